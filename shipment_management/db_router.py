@@ -0,0 +1,105 @@
+"""
+Primary/replica routing.
+
+Writes always go to the primary ('default'). Reads go to the replica only for safe (GET/HEAD) requests to the views
+listed in DATABASE_ROUTING['READ_ONLY_VIEWS'], or inside a `use_replica()` block, and only while a replica is
+configured. Everything else reads from the primary, so webhooks and other read-after-write flows always see their
+own writes:
+
+- once a request or block has written, its later reads go to the primary too;
+- after a client's unsafe request (POST, ...), its reads stay on the primary for STICKY_SECONDS, via a cookie, so
+  that a redirect to a dashboard does not show replica data that predates the change.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULTS = {
+    'REPLICA': 'replica',
+    'READ_ONLY_VIEWS': (),
+    'STICKY_SECONDS': 5,
+    'STICKY_COOKIE': 'db_primary',
+}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+def get_routing_settings():
+    """
+    Returns the DATABASE_ROUTING settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_ROUTING', {})}
+
+
+def replica_alias():
+    """
+    Returns the alias of the replica, or None when no replica is configured.
+    """
+    alias = get_routing_settings()['REPLICA']
+    return alias if alias in settings.DATABASES else None
+
+
+class RoutingState:
+    """
+    Where the reads of the current request or block go.
+    """
+    __slots__ = ('use_replica', 'wrote')
+
+    def __init__(self, use_replica=False):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+@contextmanager
+def routing(use_replica=False):
+    """
+    Starts a routing scope, e.g. for one request. Reads in it use the primary until `use_replica` is set.
+    """
+    state = RoutingState(use_replica)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def use_replica():
+    """
+    Sends the reads of the block to the replica, e.g. for a report or an export run from a management command.
+    """
+    return routing(use_replica=True)
+
+
+def use_primary():
+    """
+    Sends the reads of the block to the primary, even in a replica scope, e.g. to fill a shared cache: a value read
+    from a lagging replica right after an invalidation would be served to every client until it expires.
+    """
+    return routing(use_replica=False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Database router for settings.DATABASE_ROUTERS; see the module docstring.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is not None and state.use_replica and not state.wrote:
+            return replica_alias() or 'default'
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data, so objects read from either database may be related.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,54 @@
+"""
+Database execute wrappers scoped to the current request instead of to one connection.
+
+`connection.execute_wrapper()` only wraps the connection of the calling thread, but async views query through the
+async ORM, which runs on a connection owned by a worker thread. `scoped_execute_wrapper()` keeps the wrappers in a
+context variable, which sync_to_async carries into that thread, and every connection gets a single dispatching
+wrapper, as it connects, that runs the wrappers of the current context.
+"""
+import contextvars
+from contextlib import contextmanager
+from functools import partial
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_wrappers = contextvars.ContextVar('execute_wrappers', default=())
+
+
+def dispatch(execute, sql, params, many, context):
+    wrappers = _wrappers.get()
+    # The first wrapper installed is the outermost, as with nested connection.execute_wrapper() blocks.
+    for wrapper in reversed(wrappers):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install(connection):
+    if dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(dispatch)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    install(connection)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid='shipment_management.execute_wrappers')
+
+
+@contextmanager
+def scoped_execute_wrapper(wrapper):
+    """
+    Applies an execute wrapper to every query of the current request or task, in whichever thread it runs.
+
+    Args:
+    wrapper (callable): An execute wrapper, as for connection.execute_wrapper().
+    """
+    # Connections of this thread may have connected before this module was imported.
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+    token = _wrappers.set(_wrappers.get() + (wrapper,))
+    try:
+        yield wrapper
+    finally:
+        _wrappers.reset(token)
@@ -0,0 +1,196 @@
+"""
+Cross-node cache invalidation over Postgres LISTEN/NOTIFY.
+
+Each node keeps its own in-process caches (the local tier of shipment_management.tiered_cache), which a write on
+another node would leave stale. `publish()` sends an invalidation event on a Postgres channel with NOTIFY, and a
+listener thread on every node, started by `start_listener()` when settings.INVALIDATION_BUS['ENABLED'] is set,
+passes the events of the other nodes to the handlers registered with `subscribe()`.
+
+Postgres delivers a notification when the publishing transaction commits, and drops it on rollback, so events
+published inside `transaction.atomic()` never arrive before the data they describe. Notifications are not queued
+for a node that is not listening: the listener emits 'connected' and 'disconnected' events on its own node, so that
+caches can be emptied after a gap and fall back to short lifetimes while they cannot be told about writes.
+
+The bus needs the psycopg2 driver; on other databases `publish()` does nothing and no listener is started.
+"""
+import json
+import logging
+import select
+import threading
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DATABASE': 'default',
+    'CHANNEL': 'shipments_invalidation',
+    'LOCAL_TIMEOUT': 300,
+    'RECONNECT_DELAY': 5,
+}
+# Postgres rejects NOTIFY payloads of 8000 bytes or more.
+MAX_PAYLOAD = 7900
+POLL_INTERVAL = 1
+# Identifies this process, so that the listener skips the events it published itself.
+NODE_ID = uuid.uuid4().hex
+
+_handlers = {}
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_bus_settings():
+    """
+    Returns the INVALIDATION_BUS settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'INVALIDATION_BUS', {})}
+
+
+def subscribe(event, handler):
+    """
+    Registers `handler(message)` for the events named `event` that other nodes publish.
+    """
+    handlers = _handlers.setdefault(event, [])
+    if handler not in handlers:
+        handlers.append(handler)
+
+
+def emit(event, message):
+    """
+    Runs the handlers of an event on this node.
+    """
+    for handler in _handlers.get(event, ()):
+        try:
+            handler(message)
+        except Exception as e:
+            logger.error("Invalidation handler for %s failed: %s", event, e)
+
+
+def dispatch(payload):
+    """
+    Runs the handlers of a received notification, unless this node published it.
+    """
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        logger.warning("Ignoring malformed invalidation event: %s", payload)
+        return
+    if message.get('node') != NODE_ID:
+        emit(message.get('event'), message)
+
+
+def publish(event, **data):
+    """
+    Sends an event to the other nodes.
+
+    Args:
+    event (str): The event name, e.g. 'tags'.
+    **data: JSON-serializable event data. An event too large for NOTIFY is sent as a 'clear' event instead.
+
+    Returns:
+    bool: True if the event was sent, False if the bus is disabled, the database is not Postgres or NOTIFY failed.
+    """
+    config = get_bus_settings()
+    if not config['ENABLED']:
+        return False
+    connection = connections[config['DATABASE']]
+    if connection.vendor != 'postgresql':
+        return False
+    payload = json.dumps({'node': NODE_ID, 'event': event, **data}, separators=(',', ':'))
+    if len(payload.encode()) > MAX_PAYLOAD:
+        payload = json.dumps({'node': NODE_ID, 'event': 'clear'})
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [config['CHANNEL'], payload])
+    except DatabaseError as e:
+        logger.warning("Could not publish invalidation event %s: %s", event, e)
+        return False
+    return True
+
+
+async def apublish(event, **data):
+    """
+    Async version of `publish`.
+    """
+    return await sync_to_async(publish)(event, **data)
+
+
+class Listener(threading.Thread):
+    """
+    Listens on the bus channel on a dedicated connection and dispatches the notifications, reconnecting after
+    RECONNECT_DELAY seconds whenever the connection is lost.
+    """
+
+    def __init__(self, config):
+        super().__init__(name='invalidation-bus', daemon=True)
+        self.config = config
+        self.connected = threading.Event()
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning("Invalidation bus listener disconnected: %s", e)
+            if self.connected.is_set():
+                self.connected.clear()
+                emit('disconnected', {})
+            self._stopping.wait(self.config['RECONNECT_DELAY'])
+
+    def _listen(self):
+        wrapper = connections[self.config['DATABASE']]
+        # A connection of its own, outside Django's per-thread handling, that stays idle in LISTEN.
+        conn = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {wrapper.ops.quote_name(self.config['CHANNEL'])}")
+            self.connected.set()
+            emit('connected', {})
+            logger.info("Listening for invalidation events on %s", self.config['CHANNEL'])
+            while not self._stopping.is_set():
+                if not select.select([conn], [], [], POLL_INTERVAL)[0]:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    dispatch(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.join(timeout)
+
+
+def start_listener():
+    """
+    Starts this process's listener, once, if the bus is enabled and the database is Postgres.
+
+    Returns:
+    Listener: The running listener, or None.
+    """
+    global _listener
+    config = get_bus_settings()
+    if not config['ENABLED'] or connections[config['DATABASE']].vendor != 'postgresql':
+        return None
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = Listener(config)
+            _listener.start()
+    return _listener
+
+
+def stop_listener(timeout=None):
+    """
+    Stops the listener started by `start_listener()`, if any.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop(timeout)
+            _listener = None
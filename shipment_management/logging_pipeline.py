@@ -0,0 +1,148 @@
+"""
+Non-blocking, structured logging.
+
+Request threads only put log records on a queue. A QueueListener thread formats them and writes them to the real
+handlers (console, rotating file), so neither message formatting nor file I/O happens on the hot path. Records keep
+their %-style arguments until the listener formats them, and payload dumps are serialized there too, capped in size
+and sampled.
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+# Attributes every LogRecord has; anything else on a record was passed through `extra`.
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def get_handler_by_name(name):
+    # logging.getHandlerByName() only exists from Python 3.12; dictConfig registers handlers in logging._handlers.
+    getter = getattr(logging, 'getHandlerByName', None)
+    return getter(name) if getter else logging._handlers[name]
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, including any `extra` fields.
+    """
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Queues records for a background QueueListener that feeds the named handlers.
+
+    The target handlers are looked up by name on the first record, once dictConfig has created all of them, and the
+    listener is stopped (and the queue drained) at interpreter exit.
+
+    Args:
+    handlers (list): The names of the handlers, as configured in LOGGING, that the listener writes to.
+    maxsize (int): The queue capacity; 0 means unbounded. When the queue is full, records are dropped and counted
+    in `dropped` rather than blocking the request.
+    """
+
+    def __init__(self, handlers, maxsize=0):
+        super().__init__(queue.Queue(maxsize))
+        self.handler_names = handlers
+        self.listener = None
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.listener is None:
+                targets = [get_handler_by_name(name) for name in self.handler_names]
+                self.listener = QueueListener(self.queue, *targets, respect_handler_level=True)
+                self.listener.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        with self._lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def emit(self, record):
+        if self.listener is None:
+            self.start()
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """
+        Leaves the message unformatted so that the listener does the work. Only the traceback is rendered here,
+        because it refers to frames that are gone by the time the listener runs.
+        """
+        record = copy.copy(record)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class Payload:
+    """
+    A log argument that serializes a payload as compact JSON only when the record is formatted, truncated to
+    `max_chars`.
+    """
+    __slots__ = ('value', 'max_chars')
+
+    def __init__(self, value, max_chars):
+        # A shallow copy, so that later changes to the top-level keys do not leak into the logged payload.
+        self.value = dict(value) if isinstance(value, dict) else value
+        self.max_chars = max_chars
+
+    def __str__(self):
+        text = json.dumps(self.value, ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... [truncated {len(text) - self.max_chars} chars]"
+        return text
+
+
+def log_payload(logger, message, payload, level=logging.INFO):
+    """
+    Logs a payload dump, sampled and size-capped according to settings.LOG_PAYLOADS.
+
+    Args:
+    logger (Logger): The logger to write to.
+    message (str): The message; the payload is appended after a newline.
+    payload: Any JSON-serializable value.
+    level (int): The log level.
+    """
+    config = getattr(settings, 'LOG_PAYLOADS', {})
+    if not logger.isEnabledFor(level) or random.random() >= config.get('SAMPLE_RATE', 1.0):
+        return
+    logger.log(level, '%s\n%s', message, Payload(payload, config.get('MAX_CHARS', 4096)))
@@ -0,0 +1,394 @@
+import hmac
+import logging
+import os
+import random
+import time
+from contextlib import nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.middleware.gzip import GZipMiddleware
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from shipments.metrics import REQUEST_LATENCY
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .db_router import SAFE_METHODS, get_routing_settings, replica_alias, routing
+from .execute_wrappers import scoped_execute_wrapper
+from .profiling import FORMATS, SamplingProfiler, get_profiling_settings
+from .query_budget import QueryRecorder, get_budget_settings, get_view_budget
+from .tracing import (
+    NOOP_SPAN, db_span_wrapper, get_correlation_id, get_tracing_settings, parse_traceparent, start_trace,
+    valid_correlation_id,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that supports both WSGI and ASGI.
+
+    Under ASGI, Django only keeps a request on the event loop if every middleware is async-capable; a single sync-only
+    middleware would move each request to a thread and back. Subclasses implement `handle` for sync requests and
+    `__acall__` for async ones.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    """
+    Records the queries of each request and flags views that exceed their SQL budget.
+
+    The number of queries, total DB time and repeated query fingerprints are collected for every request. When a
+    view goes over the MAX_QUERIES or MAX_DB_TIME_MS budget configured in settings.QUERY_BUDGET (optionally per URL
+    name under 'VIEWS'), or repeats one statement N_PLUS_ONE_THRESHOLD times or more, a warning is logged. With
+    'HEADERS' enabled the measurements are also attached to the response as X-DB-* headers.
+    """
+
+    def handle(self, request):
+        config = get_budget_settings()
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with recorder.installed():
+            response = self.get_response(request)
+        return self.check_budget(request, response, recorder, config)
+
+    async def __acall__(self, request):
+        config = get_budget_settings()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        with recorder.installed():
+            response = await self.get_response(request)
+        return self.check_budget(request, response, recorder, config)
+
+    @staticmethod
+    def check_budget(request, response, recorder, config):
+        view_name = request.resolver_match.view_name if request.resolver_match else request.path
+        max_queries, max_db_time_ms = get_view_budget(view_name)
+        repeated = recorder.repeated(config['N_PLUS_ONE_THRESHOLD'])
+
+        exceeded = []
+        if recorder.count > max_queries:
+            exceeded.append('queries')
+        if recorder.duration_ms > max_db_time_ms:
+            exceeded.append('time')
+        if repeated:
+            exceeded.append('n+1')
+
+        if exceeded:
+            logger.warning(
+                f"SQL budget exceeded for {view_name} ({', '.join(exceeded)}): {recorder.count} queries "
+                f"(budget {max_queries}), {recorder.duration_ms} ms (budget {max_db_time_ms} ms)"
+                + ''.join(f"\n  repeated {count}x: {sql}" for sql, count in repeated[:5])
+            )
+
+        if config['HEADERS']:
+            response['X-DB-Query-Count'] = str(recorder.count)
+            response['X-DB-Time-Ms'] = str(recorder.duration_ms)
+            if exceeded:
+                response['X-DB-Budget-Exceeded'] = ','.join(exceeded)
+            if repeated:
+                response['X-DB-Repeated-Queries'] = str(sum(count for _, count in repeated))
+        return response
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Records the latency of every request in a histogram labelled with the URL name, method and status code.
+
+    Requests that do not resolve to a view are labelled '<unresolved>' so that scanners cannot create a series per
+    path.
+    """
+
+    def handle(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    @staticmethod
+    def observe(request, response, start):
+        view_name = request.resolver_match.view_name if request.resolver_match else '<unresolved>'
+        REQUEST_LATENCY.labels(view_name, request.method, str(response.status_code)).observe(time.perf_counter() - start)
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Runs the sampling profiler on selected requests and writes a flame-graph profile per request.
+
+    A request is profiled when PROFILING['ENABLED'] is on and either:
+    - a staff user sends the X-Profile header or the ?profile= query parameter,
+    - the X-Profile-Token header matches PROFILING['TOKEN'] (for clients without a session, e.g. a replayed
+      webhook), or
+    - it is picked by PROFILING['SAMPLE_RATE'].
+
+    The header or parameter value may name the output format ('collapsed' or 'speedscope'); otherwise
+    PROFILING['FORMAT'] is used. The file name is returned in the X-Profile-File header. Must come after
+    AuthenticationMiddleware. Under ASGI the event-loop thread is sampled, so work that async views hand to other
+    threads, such as ORM queries and PDF rendering, appears as time spent waiting.
+    """
+
+    def handle(self, request):
+        config = get_profiling_settings()
+        fmt = self.requested_format(request, config) if config['ENABLED'] else None
+        if fmt is None:
+            return self.get_response(request)
+
+        profiler = SamplingProfiler(interval=config['INTERVAL_MS'] / 1000)
+        with profiler:
+            response = self.get_response(request)
+        return self.write_profile(request, response, profiler, config, fmt)
+
+    async def __acall__(self, request):
+        config = get_profiling_settings()
+        fmt = self.requested_format(request, config) if config['ENABLED'] else None
+        if fmt is None:
+            return await self.get_response(request)
+
+        profiler = SamplingProfiler(interval=config['INTERVAL_MS'] / 1000)
+        with profiler:
+            response = await self.get_response(request)
+        return self.write_profile(request, response, profiler, config, fmt)
+
+    @staticmethod
+    def write_profile(request, response, profiler, config, fmt):
+        view_name = request.resolver_match.view_name if request.resolver_match else request.path
+        try:
+            path = profiler.write(config['OUTPUT_DIR'], view_name, fmt)
+        except OSError as e:
+            logger.error(f"Error writing profile for {view_name}: {str(e)}")
+            return response
+        logger.info(f"Profiled {request.method} {request.path} ({view_name}): {sum(profiler.samples.values())} samples "
+                    f"over {profiler.duration * 1000:.1f} ms written to {path}")
+        response['X-Profile-File'] = os.path.basename(path)
+        return response
+
+    @staticmethod
+    def requested_format(request, config):
+        """
+        Returns the profile format to write for this request, or None if it should not be profiled.
+        """
+        requested = request.headers.get(config['HEADER']) or request.GET.get(config['QUERY_PARAM'])
+        token = request.headers.get('X-Profile-Token')
+        user = getattr(request, 'user', None)
+        authorized = (
+            (user is not None and user.is_active and user.is_staff)
+            or bool(config['TOKEN'] and token and hmac.compare_digest(token, config['TOKEN']))
+        )
+        if (requested or token) and authorized:
+            return requested if requested in FORMATS else config['FORMAT']
+        if config['SAMPLE_RATE'] and random.random() < config['SAMPLE_RATE']:
+            return config['FORMAT']
+        return None
+
+
+class TracingMiddleware(HybridMiddleware):
+    """
+    Gives every request a correlation id and, when TRACING is enabled and the request is sampled, a root span.
+
+    The correlation id comes from an incoming X-Correlation-ID header, the trace id of a W3C traceparent header, or
+    is generated, and is returned in the X-Correlation-ID response header. SQL queries of traced requests are
+    recorded as 'db.query' spans unless TRACING['DB_SPANS'] is off.
+    """
+
+    def handle(self, request):
+        with self.start_trace(request) as root:
+            correlation_id = get_correlation_id()
+            with self.db_spans(root):
+                response = self.get_response(request)
+            self.finish(request, response, root)
+        response['X-Correlation-ID'] = correlation_id
+        return response
+
+    async def __acall__(self, request):
+        with self.start_trace(request) as root:
+            correlation_id = get_correlation_id()
+            with self.db_spans(root):
+                response = await self.get_response(request)
+            self.finish(request, response, root)
+        response['X-Correlation-ID'] = correlation_id
+        return response
+
+    @staticmethod
+    def start_trace(request):
+        correlation_id = valid_correlation_id(request.headers.get('X-Correlation-ID'))
+        parent = parse_traceparent(request.headers.get('traceparent'))
+        attributes = {'http.method': request.method, 'http.target': request.path}
+        return start_trace(f'{request.method} {request.path}', correlation_id, parent, **attributes)
+
+    @staticmethod
+    def db_spans(root):
+        if root is not NOOP_SPAN and get_tracing_settings()['DB_SPANS']:
+            return scoped_execute_wrapper(db_span_wrapper)
+        return nullcontext()
+
+    @staticmethod
+    def finish(request, response, root):
+        if root is NOOP_SPAN:
+            return
+        if request.resolver_match:
+            root.name = f'{request.method} {request.resolver_match.view_name}'
+            root.set_attribute('http.route', request.resolver_match.view_name)
+        root.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            root.status = 'error'
+
+
+class DatabaseRoutingMiddleware(HybridMiddleware):
+    """
+    Sends the reads of safe requests to the views in DATABASE_ROUTING['READ_ONLY_VIEWS'] to the replica, and keeps a
+    client on the primary for STICKY_SECONDS after it changed something; see shipment_management.db_router.
+
+    The view is resolved up front, so that the session and user lookups of those requests use the replica as well.
+    """
+
+    def handle(self, request):
+        with routing(self.reads_from_replica(request)):
+            response = self.get_response(request)
+        return self.pin_to_primary(request, response)
+
+    async def __acall__(self, request):
+        with routing(self.reads_from_replica(request)):
+            response = await self.get_response(request)
+        return self.pin_to_primary(request, response)
+
+    @staticmethod
+    def reads_from_replica(request):
+        config = get_routing_settings()
+        if (request.method not in SAFE_METHODS or replica_alias() is None
+                or request.COOKIES.get(config['STICKY_COOKIE'])):
+            return False
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return False
+        return match.view_name in config['READ_ONLY_VIEWS']
+
+    @staticmethod
+    def pin_to_primary(request, response):
+        config = get_routing_settings()
+        if request.method not in SAFE_METHODS and config['STICKY_SECONDS'] and replica_alias() is not None:
+            response.set_cookie(config['STICKY_COOKIE'], '1', max_age=config['STICKY_SECONDS'], httponly=True,
+                                samesite='Lax')
+        return response
+
+
+class StaticFilesMiddleware(HybridMiddleware):
+    """
+    Serves static files with WhiteNoise, whose own middleware is sync-only.
+
+    Files are looked up in the index WhiteNoise builds of STATIC_ROOT at start-up, so answering a static request
+    costs a dictionary lookup and never reaches the views or the middleware below this one.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.whitenoise = WhiteNoiseMiddleware(get_response)
+
+    def handle(self, request):
+        return self.static_response(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.static_response(request) or await self.get_response(request)
+
+    def static_response(self, request):
+        whitenoise = self.whitenoise
+        if whitenoise.autorefresh:
+            static_file = whitenoise.find_file(request.path_info)
+        else:
+            static_file = whitenoise.files.get(request.path_info)
+        return whitenoise.serve(static_file, request) if static_file is not None else None
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """
+    Compresses responses with Brotli when the client accepts it and the brotli package is installed, and with gzip
+    otherwise, as django.middleware.gzip.GZipMiddleware does.
+
+    Brotli is only used for complete responses; streaming responses are gzipped. Static files never reach this
+    middleware: WhiteNoise serves the variants that collectstatic precompressed.
+    """
+    min_length = 200
+    # Levels above 5 cost much more CPU per response for a few percent smaller pages.
+    brotli_quality = 5
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.gzip = GZipMiddleware(get_response)
+
+    def handle(self, request):
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response  # each event must reach the client as soon as it is written
+        if (response.streaming or not accepts_encoding(request, 'br') or len(response.content) < self.min_length
+                or response.has_header('Content-Encoding')):
+            return self.gzip.process_response(request, response)
+        brotli = load_brotli()
+        if brotli is None:
+            return self.gzip.process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=self.brotli_quality)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+def accepts_encoding(request, coding):
+    """
+    Returns whether the Accept-Encoding header of a request accepts a content coding with a non-zero q-value.
+    """
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() != coding:
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def load_brotli():
+    # brotli is optional: without it, responses are gzipped.
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
@@ -0,0 +1,164 @@
+"""
+Low-overhead sampling profiler for live requests.
+
+A background thread periodically captures the stack of the thread serving the request through
+sys._current_frames(). Nothing is traced between samples, so the profiled code runs at close to full speed. The
+samples are written as collapsed stacks (for flamegraph.pl, speedscope or inferno) or as speedscope JSON.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': False,
+    'OUTPUT_DIR': 'profiles',
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL_MS': 5,
+    'FORMAT': 'collapsed',
+    'TOKEN': None,
+    'HEADER': 'X-Profile',
+    'QUERY_PARAM': 'profile',
+}
+FORMATS = ('collapsed', 'speedscope')
+EXTENSIONS = {'collapsed': '.folded', 'speedscope': '.speedscope.json'}
+
+
+def get_profiling_settings():
+    """
+    Returns the PROFILING settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed interval.
+
+    Args:
+    interval (float): Seconds between samples.
+    thread_id (int, optional): The thread to sample. Defaults to the thread that calls start().
+
+    Example:
+    >>> with SamplingProfiler(interval=0.005) as profiler:
+    ...     generate_pdf_label(request, 42)
+    >>> profiler.write('/tmp/profiles', 'label', 'speedscope')
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = Counter()
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._started_at
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[self._stack(frame)] += 1
+
+    @staticmethod
+    def _stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    @staticmethod
+    def _frame_name(name, filename, line):
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def collapsed(self):
+        """
+        Returns the samples as collapsed stacks: one `root;...;leaf count` line per distinct stack.
+        """
+        return ''.join(
+            ';'.join(self._frame_name(*frame) for frame in stack) + f' {count}\n'
+            for stack, count in self.samples.most_common()
+        )
+
+    def speedscope(self, name):
+        """
+        Returns the samples as a speedscope 'sampled' profile, weighted in milliseconds.
+        """
+        frames = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(round(count * self.interval * 1000, 3))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'shipment_management.profiling',
+            'activeProfileIndex': 0,
+            'shared': {'frames': [{'name': frame_name, 'file': filename, 'line': line}
+                                  for frame_name, filename, line in frames]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+    def write(self, directory, name, fmt='collapsed'):
+        """
+        Writes the profile to `directory` and returns the path of the file.
+
+        Args:
+        directory (str): The output directory, created if missing.
+        name (str): Identifies the profile, e.g. the view name. It is part of the file name.
+        fmt (str): 'collapsed' or 'speedscope'.
+
+        Raises:
+        ValueError: If the format is unknown.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown profile format: {fmt}")
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'request'
+        filename = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{slug}-{os.getpid()}{EXTENSIONS[fmt]}"
+        path = os.path.join(directory, filename)
+        with open(path, 'w', encoding='utf-8') as handle:
+            if fmt == 'speedscope':
+                json.dump(self.speedscope(name), handle)
+            else:
+                handle.write(self.collapsed())
+        return path
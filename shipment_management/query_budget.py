@@ -0,0 +1,132 @@
+"""
+Per-request SQL accounting.
+
+A QueryRecorder is installed as an execute wrapper for the queries of the current request, on whichever connection
+and thread they run (see shipment_management.execute_wrappers). It counts queries, sums their
+time and groups them by fingerprint (the SQL with literals and IN-lists normalized), so that the same statement
+repeated once per row - the classic N+1 pattern - stands out.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .execute_wrappers import scoped_execute_wrapper
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_QUERIES': 50,
+    'MAX_DB_TIME_MS': 500,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'HEADERS': False,
+    'VIEWS': {},
+}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?|\d+)\s*,?)+\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def get_budget_settings():
+    """
+    Returns the QUERY_BUDGET settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'QUERY_BUDGET', {})}
+
+
+def get_view_budget(view_name):
+    """
+    Returns the (max queries, max DB time in ms) budget of a view, falling back to the global budget.
+
+    Args:
+    view_name (str): The namespaced URL name, e.g. 'shipments:home'.
+    """
+    config = get_budget_settings()
+    view = config['VIEWS'].get(view_name, {})
+    return view.get('MAX_QUERIES', config['MAX_QUERIES']), view.get('MAX_DB_TIME_MS', config['MAX_DB_TIME_MS'])
+
+
+def fingerprint(sql):
+    """
+    Normalizes a SQL statement so that executions differing only in their parameters compare equal.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper that records the number, duration and fingerprints of queries.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+    def repeated(self, threshold):
+        """
+        Returns the (fingerprint, count) pairs executed at least `threshold` times, most repeated first.
+        """
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+    @contextmanager
+    def installed(self):
+        """
+        Records the queries of the current request or task, on every database, for the duration of the block.
+        """
+        with scoped_execute_wrapper(self):
+            yield self
+
+
+@contextmanager
+def assert_query_budget(max_queries=None, view_name=None, n_plus_one_threshold=None):
+    """
+    Asserts that the block stays within a query budget and executes no N+1 pattern.
+
+    Args:
+    max_queries (int, optional): The maximum number of queries. Defaults to the budget of `view_name`.
+    view_name (str, optional): A namespaced URL name whose configured QUERY_BUDGET applies.
+    n_plus_one_threshold (int, optional): How often one fingerprint may repeat. Defaults to N_PLUS_ONE_THRESHOLD.
+
+    Raises:
+    AssertionError: If the budget is exceeded or a statement repeats too often. The message lists the worst
+    offending fingerprints.
+
+    Example:
+    >>> with assert_query_budget(view_name='shipments:home'):
+    ...     client.get(reverse('shipments:home'))
+    """
+    if max_queries is None:
+        max_queries, _ = get_view_budget(view_name)
+    if n_plus_one_threshold is None:
+        n_plus_one_threshold = get_budget_settings()['N_PLUS_ONE_THRESHOLD']
+
+    recorder = QueryRecorder()
+    with recorder.installed():
+        yield recorder
+
+    problems = []
+    if recorder.count > max_queries:
+        problems.append(f"{recorder.count} queries executed, budget is {max_queries}")
+    for sql, count in recorder.repeated(n_plus_one_threshold):
+        problems.append(f"N+1: {count} x {sql}")
+    assert not problems, '\n'.join(problems)
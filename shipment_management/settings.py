@@ -43,6 +43,8 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # Lets WhiteNoise serve static files under runserver too, as in production.
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
     'shipments.apps.ShipmentsConfig',
     'pytest_django',
@@ -50,13 +52,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shipment_management.middleware.TracingMiddleware',
+    'shipment_management.middleware.MetricsMiddleware',
+    'shipment_management.middleware.DatabaseRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'shipment_management.middleware.StaticFilesMiddleware',
+    'shipment_management.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'shipment_management.middleware.ProfilingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shipment_management.middleware.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'shipment_management.urls'
@@ -83,7 +92,10 @@ WSGI_APPLICATION = 'shipment_management.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-# Database
+# Connections are kept open for DB_CONN_MAX_AGE seconds and checked before reuse, instead of connecting on every
+# request. Under ASGI, where connections are not reused across requests, put PgBouncer in front and set it to 0.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -92,7 +104,93 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('POSTGRES_HOST', 'db'),
         'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Optional streaming replica for read-only views, see shipment_management.db_router.
+if os.getenv('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('POSTGRES_REPLICA_HOST'),
+        'PORT': os.getenv('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['shipment_management.db_router.PrimaryReplicaRouter']
+DATABASE_ROUTING = {
+    'REPLICA': 'replica',
+    'READ_ONLY_VIEWS': (
+        'shipments:home',
+        'shipments:shipment_detail',
+        'shipments:search_shipments',
+        'shipments:analytics_data',
+        'shipments:archived_shipment',
+    ),
+    'STICKY_SECONDS': int(os.getenv('DB_STICKY_SECONDS', '5')),
+}
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The shared tier of shipment_management.tiered_cache: a file cache by default, the database ('db', after
+# `manage.py createcachetable`) or Redis ('redis', needs the redis package).
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'file')
+if CACHE_BACKEND == 'redis':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                          'LOCATION': os.getenv('REDIS_URL', 'redis://redis:6379/0')}}
+elif CACHE_BACKEND == 'db':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                          'LOCATION': 'shipments_cache'}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                          'LOCATION': os.getenv('CACHE_DIR', '/app/cache'),
+                          'OPTIONS': {'MAX_ENTRIES': 10000}}}
+
+# In-process LRU in front of CACHES[ALIAS], see shipment_management.tiered_cache. Other workers see an invalidation
+# after at most LOCAL_TIMEOUT seconds.
+TIERED_CACHE = {
+    'ENABLED': os.getenv('TIERED_CACHE_ENABLED', 'True') == 'True',
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAX_ENTRIES': 1000,
+    'LOCAL_TIMEOUT': 5,
+}
+
+# Cross-node cache invalidation over Postgres LISTEN/NOTIFY, see shipment_management.invalidation_bus. While a node
+# listens, its local cache entries live for LOCAL_TIMEOUT seconds instead of TIERED_CACHE['LOCAL_TIMEOUT'].
+INVALIDATION_BUS = {
+    'ENABLED': os.getenv('INVALIDATION_BUS_ENABLED', 'False') == 'True',
+    'DATABASE': 'default',
+    'CHANNEL': 'shipments_invalidation',
+    'LOCAL_TIMEOUT': int(os.getenv('INVALIDATION_BUS_LOCAL_TIMEOUT', '300')),
+}
+
+# Admission control of inbound webhooks, see shipments.services.throttle_service. Each merchant may send BURST
+# webhooks at once and RATE per second after that; each worker handles at most MAX_IN_FLIGHT webhooks at a time.
+# Buckets are kept in the cache when it is Redis, else in the database.
+WEBHOOK_LIMITS = {
+    'ENABLED': os.getenv('WEBHOOK_LIMITS_ENABLED', 'True') == 'True',
+    'BACKEND': os.getenv('WEBHOOK_LIMITS_BACKEND', 'cache' if CACHE_BACKEND == 'redis' else 'database'),
+    'ALIAS': 'default',
+    'RATE': float(os.getenv('WEBHOOK_MERCHANT_RATE', '20')),
+    'BURST': int(os.getenv('WEBHOOK_MERCHANT_BURST', '200')),
+    'MAX_IN_FLIGHT': int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '32')),
+    'OVERLOAD_RETRY_AFTER': 5,
+}
+
+# Journal of raw webhook bodies, see shipments.services.journal_service and `manage.py replay_webhooks`.
+WEBHOOK_JOURNAL = {
+    'ENABLED': os.getenv('WEBHOOK_JOURNAL_ENABLED', 'True') == 'True',
+    'LEVEL': 6,
+}
+
+# Bulk status updates from the dashboard, the admin and `manage.py bulk_update_status`, see
+# shipments.services.bulk_status_service.
+BULK_STATUS_UPDATES = {
+    'MAX_SHIPMENTS': int(os.getenv('BULK_STATUS_MAX_SHIPMENTS', 5000)),
+    'BATCH_SIZE': 1000,
+    'SALLA_CONCURRENCY': int(os.getenv('BULK_STATUS_SALLA_CONCURRENCY', 10)),
 }
 
 # Password validation
@@ -132,10 +230,84 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
-STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
+# collectstatic writes content-hashed copies of every file with gzip and Brotli variants next to them. WhiteNoise
+# serves the variant the client accepts, and the hashed names with a far-future, immutable Cache-Control.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+WHITENOISE_KEEP_ONLY_HASHED_FILES = True
 
 APPEND_SLASH = True
 
+# Bearer token required to scrape /metrics; the endpoint is open when unset.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# On-demand sampling profiler, see shipment_management.middleware.ProfilingMiddleware.
+PROFILING = {
+    'ENABLED': os.getenv('PROFILING_ENABLED', 'False') == 'True',
+    'OUTPUT_DIR': os.getenv('PROFILING_OUTPUT_DIR', '/app/logs/profiles'),
+    'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', '0') or 0),
+    'INTERVAL_MS': 5,
+    'FORMAT': os.getenv('PROFILING_FORMAT', 'collapsed'),
+    'TOKEN': os.getenv('PROFILING_TOKEN'),
+}
+
+# Request tracing, see shipment_management.tracing. EXPORTER is 'file' (JSON lines), 'otlp' (OTLP/HTTP JSON to
+# OTLP_ENDPOINT, e.g. an OpenTelemetry Collector or Jaeger) or None.
+TRACING = {
+    'ENABLED': os.getenv('TRACING_ENABLED', 'False') == 'True',
+    'SAMPLE_RATE': float(os.getenv('TRACING_SAMPLE_RATE', '1.0')),
+    'EXPORTER': os.getenv('TRACING_EXPORTER', 'file'),
+    'FILE_PATH': os.getenv('TRACING_FILE_PATH', '/app/logs/traces.jsonl'),
+    'OTLP_ENDPOINT': os.getenv('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT', 'http://localhost:4318/v1/traces'),
+    'SERVICE_NAME': os.getenv('OTEL_SERVICE_NAME', 'shipments'),
+    'DB_SPANS': True,
+}
+
+# Async versions of the webhook, label and shipment detail views, for workers served over ASGI
+# (shipment_management.asgi). Label PDFs are then rendered in a pool of PDF_WORKERS threads or processes.
+ASYNC_VIEWS = {
+    'ENABLED': os.getenv('ASYNC_VIEWS', 'False') == 'True',
+    'PDF_EXECUTOR': os.getenv('PDF_EXECUTOR', 'thread'),
+    'PDF_WORKERS': int(os.getenv('PDF_WORKERS', '4')),
+}
+
+# Live dashboard updates over server-sent events, see shipments.live. The event stream is served by the ASGI app
+# only; with several nodes, events reach the other nodes over INVALIDATION_BUS.
+LIVE_UPDATES = {
+    'ENABLED': os.getenv('LIVE_UPDATES', os.getenv('ASYNC_VIEWS', 'False')) == 'True',
+    'HEARTBEAT': 15,
+    'QUEUE_SIZE': 100,
+    'REPLAY': 200,
+}
+
+# Start-up warmup of label rendering, see shipments.warmup. With BLOCKING, a worker only accepts requests once the
+# warmup has finished or TIMEOUT seconds have passed.
+WARMUP = {
+    'ENABLED': os.getenv('WARMUP_ON_START', 'False') == 'True',
+    'BLOCKING': os.getenv('WARMUP_BLOCKING', 'False') == 'True',
+    'TIMEOUT': float(os.getenv('WARMUP_TIMEOUT', '30')),
+    'STEPS': ('templates', 'fonts', 'database', 'label'),
+}
+
+# SQL budget per request, see shipment_management.middleware.QueryBudgetMiddleware.
+# Views are keyed by their namespaced URL name; views without an entry get the global budget.
+QUERY_BUDGET = {
+    'ENABLED': os.getenv('QUERY_BUDGET_ENABLED', 'True') == 'True',
+    'MAX_QUERIES': 50,
+    'MAX_DB_TIME_MS': 500,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'HEADERS': DEBUG,
+    'VIEWS': {
+        # Three of them load the session, the user and the user's merchant.
+        'shipments:home': {'MAX_QUERIES': 8},
+        'shipments:shipment_detail': {'MAX_QUERIES': 10},
+        'shipments:generate_pdf_label': {'MAX_QUERIES': 5},
+        'shipments:shipment_webhook': {'MAX_QUERIES': 20},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -171,6 +343,14 @@ TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
+# Payload dumps in the logs (webhook bodies and parsed shipments): the fraction that is logged and the size cap.
+LOG_PAYLOADS = {
+    'SAMPLE_RATE': float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '1.0' if DEBUG else '0.05')),
+    'MAX_CHARS': int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '4096')),
+}
+
+# Loggers write to the 'queue' handler only; a background QueueListener formats the records and feeds the console
+# and file handlers, so request threads never wait on formatting or disk I/O.
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -183,11 +363,19 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'shipment_management.logging_pipeline.JsonFormatter',
+        },
+    },
+    'filters': {
+        'correlation_id': {
+            '()': 'shipment_management.tracing.CorrelationIdFilter',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'formatter': os.getenv('LOG_CONSOLE_FORMAT', 'verbose'),
         },
         'file': {
             'level': 'DEBUG',
@@ -195,34 +383,45 @@ LOGGING = {
             'filename': '/app/logs/django_debug.log',
             'when': 'midnight',
             'backupCount': 21,
-            'formatter': 'verbose',
+            'formatter': 'json',
+        },
+        'queue': {
+            '()': 'shipment_management.logging_pipeline.QueueListenerHandler',
+            'handlers': ['console', 'file'],
+            'maxsize': 10000,
+            'filters': ['correlation_id'],
         },
     },
     'root': {
-        'handlers': ['console', 'file'],
+        'handlers': ['queue'],
         'level': 'INFO',
     },
     'loggers': {
         'django': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
-            'propagate': True,
+            'propagate': False,
         },
         'shipments': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False,
         },
         'weasyprint': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'WARNING',  # Adjust to filter out detailed logs
             'propagate': False,
         },
         'fontTools': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'WARNING',  # Add this to reduce font-related log verbosity
             'propagate': False,
         },
+        'httpx': {
+            'handlers': ['queue'],
+            'level': 'WARNING',  # Trace exports would otherwise log every request
+            'propagate': False,
+        },
     },
 }
 # Add this line to silence third-party library logs
@@ -0,0 +1,416 @@
+"""
+Two-tier cache with tag-based invalidation.
+
+Values are stored in a shared Django cache (settings.TIERED_CACHE['ALIAS']: file, database or Redis) and kept in a
+small in-process LRU in front of it, so repeated reads in a worker cost a dictionary lookup.
+
+Every entry is stored with tags, e.g. 'shipment:42' or 'merchant:7'. Each tag has a version in the shared cache;
+`invalidate_tags()` bumps the versions, and a shared entry whose tag versions are out of date is treated as a miss.
+The local tier is dropped for those tags at once in the invalidating process, while other processes keep serving
+their local copy for at most LOCAL_TIMEOUT seconds.
+
+With settings.INVALIDATION_BUS enabled, invalidations are also published on shipment_management.invalidation_bus,
+and every node drops its local copies as soon as it receives them. While the bus listener is connected, local
+entries then live for INVALIDATION_BUS['LOCAL_TIMEOUT'] seconds instead, and nodes whose shared tier is a cache of
+their own, such as the file cache, stay consistent too. Values kept with `set_local()`, like access tokens, never
+leave the process.
+
+Values are computed on the primary database, also in views routed to the replica (see
+shipment_management.db_router), so that a refill right after an invalidation never caches the replica's older copy.
+
+The cache fails open: when the shared tier cannot be read or written, e.g. an unwritable cache directory or Redis
+being down, the error is logged and the value is computed as if it were not cached.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import invalidation_bus
+from .db_router import use_primary
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAX_ENTRIES': 1000,
+    'LOCAL_TIMEOUT': 5,
+    'KEY_PREFIX': 'tc',
+}
+_MISSING = object()
+
+
+def get_cache_settings():
+    """
+    Returns the TIERED_CACHE settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'TIERED_CACHE', {})}
+
+
+class LocalLRU:
+    """
+    A thread-safe, size-bounded LRU of tagged values that expire after `timeout` seconds.
+    """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so that a value read before one is not stored after it.
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value, _ = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags, generation=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.timeout, value, frozenset(tags))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def drop_tags(self, tags):
+        tags = set(tags)
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, (_, _, entry_tags) in self._entries.items() if entry_tags & tags]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache:
+    """
+    A local LRU in front of a shared Django cache, with tag-based invalidation; see the module docstring.
+
+    Example:
+    >>> cache = get_tiered_cache()
+    >>> counts = cache.get_or_set('home:status_counts', compute_counts, tags=['shipments'])
+    >>> cache.invalidate_tags('shipments')
+    """
+
+    def __init__(self, alias='default', timeout=300, local_max_entries=1000, local_timeout=5, key_prefix='tc',
+                 enabled=True):
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.enabled = enabled
+        self.local = LocalLRU(local_max_entries, local_timeout)
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _key(self, key):
+        return f'{self.key_prefix}:v:{key}'
+
+    def _tag_key(self, tag):
+        return f'{self.key_prefix}:t:{tag}'
+
+    def _shared_failed(self, operation, error):
+        logger.warning("Shared cache %s failed, continuing without it: %s", operation, error)
+
+    def _unavailable_versions(self, tags, create):
+        # Versions that match no stored entry and no earlier validator, so nothing stale is served.
+        return {tag: time.time_ns() for tag in tags} if create else {}
+
+    def _tag_versions(self, tags, create=False):
+        """
+        Returns the current version of each tag. With `create`, missing tags get a fresh version; versions are
+        timestamps, so a tag that was evicted never comes back with a version an old entry still carries.
+        """
+        keys = {self._tag_key(tag): tag for tag in tags}
+        if not keys:
+            return {}
+        try:
+            found = self.shared.get_many(keys)
+            missing = {key: time.time_ns() for key in keys if key not in found} if create else {}
+            if missing:
+                self.shared.set_many(missing, None)
+        except Exception as e:
+            self._shared_failed('tag lookup', e)
+            return self._unavailable_versions(tags, create)
+        return {keys[key]: version for key, version in {**found, **missing}.items()}
+
+    async def _atag_versions(self, tags, create=False):
+        keys = {self._tag_key(tag): tag for tag in tags}
+        if not keys:
+            return {}
+        try:
+            found = await self.shared.aget_many(keys)
+            missing = {key: time.time_ns() for key in keys if key not in found} if create else {}
+            if missing:
+                await self.shared.aset_many(missing, None)
+        except Exception as e:
+            self._shared_failed('tag lookup', e)
+            return self._unavailable_versions(tags, create)
+        return {keys[key]: version for key, version in {**found, **missing}.items()}
+
+    def tag_versions(self, *tags):
+        """
+        Returns the current versions of `tags`, which change whenever one of them is invalidated, e.g. to derive an
+        HTTP validator for a page cached under these tags.
+        """
+        return self._tag_versions(tags, create=True)
+
+    async def atag_versions(self, *tags):
+        return await self._atag_versions(tags, create=True)
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return value
+        generation = self.local.generation
+        try:
+            entry = self.shared.get(self._key(key))
+        except Exception as e:
+            self._shared_failed('get', e)
+            return default
+        if entry is None:
+            return default
+        value, tag_versions = entry
+        if tag_versions and self._tag_versions(tag_versions) != tag_versions:
+            return default
+        self.local.set(key, value, tag_versions, generation)
+        return value
+
+    async def aget(self, key, default=None):
+        if not self.enabled:
+            return default
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return value
+        generation = self.local.generation
+        try:
+            entry = await self.shared.aget(self._key(key))
+        except Exception as e:
+            self._shared_failed('get', e)
+            return default
+        if entry is None:
+            return default
+        value, tag_versions = entry
+        if tag_versions and await self._atag_versions(tag_versions) != tag_versions:
+            return default
+        self.local.set(key, value, tag_versions, generation)
+        return value
+
+    def set(self, key, value, timeout=None, tags=()):
+        """
+        Stores `value` under `key` in both tiers.
+
+        Args:
+        key (str): The cache key.
+        value: Any picklable value.
+        timeout (int, optional): Seconds to keep the value in the shared tier. Defaults to TIMEOUT.
+        tags (iterable): Tags whose invalidation drops the value.
+        """
+        if self.enabled:
+            self._store(key, value, timeout, self._tag_versions(tags, create=True))
+
+    def _store(self, key, value, timeout, tag_versions, generation=None):
+        try:
+            self.shared.set(self._key(key), (value, tag_versions), self.timeout if timeout is None else timeout)
+        except Exception as e:
+            self._shared_failed('set', e)
+            return
+        self.local.set(key, value, tag_versions, generation)
+
+    def get_local(self, key, default=None):
+        """
+        Returns a value stored with `set_local`.
+        """
+        if not self.enabled:
+            return default
+        value = self.local.get(key)
+        return default if value is _MISSING else value
+
+    def set_local(self, key, value, tags=()):
+        """
+        Stores `value` in the local tier only, for values that must not be written to the shared cache, such as
+        credentials. It is dropped when one of its tags is invalidated, on any node while the bus is connected.
+        """
+        if self.enabled:
+            self.local.set(key, value, tags)
+
+    def get_or_set(self, key, compute, timeout=None, tags=()):
+        """
+        Returns the cached value of `key`, computing and storing it with `compute()`, on the primary database, on a
+        miss.
+
+        The tag versions are read before `compute()` runs, so a value computed while one of its tags is invalidated
+        is stored as already stale instead of outliving the invalidation.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self.enabled:
+            return compute()
+        generation = self.local.generation
+        tag_versions = self._tag_versions(tags, create=True)
+        with use_primary():
+            value = compute()
+        self._store(key, value, timeout, tag_versions, generation)
+        return value
+
+    async def aget_or_set(self, key, compute, timeout=None, tags=()):
+        """
+        Async version of `get_or_set`; `compute` is a coroutine function.
+        """
+        value = await self.aget(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self.enabled:
+            return await compute()
+        generation = self.local.generation
+        tag_versions = await self._atag_versions(tags, create=True)
+        with use_primary():
+            value = await compute()
+        try:
+            await self.shared.aset(self._key(key), (value, tag_versions), self.timeout if timeout is None else timeout)
+        except Exception as e:
+            self._shared_failed('set', e)
+            return value
+        self.local.set(key, value, tag_versions, generation)
+        return value
+
+    def delete(self, key):
+        self.local.delete(key)
+        try:
+            self.shared.delete(self._key(key))
+        except Exception as e:
+            self._shared_failed('delete', e)
+
+    def invalidate_tags(self, *tags):
+        """
+        Invalidates every entry carrying one of `tags`: in both tiers of this process, and in the shared tier for
+        all processes.
+        """
+        if not tags:
+            return
+        self._bump_tags(tags)
+        invalidation_bus.publish('tags', tags=list(tags))
+
+    def _bump_tags(self, tags):
+        self.local.drop_tags(tags)
+        try:
+            self.shared.set_many({self._tag_key(tag): time.time_ns() for tag in tags}, None)
+        except Exception as e:
+            logger.error("Shared cache invalidation of %s failed: %s", ', '.join(tags), e)
+
+    async def ainvalidate_tags(self, *tags):
+        if not tags:
+            return
+        self.local.drop_tags(tags)
+        try:
+            await self.shared.aset_many({self._tag_key(tag): time.time_ns() for tag in tags}, None)
+        except Exception as e:
+            logger.error("Shared cache invalidation of %s failed: %s", ', '.join(tags), e)
+        await invalidation_bus.apublish('tags', tags=list(tags))
+
+    @property
+    def shared_is_local(self):
+        # Each node has its own file or local-memory cache, which the invalidating node cannot update.
+        return isinstance(self.shared, (FileBasedCache, LocMemCache))
+
+    def apply_remote_invalidation(self, tags):
+        """
+        Applies an invalidation published by another node.
+        """
+        if self.shared_is_local:
+            self._bump_tags(tags)
+        else:
+            self.local.drop_tags(tags)
+
+    def clear(self):
+        """
+        Empties the local tier and the shared cache alias.
+        """
+        self.local.clear()
+        try:
+            self.shared.clear()
+        except Exception as e:
+            self._shared_failed('clear', e)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tiered_cache():
+    """
+    Returns the process-wide TieredCache configured by settings.TIERED_CACHE.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = get_cache_settings()
+                _cache = TieredCache(config['ALIAS'], config['TIMEOUT'], config['LOCAL_MAX_ENTRIES'],
+                                     config['LOCAL_TIMEOUT'], config['KEY_PREFIX'], config['ENABLED'])
+    return _cache
+
+
+# Handlers of the invalidation bus, see shipment_management.invalidation_bus.
+
+def _on_tags(message):
+    get_tiered_cache().apply_remote_invalidation(message.get('tags', ()))
+
+
+def _on_clear(message):
+    cache = get_tiered_cache()
+    if cache.shared_is_local:
+        cache.clear()
+    else:
+        cache.local.clear()
+
+
+def _on_bus_connected(message):
+    # Invalidations published while this node was not listening are lost.
+    cache = get_tiered_cache()
+    cache.local.clear()
+    cache.local.timeout = invalidation_bus.get_bus_settings()['LOCAL_TIMEOUT']
+
+
+def _on_bus_disconnected(message):
+    cache = get_tiered_cache()
+    cache.local.timeout = get_cache_settings()['LOCAL_TIMEOUT']
+    cache.local.clear()
+
+
+invalidation_bus.subscribe('tags', _on_tags)
+invalidation_bus.subscribe('clear', _on_clear)
+invalidation_bus.subscribe('connected', _on_bus_connected)
+invalidation_bus.subscribe('disconnected', _on_bus_disconnected)
@@ -0,0 +1,430 @@
+"""
+Lightweight request-scoped tracing.
+
+TracingMiddleware opens a root span per request and code opens child spans with `span()`; the current span lives in
+a contextvar, so spans nest across function calls without being passed around. Every request also gets a
+correlation id, taken from an incoming X-Correlation-ID or W3C traceparent header or freshly generated. It is added
+to log records and returned in the response, and `bind_context()` carries it (with the current span) into
+background threads.
+
+Finished traces are handed to a background exporter that writes them as JSON lines to a file, or posts them as
+OTLP/HTTP JSON to a collector, such as the OpenTelemetry Collector or Jaeger's OTLP endpoint. Outside a sampled
+request, `span()` returns a no-op span, so instrumented code costs close to nothing when tracing is off.
+"""
+import atexit
+import contextvars
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'EXPORTER': 'file',
+    'FILE_PATH': 'traces.jsonl',
+    'OTLP_ENDPOINT': 'http://localhost:4318/v1/traces',
+    'OTLP_HEADERS': {},
+    'SERVICE_NAME': 'shipments',
+    'DB_SPANS': True,
+}
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+_CORRELATION_ID = re.compile(r'^[A-Za-z0-9_.-]{8,64}$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+
+def get_tracing_settings():
+    """
+    Returns the TRACING settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'TRACING', {})}
+
+
+class Trace:
+    """
+    The spans of one trace that have finished so far.
+    """
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self.finished = False
+
+
+class Span:
+    """
+    A timed operation with attributes, e.g. one webhook, one SQL query or one call to Salla.
+    """
+
+    def __init__(self, name, trace, parent_id=None, kind='internal', attributes=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exc):
+        self.status = 'error'
+        self.error = f'{type(exc).__name__}: {exc}'
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+        if self.trace.finished:
+            # A span of background work that outlived its request is exported on its own.
+            export([self])
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class NoopSpan:
+    """
+    Stands in for a span when the current request is not traced.
+    """
+    span_id = None
+    trace_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def get_correlation_id():
+    """
+    Returns the correlation id of the current request or background job, or None outside of one.
+    """
+    return _correlation_id.get()
+
+
+@contextmanager
+def _activate(new_span):
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.end()
+
+
+@contextmanager
+def span(name, kind='internal', **attributes):
+    """
+    Opens a child span of the current span.
+
+    Args:
+    name (str): The operation, e.g. 'salla.update_shipment'.
+    kind (str): 'internal', 'server' or 'client'.
+    **attributes: Initial attributes, e.g. shipment_id=42.
+
+    Yields:
+    Span: The new span, or a no-op span when there is no active trace.
+
+    Example:
+    >>> with span('smtp.send', kind='client', shipment_id=shipment.shipment_id) as s:
+    ...     send_mail(...)
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    with _activate(Span(name, parent.trace, parent.span_id, kind, attributes)) as new_span:
+        yield new_span
+
+
+def set_span_attributes(**attributes):
+    """
+    Sets attributes on the current span, if the request is traced.
+    """
+    active = _current_span.get()
+    if active is not None:
+        active.attributes.update(attributes)
+
+
+def traced(name, kind='internal'):
+    """
+    Decorator that runs the function, or coroutine function, in a span named `name`.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def start_trace(name, correlation_id=None, parent=None, kind='server', **attributes):
+    """
+    Starts a trace, or continues an incoming one, with a root span and sets the correlation id.
+
+    Args:
+    name (str): The name of the root span.
+    correlation_id (str, optional): An incoming correlation id. A new one is generated when omitted.
+    parent (tuple, optional): The (trace id, span id) of a remote parent, e.g. from a traceparent header.
+    kind (str): The kind of the root span.
+    **attributes: Initial attributes of the root span.
+
+    Yields:
+    Span: The root span, or a no-op span when tracing is disabled or the trace is not sampled. The correlation id
+    is set either way.
+    """
+    config = get_tracing_settings()
+    trace_id, parent_id = parent or (None, None)
+    correlation_id = correlation_id or trace_id or secrets.token_hex(16)
+    correlation_token = _correlation_id.set(correlation_id)
+    try:
+        if not config['ENABLED'] or random.random() >= config['SAMPLE_RATE']:
+            yield NOOP_SPAN
+            return
+        if trace_id is None:
+            trace_id = correlation_id if re.fullmatch(r'[0-9a-f]{32}', correlation_id) else secrets.token_hex(16)
+        trace = Trace(trace_id)
+        root = Span(name, trace, parent_id, kind, attributes)
+        try:
+            with _activate(root):
+                yield root
+        finally:
+            trace.finished = True
+            export(trace.spans)
+    finally:
+        _correlation_id.reset(correlation_token)
+
+
+def parse_traceparent(header):
+    """
+    Returns the (trace id, parent span id) of a W3C traceparent header, or None if it is missing or malformed.
+    """
+    match = _TRACEPARENT.match((header or '').strip().lower())
+    return match.groups() if match else None
+
+
+def valid_correlation_id(value):
+    return value if value and _CORRELATION_ID.match(value) else None
+
+
+def bind_context(func):
+    """
+    Wraps `func` so that it runs with the current correlation id and span, e.g. in a thread or an executor.
+    """
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return wrapper
+
+
+def db_span_wrapper(execute, sql, params, many, context):
+    """
+    Database execute wrapper that records every query as a client span of the current request.
+    """
+    with span('db.query', kind='client', **{'db.system': context['connection'].vendor,
+                                            'db.statement': sql[:500]}):
+        return execute(sql, params, many, context)
+
+
+class CorrelationIdFilter(logging.Filter):
+    """
+    Adds `correlation_id` (and `span_id` when traced) to log records so that logs can be joined with traces.
+    """
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        active = _current_span.get()
+        if active is not None:
+            record.span_id = active.span_id
+        return True
+
+
+# Exporters
+
+
+class FileExporter:
+    """
+    Appends spans as JSON lines to a file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as handle:
+            for finished in spans:
+                handle.write(json.dumps(finished.to_dict(), default=str) + '\n')
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OTLPHttpExporter:
+    """
+    Posts spans to an OTLP/HTTP collector using the JSON encoding.
+    """
+
+    def __init__(self, endpoint, service_name, headers=None, timeout=5):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+        self.timeout = timeout
+
+    def encode(self, spans):
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [{
+                    'traceId': finished.trace_id,
+                    'spanId': finished.span_id,
+                    'parentSpanId': finished.parent_id or '',
+                    'name': finished.name,
+                    'kind': SPAN_KINDS.get(finished.kind, 1),
+                    'startTimeUnixNano': str(finished.start_ns),
+                    'endTimeUnixNano': str(finished.end_ns),
+                    'attributes': [{'key': key, 'value': _otlp_value(value)}
+                                   for key, value in finished.attributes.items() if value is not None],
+                    'status': {'code': 2, 'message': finished.error} if finished.status == 'error' else {'code': 1},
+                } for finished in spans],
+            }],
+        }]}
+
+    def export(self, spans):
+        import httpx
+        response = httpx.post(self.endpoint, json=self.encode(spans), headers=self.headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class BackgroundExporter:
+    """
+    Exports finished traces from a daemon thread so that requests never wait on the exporter.
+    """
+
+    def __init__(self, exporter, maxsize=1000):
+        self.exporter = exporter
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, spans):
+        try:
+            self.queue.put_nowait(list(spans))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            spans = self.queue.get()
+            try:
+                self.exporter.export(spans)
+            except Exception as e:
+                logger.warning("Error exporting %s spans: %s", len(spans), e)
+            finally:
+                self.queue.task_done()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """
+    Returns the process-wide background exporter configured by TRACING['EXPORTER'], or None when it is disabled.
+    """
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                config = get_tracing_settings()
+                if config['EXPORTER'] == 'otlp':
+                    exporter = OTLPHttpExporter(config['OTLP_ENDPOINT'], config['SERVICE_NAME'],
+                                                config['OTLP_HEADERS'])
+                elif config['EXPORTER'] == 'file':
+                    exporter = FileExporter(config['FILE_PATH'])
+                else:
+                    return None
+                _exporter = BackgroundExporter(exporter)
+    return _exporter
+
+
+def export(spans):
+    exporter = get_exporter()
+    if exporter is not None and spans:
+        exporter.submit(spans)
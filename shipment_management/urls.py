@@ -18,15 +18,14 @@ from django.contrib import admin
 from django.shortcuts import redirect
 from django.urls import path, include, re_path
 from django.conf.urls import handler404
-from django.conf.urls.static import static
-from django.conf import settings
+from shipments.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
     path('shipments/', include('shipments.urls')),
+    path('metrics', metrics_view, name='metrics'),
     re_path(r'^$', lambda request: redirect('shipments:home', permanent=True)),
 
 ]
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 handler404 = 'shipments.views.custom_page_not_found_view'
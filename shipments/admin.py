@@ -1,6 +1,147 @@
-from django.contrib import admin
-from .models import Shipment, ShipmentStatus, MerchantToken
+"""
+Admin of the shipments app.
+
+The shipment and status history tables are too large for the admin's defaults, so their changelists:
+
+- count rows with the EstimatedCountPaginator instead of an exact COUNT(*), and skip the count of all rows;
+- load only the columns they display, not the JSON details of every shipment;
+- filter and sort through the indexes of Shipment, taking filter choices from small tables rather than a
+  SELECT DISTINCT over the shipments;
+- search for exact shipment IDs, shipping numbers and tracking numbers, which use indexes, instead of the default
+  icontains search, which reads every row.
+"""
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Q
+from .models import Shipment, ShipmentStatus, MerchantToken, StatusRollup
+from .pagination import EstimatedCountPaginator
+from .services.bulk_status_service import bulk_status_update
+
+# Statuses that ops set on many shipments at once, e.g. from a courier manifest.
+BULK_STATUSES = ('delivered', 'returned')
+
+
+def status_action(status):
+    """
+    Builds an admin action that gives the selected shipments a status with one bulk update.
+    """
+    def action(modeladmin, request, queryset):
+        try:
+            result = bulk_status_update(queryset.values_list('shipment_id', flat=True), status)
+        except ValueError as e:
+            modeladmin.message_user(request, str(e), messages.ERROR)
+            return
+        modeladmin.message_user(request, f"Marked {result['updated']} shipments as {status}.", messages.SUCCESS)
+
+    action.__name__ = f'mark_{status}'
+    return admin.action(description=f'Mark selected shipments as {status}')(action)
+
+
+class ProjectedChangeList(ChangeList):
+    """
+    A changelist that only loads the `changelist_fields` of its model admin.
+    """
+
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        return queryset.only(*self.model_admin.changelist_fields)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin of tables too large to count or load whole rows of.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    changelist_fields = ()
+
+    def get_changelist(self, request, **kwargs):
+        return ProjectedChangeList
+
+
+class MerchantFilter(admin.SimpleListFilter):
+    """
+    Filters by merchant, offering the merchants that installed the app.
+    """
+    title = 'merchant'
+    parameter_name = 'merchant'
+
+    def lookups(self, request, model_admin):
+        merchants = MerchantToken.objects.order_by('merchant_id').values_list('merchant_id', flat=True)
+        return [(merchant, merchant) for merchant in merchants]
+
+    def queryset(self, request, queryset):
+        if self.value() and self.value().isdigit():
+            return queryset.filter(merchant=int(self.value()))
+        return queryset
+
+
+class CourierFilter(admin.SimpleListFilter):
+    """
+    Filters by courier, offering the couriers of the analytics rollups.
+    """
+    title = 'courier'
+    parameter_name = 'courier_name'
+
+    def lookups(self, request, model_admin):
+        couriers = (StatusRollup.objects.exclude(courier_name='').order_by('courier_name')
+                    .values_list('courier_name', flat=True).distinct())
+        return [(courier, courier) for courier in couriers]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(courier_name=self.value())
+        return queryset
+
+
+class ShipmentStatusInline(admin.TabularInline):
+    model = ShipmentStatus
+    fields = ('status', 'date_time')
+    ordering = ('date_time',)
+    extra = 0
+
+
+@admin.register(Shipment)
+class ShipmentAdmin(LargeTableAdmin):
+    list_display = ('shipment_id', 'shipping_number', 'tracking_number', 'merchant', 'courier_name',
+                    'current_status', 'created_at')
+    changelist_fields = list_display
+    list_filter = ('current_status', CourierFilter, MerchantFilter)
+    search_fields = ('shipment_id', 'shipping_number', 'tracking_number')
+    search_help_text = 'Exact shipment ID, shipping number or tracking number.'
+    ordering = ('-created_at',)
+    readonly_fields = ('current_status',)
+    inlines = [ShipmentStatusInline]
+    actions = [status_action(status) for status in BULK_STATUSES]
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        lookup = Q(shipping_number=term) | Q(tracking_number=term)
+        if term.isdigit():
+            lookup |= Q(shipment_id=int(term))
+        return queryset.filter(lookup), False
+
+
+@admin.register(ShipmentStatus)
+class ShipmentStatusAdmin(LargeTableAdmin):
+    list_display = ('id', 'shipment', 'status', 'date_time')
+    list_select_related = ('shipment',)
+    changelist_fields = ('id', 'status', 'date_time', 'shipment__shipment_id')
+    search_fields = ('shipment__shipment_id',)
+    search_help_text = 'Exact shipment ID.'
+    # Rows are inserted in time order, so the primary key sorts them by time through its index.
+    ordering = ('-id',)
+    raw_id_fields = ('shipment',)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if not term.isdigit():
+            return queryset.none(), False
+        return queryset.filter(shipment_id=int(term)), False
+
 
-admin.site.register(Shipment)
-admin.site.register(ShipmentStatus)
 admin.site.register(MerchantToken)
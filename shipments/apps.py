@@ -1,6 +1,28 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ShipmentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shipments'
+
+    def ready(self):
+        # shipments.warmup is only imported when enabled, to keep start-up lean.
+        if getattr(settings, 'WARMUP', {}).get('ENABLED') and self._serves_requests():
+            from .warmup import start_warmup
+            start_warmup()
+        if getattr(settings, 'INVALIDATION_BUS', {}).get('ENABLED') and self._serves_requests():
+            from shipment_management.invalidation_bus import start_listener
+            from . import cache, live  # register their handlers with the bus
+            start_listener()
+
+    @staticmethod
+    def _serves_requests():
+        # Management commands other than runserver don't render labels; `manage.py warmup` runs its own, and the
+        # runserver autoreloader parent (without RUN_MAIN) never serves a request.
+        if os.path.basename(sys.argv[0]) != 'manage.py':
+            return True
+        return sys.argv[1:2] == ['runserver'] and os.environ.get('RUN_MAIN') == 'true'
@@ -0,0 +1,177 @@
+"""
+Synthetic shipment data for scale testing.
+
+The generator writes merchants, shipments with realistic Salla-shaped JSON columns and status histories straight
+through bulk_create, so millions of rows can be produced without going through the webhook path.
+"""
+import random
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ..models import MerchantToken, Shipment, ShipmentStatus
+
+CITIES = [
+    ('Riyadh', 24.7136, 46.6753),
+    ('Jeddah', 21.4858, 39.1925),
+    ('Mecca', 21.3891, 39.8579),
+    ('Medina', 24.5247, 39.5692),
+    ('Dammam', 26.4207, 50.0888),
+    ('Khobar', 26.2172, 50.1971),
+    ('Tabuk', 28.3835, 36.5662),
+    ('Abha', 18.2465, 42.5117),
+]
+FIRST_NAMES = ['Mohammed', 'Abdullah', 'Fatimah', 'Noura', 'Khalid', 'Sara', 'Faisal', 'Reem', 'Omar', 'Huda']
+LAST_NAMES = ['Al-Otaibi', 'Al-Qahtani', 'Al-Ghamdi', 'Al-Harbi', 'Al-Zahrani', 'Al-Shehri', 'Al-Dosari']
+STREETS = ['King Fahd Rd', 'Olaya St', 'Prince Sultan St', 'Tahlia St', 'King Abdulaziz Rd', 'Makkah Rd']
+PRODUCTS = ['Perfume', 'Abaya', 'Dates Box', 'Coffee Beans', 'Phone Case', 'Sneakers', 'Oud Incense', 'Headphones']
+COURIERS = ['SMSA', 'Aramex', 'DHL', 'SPL', 'J&T Express', 'Naqel']
+
+# Status histories and how often each occurs.
+HISTORIES = [
+    (['created', 'in_progress', 'delivering', 'delivered'], 70),
+    (['created', 'in_progress', 'delivering'], 10),
+    (['created', 'pending'], 5),
+    (['created', 'cancelled'], 8),
+    (['created', 'in_progress', 'delivering', 'returned'], 7),
+]
+
+
+def _address(rng):
+    city, latitude, longitude = rng.choice(CITIES)
+    name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+    return {
+        'name': name,
+        'type': 'address',
+        'email': f"{name.split()[0].lower()}{rng.randint(1, 9999)}@example.com",
+        'phone': f'+9665{rng.randint(10000000, 99999999)}',
+        'country': 'Saudi Arabia',
+        'city': city,
+        'address_line': f'{rng.randint(1, 9999)} {rng.choice(STREETS)}, {city}',
+        'street_number': str(rng.randint(1, 9999)),
+        'block': f'Block {rng.randint(1, 40)}',
+        'postal_code': str(rng.randint(10000, 99999)),
+        'latitude': round(latitude + rng.uniform(-0.1, 0.1), 6),
+        'longitude': round(longitude + rng.uniform(-0.1, 0.1), 6),
+    }
+
+
+def _packages(rng):
+    packages = []
+    for _ in range(rng.randint(1, 4)):
+        quantity = rng.randint(1, 3)
+        packages.append({
+            'name': rng.choice(PRODUCTS),
+            'sku': f'SKU-{rng.randint(10000, 99999)}',
+            'price': {'amount': round(rng.uniform(20, 900), 2), 'currency': 'SAR'},
+            'quantity': quantity,
+            'weight': {'value': round(rng.uniform(0.1, 5), 2), 'unit': 'kg'},
+        })
+    return packages
+
+
+def _shipping_numbers(created_ats):
+    """
+    Allocates shipping numbers in the NNNNNNMMYYYY format, counting per creation month.
+    """
+    counters = {}
+    numbers = []
+    for created_at in created_ats:
+        suffix = created_at.strftime('%m%Y')
+        if suffix not in counters:
+            last = (
+                Shipment.objects.filter(shipping_number__endswith=suffix)
+                .order_by('-shipping_number')
+                .values_list('shipping_number', flat=True)
+                .first()
+            )
+            counters[suffix] = int(last[:6]) if last else 0
+        counters[suffix] += 1
+        numbers.append(f'{counters[suffix]:06d}{suffix}')
+    return numbers
+
+
+def generate_synthetic_data(shipments, merchants=50, days=180, seed=None, batch_size=5000, progress=None):
+    """
+    Generates merchants, shipments and status histories.
+
+    Args:
+    shipments (int): The number of shipments to create.
+    merchants (int): The number of merchants the shipments are spread over.
+    days (int): Shipments are created over the last `days` days.
+    seed (int, optional): The random seed, for reproducible data sets.
+    batch_size (int): The number of shipments written per transaction.
+    progress (callable, optional): Called with the number of shipments created so far after each batch.
+
+    Returns:
+    tuple: The number of shipments and statuses created.
+
+    Merchant ids start at 1000 and get a long-lived MerchantToken each. Shipment ids continue after the highest
+    existing id, so the generator can be run repeatedly to grow a data set.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    merchant_ids = list(range(1000, 1000 + merchants))
+    existing_tokens = set(MerchantToken.objects.filter(merchant_id__in=merchant_ids).values_list('merchant_id', flat=True))
+    MerchantToken.objects.bulk_create([
+        MerchantToken(merchant_id=merchant_id, access_token=f'synthetic-{merchant_id}',
+                      refresh_token=f'synthetic-refresh-{merchant_id}', expires_at=now + timedelta(days=3650))
+        for merchant_id in merchant_ids if merchant_id not in existing_tokens
+    ])
+    merchant_origins = {merchant_id: _address(rng) for merchant_id in merchant_ids}
+    histories, weights = zip(*HISTORIES)
+
+    next_id = (Shipment.objects.aggregate(last=Max('shipment_id'))['last'] or 0) + 1
+    created_shipments = 0
+    created_statuses = 0
+    while created_shipments < shipments:
+        count = min(batch_size, shipments - created_shipments)
+        created_ats = sorted(now - timedelta(seconds=rng.uniform(0, days * 86400)) for _ in range(count))
+        new_shipments = []
+        new_statuses = []
+        for offset, (created_at, shipping_number) in enumerate(zip(created_ats, _shipping_numbers(created_ats))):
+            shipment_id = next_id + offset
+            merchant_id = rng.choice(merchant_ids)
+            packages = _packages(rng)
+            total = round(sum(p['price']['amount'] * p['quantity'] for p in packages), 2)
+            weight = round(sum(p['weight']['value'] * p['quantity'] for p in packages), 2)
+            new_shipments.append(Shipment(
+                shipment_id=shipment_id,
+                event='shipment.creating',
+                merchant=merchant_id,
+                created_at=created_at,
+                type='shipment',
+                shipping_number=shipping_number,
+                courier_name=rng.choice(COURIERS),
+                courier_logo='https://cdn.salla.sa/courier-logo.png',
+                tracking_number=f'TRK{shipment_id:010d}',
+                tracking_link=f'https://tracking.example.com/{shipment_id}',
+                payment_method=rng.choice(['cod', 'credit_card', 'mada', 'apple_pay']),
+                total={'amount': total, 'currency': 'SAR'},
+                cash_on_delivery={'amount': total, 'currency': 'SAR'},
+                label={'url': f'https://example.com/shipments/generate-pdf-label/{shipment_id}/'},
+                total_weight={'value': weight, 'units': 'kg'},
+                created_at_details={'date': created_at.isoformat(), 'timezone': 'Asia/Riyadh'},
+                packages=packages,
+                ship_from=merchant_origins[merchant_id],
+                ship_to=_address(rng),
+                meta={'source': 'synthetic'},
+            ))
+            date_time = created_at
+            for status in rng.choices(histories, weights)[0]:
+                date_time = min(date_time + timedelta(hours=rng.expovariate(1 / 18)), now)
+                new_statuses.append(ShipmentStatus(shipment_id=shipment_id, status=status, date_time=date_time))
+
+        with transaction.atomic():
+            Shipment.objects.bulk_create(new_shipments, batch_size=1000)
+            ShipmentStatus.objects.bulk_create(new_statuses, batch_size=5000)
+            Shipment.sync_current_status([shipment.shipment_id for shipment in new_shipments])
+        next_id += count
+        created_shipments += count
+        created_statuses += len(new_statuses)
+        if progress:
+            progress(created_shipments)
+
+    return created_shipments, created_statuses
@@ -0,0 +1,114 @@
+"""
+Start-up benchmarks: import time, resident memory and loaded dependencies of a fresh process.
+
+Every measurement runs in a new interpreter, as a worker or a management command would, so nothing imported by the
+benchmarking process itself leaks into the numbers.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+TARGETS = ('django_setup', 'wsgi', 'asgi')
+# Dependencies worth keeping out of start-up; the report lists which of them a target loaded.
+HEAVY_MODULES = ('weasyprint', 'requests', 'dateutil', 'httpx', 'prometheus_client', 'psycopg2', 'psycopg')
+RESULT_MARKER = 'STARTUP_RESULT '
+
+# Runs in the child process. argv: target, or 'manage' followed by the command line.
+PROBE = r'''
+import json, os, sys, time
+start = time.perf_counter()
+target = sys.argv[1]
+if target == 'manage':
+    from django.core.management import execute_from_command_line
+    execute_from_command_line(['manage.py'] + sys.argv[2:])
+elif target in ('wsgi', 'asgi'):
+    import importlib
+    importlib.import_module('shipment_management.' + target)
+    from django.urls import get_resolver
+    get_resolver().url_patterns  # workers import the URLconf, and with it the views, on their first request
+else:
+    import django
+    django.setup()
+elapsed = time.perf_counter() - start
+rss_kb = None
+try:
+    with open('/proc/self/status') as status:
+        rss_kb = next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+except OSError:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = json.loads(os.environ['STARTUP_HEAVY_MODULES'])
+print(''' + repr(RESULT_MARKER) + r''' + json.dumps({
+    'import_ms': round(elapsed * 1000, 1),
+    'rss_kb': rss_kb,
+    'modules': len(sys.modules),
+    'heavy_modules': [name for name in heavy if name in sys.modules],
+}))
+'''
+
+
+def measure(target, command=None):
+    """
+    Starts a fresh interpreter for one target and returns its start-up measurements.
+
+    Args:
+    target (str): One of TARGETS, or 'manage' to run a management command.
+    command (list, optional): The management command line for the 'manage' target, e.g. ['check'].
+
+    Returns:
+    dict: 'wall_ms' (including interpreter start-up), 'import_ms', 'rss_kb', 'modules' and 'heavy_modules'.
+
+    Raises:
+    RuntimeError: If the process fails.
+    """
+    env = {**os.environ, 'STARTUP_HEAVY_MODULES': json.dumps(HEAVY_MODULES)}
+    env.setdefault('DJANGO_SETTINGS_MODULE', os.environ.get('DJANGO_SETTINGS_MODULE', 'shipment_management.settings'))
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', PROBE, target, *(command or [])], cwd=settings.BASE_DIR,
+                             env=env, capture_output=True, text=True)
+    wall_ms = round((time.perf_counter() - start) * 1000, 1)
+    lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+    if process.returncode != 0 or not lines:
+        raise RuntimeError(f"Start-up probe for {target} failed: {process.stderr.strip()[-2000:]}")
+    return {'wall_ms': wall_ms, **json.loads(lines[-1][len(RESULT_MARKER):])}
+
+
+def run_startup_benchmarks(targets=TARGETS, commands=(), runs=5):
+    """
+    Measures each target `runs` times and summarizes the results.
+
+    Args:
+    targets (iterable): Names from TARGETS.
+    commands (iterable): Management command lines to measure, e.g. ['check', 'showmigrations shipments'].
+    runs (int): Fresh processes per target.
+
+    Returns:
+    dict: Per target the median wall and import time, the peak RSS in MiB, the module count and the heavy
+    dependencies loaded.
+
+    Raises:
+    ValueError: If a target is unknown.
+    """
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        raise ValueError(f"Unknown start-up targets: {', '.join(sorted(unknown))}")
+
+    jobs = [(name, name, None) for name in targets]
+    jobs += [(f'manage.py {command}', 'manage', command.split()) for command in commands]
+    results = {}
+    for label, target, command in jobs:
+        samples = [measure(target, command) for _ in range(runs)]
+        results[label] = {
+            'runs': runs,
+            'wall_ms': round(statistics.median(sample['wall_ms'] for sample in samples), 1),
+            'import_ms': round(statistics.median(sample['import_ms'] for sample in samples), 1),
+            'rss_mb': round(max(sample['rss_kb'] for sample in samples) / 1024, 1),
+            'modules': samples[-1]['modules'],
+            'heavy_modules': samples[-1]['heavy_modules'],
+        }
+    return results
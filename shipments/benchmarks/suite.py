@@ -0,0 +1,227 @@
+"""
+Scale benchmarks for the main request paths.
+
+Each scenario is driven through the full Django stack with the test client. Latency is measured over several
+iterations; queries per request and peak Python memory are measured on one extra, instrumented iteration so that
+tracing does not skew the timings.
+"""
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Max
+from django.test import Client
+from django.urls import reverse
+
+from ..models import Shipment, ShipmentStatus
+
+SCENARIOS = ('home', 'shipment_detail', 'generate_pdf_label', 'webhook_handler', 'search_shipments')
+# Outbound calls are replaced so that the webhook benchmark measures this app, not Salla or the mail relay.
+OUTBOUND_PATCHES = (
+    'shipments.services.shipment_service.update_salla_api',
+    'shipments.services.shipment_service.send_shipment_email',
+)
+
+
+def percentile(samples, p):
+    """
+    Returns the p-th percentile of a list of samples using linear interpolation.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class QueryCounter:
+    """
+    Counts the queries executed on the default connection.
+
+    Unlike CaptureQueriesContext this does not keep the SQL, so it stays accurate past the 9000 queries that Django's
+    query log holds.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class BenchmarkContext:
+    """
+    Holds the test client, logged in as a staff user who sees every merchant, and picks the shipments each scenario
+    works on.
+    """
+
+    USERNAME = 'benchmark'
+
+    def __init__(self):
+        self.client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        self.user, self.created_user = get_user_model().objects.get_or_create(username=self.USERNAME,
+                                                                               defaults={'is_staff': True})
+        self.client.force_login(self.user)
+        self.sample = Shipment.objects.order_by('-shipment_id').values('shipment_id', 'merchant', 'tracking_number').first()
+        self.next_id = (Shipment.objects.aggregate(last=Max('shipment_id'))['last'] or 0) + 1_000_000
+        self.created_ids = []
+
+    def home(self):
+        return self.client.get(reverse('shipments:home'))
+
+    def shipment_detail(self):
+        return self.client.get(reverse('shipments:shipment_detail', args=[self.sample['shipment_id']]))
+
+    def generate_pdf_label(self):
+        return self.client.get(reverse('shipments:generate_pdf_label', args=[self.sample['shipment_id']]))
+
+    def webhook_handler(self):
+        shipment_id = self.next_id
+        self.next_id += 1
+        self.created_ids.append(shipment_id)
+        payload = {
+            'event': 'shipment.creating',
+            'merchant': self.sample['merchant'],
+            'created_at': '2024-01-01T10:00:00+03:00',
+            'data': {
+                'id': shipment_id,
+                'status': 'creating',
+                'type': 'shipment',
+                'courier_name': 'SMSA',
+                'tracking_number': f'BENCH{shipment_id}',
+                'packages': [{'name': 'Perfume', 'quantity': 1}],
+                'ship_from': {'name': 'Benchmark Store', 'city': 'Riyadh', 'country': 'Saudi Arabia'},
+                'ship_to': {'name': 'Benchmark Customer', 'city': 'Jeddah', 'country': 'Saudi Arabia'},
+            },
+        }
+        return self.client.post(reverse('shipments:shipment_webhook'), data=json.dumps(payload),
+                                content_type='application/json')
+
+    def search_shipments(self):
+        return self.client.get(reverse('shipments:search_shipments'),
+                               {'q': (self.sample['tracking_number'] or '')[-6:]})
+
+    def cleanup(self):
+        Shipment.objects.filter(shipment_id__in=self.created_ids).delete()
+        self.created_ids = []
+        if self.created_user:
+            self.user.delete()
+
+
+def run_scenario(context, name, iterations):
+    """
+    Runs one scenario and returns its latency percentiles, query count and peak memory.
+    """
+    action = getattr(context, name)
+    timings = []
+    status_code = None
+    try:
+        action()  # warm up templates, caches and the connection
+        for _ in range(iterations):
+            start = time.perf_counter()
+            response = action()
+            timings.append((time.perf_counter() - start) * 1000)
+        status_code = getattr(response, 'status_code', None)
+
+        queries = QueryCounter()
+        tracemalloc.start()
+        with connection.execute_wrapper(queries):
+            action()
+        _, peak = tracemalloc.get_traced_memory()
+    except Exception as e:
+        return {'error': str(e)}
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'status_code': status_code,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p90_ms': round(percentile(timings, 90), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'mean_ms': round(statistics.mean(timings), 2),
+        'queries': queries.count,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(iterations=20, scenarios=SCENARIOS):
+    """
+    Runs the benchmark scenarios against the current data set.
+
+    Args:
+    iterations (int): The number of timed requests per scenario.
+    scenarios (iterable): The scenario names to run, see SCENARIOS.
+
+    Returns:
+    dict: The data set size and one result dictionary per scenario.
+
+    Raises:
+    ValueError: If the database holds no shipments or a scenario name is unknown.
+    """
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    context = BenchmarkContext()
+    if context.sample is None:
+        raise ValueError("No shipments to benchmark; run generate_synthetic_data first")
+
+    patches = [patch(target) for target in OUTBOUND_PATCHES]
+    for outbound in patches:
+        outbound.start()
+    try:
+        results = {name: run_scenario(context, name, iterations) for name in scenarios}
+    finally:
+        for outbound in patches:
+            outbound.stop()
+        context.cleanup()
+
+    return {
+        'shipments': Shipment.objects.count(),
+        'statuses': ShipmentStatus.objects.count(),
+        'results': results,
+    }
+
+
+def environment():
+    """
+    Describes the environment of a benchmark run so that results from different runs can be compared.
+    """
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'debug': settings.DEBUG,
+    }
+
+
+def compare(previous, current):
+    """
+    Compares two benchmark reports and returns one line per scenario and size with the p50 and query deltas.
+    """
+    lines = []
+    previous_runs = {run['shipments']: run for run in previous.get('runs', [])}
+    for run in current.get('runs', []):
+        baseline = previous_runs.get(run['shipments'])
+        if not baseline:
+            continue
+        for name, result in run['results'].items():
+            before = baseline['results'].get(name, {})
+            if 'p50_ms' not in result or 'p50_ms' not in before:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            lines.append(f"{run['shipments']:>9} {name:<20} p50 {before['p50_ms']:>9.2f} -> {result['p50_ms']:>9.2f} ms "
+                         f"({change:+.1f}%), queries {before['queries']} -> {result['queries']}")
+    return lines
@@ -0,0 +1,161 @@
+"""
+Cached shipment pages and computed objects, and their invalidation.
+
+Entries are tagged so that a write drops exactly the pages that show the changed data:
+
+- every entry carries BULK, bumped only by bulk loads (imports, archiving, rollup rebuilds);
+- pages that list or aggregate shipments (the dashboard, unfiltered analytics) carry ALL_SHIPMENTS;
+- pages of one shipment carry its `shipment_tag`, and merchant-scoped pages the `merchant_tag`.
+
+`invalidate_shipment()` is called by every service or view that writes a shipment or its statuses.
+
+The loaders below are shared by the views and by their HTTP validators (shipments.conditional), so that a
+conditional request that ends in a 304 runs no query.
+
+Merchant access tokens are cached in the local tier only, so they never reach the shared cache, and are dropped by
+`invalidate_merchant_token()` when a token is stored or refreshed. So is whether a merchant installed the app.
+"""
+from django.db import transaction
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.utils import timezone
+from shipment_management.tiered_cache import get_tiered_cache
+
+from .models import MerchantToken, Shipment, ShipmentStatus
+
+ALL_SHIPMENTS = 'shipments'
+BULK = 'shipments:bulk'
+
+
+def shipment_tag(shipment_id):
+    return f'shipment:{shipment_id}'
+
+
+def merchant_tag(merchant):
+    return f'merchant:{merchant or 0}'
+
+
+def token_tag(merchant_id):
+    return f'merchant_token:{merchant_id}'
+
+
+def shipment_tags(shipment_id, merchant=None):
+    """
+    Returns the tags invalidated by a write to one shipment.
+    """
+    tags = [ALL_SHIPMENTS, shipment_tag(shipment_id)]
+    if merchant is not None:
+        tags.append(merchant_tag(merchant))
+    return tags
+
+
+def get_shipment_detail(shipment_id):
+    """
+    Returns a shipment and its status history, oldest first, cached until the shipment changes.
+
+    Raises:
+    Http404: If the shipment does not exist.
+    """
+    def load():
+        shipment = get_object_or_404(Shipment, shipment_id=shipment_id)
+        return shipment, list(shipment.statuses.order_by('date_time', 'id'))
+
+    return get_tiered_cache().get_or_set(f'shipment_detail:{shipment_id}', load,
+                                         tags=[shipment_tag(shipment_id), BULK])
+
+
+async def aget_shipment_detail(shipment_id):
+    """
+    Async version of `get_shipment_detail`.
+    """
+    async def load():
+        shipment = await aget_object_or_404(Shipment, shipment_id=shipment_id)
+        return shipment, [status async for status in shipment.statuses.order_by('date_time', 'id')]
+
+    return await get_tiered_cache().aget_or_set(f'shipment_detail:{shipment_id}', load,
+                                                tags=[shipment_tag(shipment_id), BULK])
+
+
+def latest_status_time():
+    """
+    Returns the time of the status recorded last, or None, cached until any shipment changes. The row is found by
+    primary key, which unlike a MAX(date_time) over the whole history needs no scan.
+    """
+    return get_tiered_cache().get_or_set(
+        'latest_status_time',
+        lambda: ShipmentStatus.objects.order_by('-id').values_list('date_time', flat=True).first(),
+        tags=[ALL_SHIPMENTS, BULK],
+    )
+
+
+def invalidate_shipment(shipment_id, merchant=None):
+    """
+    Drops the cached pages that show a shipment once the current transaction commits, so that a concurrent request
+    cannot cache the data from before the write again.
+    """
+    tags = shipment_tags(shipment_id, merchant)
+    transaction.on_commit(lambda: get_tiered_cache().invalidate_tags(*tags))
+
+
+async def ainvalidate_shipment(shipment_id, merchant=None):
+    """
+    Async version of `invalidate_shipment`, for the async ORM, which always runs in autocommit mode.
+    """
+    await get_tiered_cache().ainvalidate_tags(*shipment_tags(shipment_id, merchant))
+
+
+def invalidate_shipments(shipments):
+    """
+    Drops the cached pages of many shipments once the current transaction commits, with one invalidation.
+    """
+    tags = {tag for shipment in shipments for tag in shipment_tags(shipment.shipment_id, shipment.merchant)}
+    transaction.on_commit(lambda: get_tiered_cache().invalidate_tags(*tags))
+
+
+def invalidate_all():
+    """
+    Drops every cached shipment page, after a bulk load.
+    """
+    transaction.on_commit(lambda: get_tiered_cache().invalidate_tags(BULK, ALL_SHIPMENTS))
+
+
+def cached_access_token(merchant_id):
+    """
+    Returns the cached access token of a merchant, or None when it is not cached or has expired.
+    """
+    entry = get_tiered_cache().get_local(token_tag(merchant_id))
+    if entry is None:
+        return None
+    access_token, expires_at = entry
+    return access_token if expires_at > timezone.now() else None
+
+
+def cache_access_token(merchant_token):
+    get_tiered_cache().set_local(token_tag(merchant_token.merchant_id),
+                                 (merchant_token.access_token, merchant_token.expires_at),
+                                 tags=[token_tag(merchant_token.merchant_id)])
+
+
+def merchant_installed(merchant_id):
+    """
+    Returns whether a merchant installed the app, i.e. has a MerchantToken.
+
+    Only installed merchants are cached, so that the made-up merchant IDs of a webhook body take no cache space.
+    """
+    key = f'merchant_installed:{merchant_id}'
+    if get_tiered_cache().get_local(key):
+        return True
+    installed = MerchantToken.objects.filter(merchant_id=merchant_id).exists()
+    if installed:
+        get_tiered_cache().set_local(key, True, tags=[token_tag(merchant_id)])
+    return installed
+
+
+def invalidate_merchant_token(merchant_id):
+    """
+    Drops the cached access token of a merchant, on every node, once the current transaction commits.
+    """
+    transaction.on_commit(lambda: get_tiered_cache().invalidate_tags(token_tag(merchant_id)))
+
+
+async def ainvalidate_merchant_token(merchant_id):
+    await get_tiered_cache().ainvalidate_tags(token_tag(merchant_id))
@@ -0,0 +1,141 @@
+"""
+HTTP validators for conditional GETs of the dashboard, shipment detail and label responses.
+
+The ETag is derived from the time of the latest status the response shows, from the versions of the response's
+cache tags, which every write bumps (see shipments.cache), so an edit that records no status changes it too, and
+from the static files manifest, so a deploy with new assets does. Pages that embed a CSRF token also vary with the
+client's CSRF cookie. Everything comes from the tiered cache, so a request answered with 304 Not Modified runs no
+query and renders nothing.
+
+The pages send no Last-Modified: no single time covers all of the above, and a client revalidating with
+If-Modified-Since alone would be told a page it last saw before such a change is not modified.
+
+Responses are marked `Cache-Control: private, no-cache`: browsers keep them but revalidate on every visit.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from shipment_management.tiered_cache import get_tiered_cache
+
+from .cache import BULK, aget_shipment_detail, get_shipment_detail, latest_status_time, shipment_tag
+from .scoping import aget_request_merchant, check_merchant, get_request_merchant, scope_key, scope_tag
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+def make_etag(request, tag_versions, *parts, csrf=True):
+    """
+    Returns a weak ETag for a response built from data cached under tags with the given versions.
+
+    Args:
+    request (HttpRequest): The request.
+    tag_versions (dict): The tag versions, see TieredCache.tag_versions.
+    *parts: Anything else the response depends on, e.g. the shipment ID and the latest status time.
+    csrf (bool): Whether the response embeds a CSRF token.
+
+    Returns:
+    str: The quoted ETag.
+    """
+    state = [sorted(tag_versions.items()), parts, getattr(staticfiles_storage, 'manifest_hash', '')]
+    if csrf:
+        state.append(request.COOKIES.get(settings.CSRF_COOKIE_NAME))
+    return f'W/"{hashlib.md5(repr(state).encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def conditional(validators):
+    """
+    Answers conditional GETs to a view with 304 Not Modified.
+
+    Args:
+    validators (callable): Called with the view's arguments, returns the ETag and the Last-Modified datetime of the
+    response, either of which may be None. It is a coroutine function for async views.
+
+    Example:
+    @conditional(detail_validators)
+    def shipment_detail(request, shipment_id): ...
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_view(request, *args, **kwargs):
+                if request.method not in CONDITIONAL_METHODS:
+                    return await view(request, *args, **kwargs)
+                etag, last_modified = await validators(request, *args, **kwargs)
+                response = not_modified(request, etag, last_modified) or await view(request, *args, **kwargs)
+                return add_validators(response, etag, last_modified)
+            return async_view
+
+        @wraps(view)
+        def sync_view(request, *args, **kwargs):
+            if request.method not in CONDITIONAL_METHODS:
+                return view(request, *args, **kwargs)
+            etag, last_modified = validators(request, *args, **kwargs)
+            response = not_modified(request, etag, last_modified) or view(request, *args, **kwargs)
+            return add_validators(response, etag, last_modified)
+        return sync_view
+    return decorator
+
+
+def not_modified(request, etag, last_modified):
+    return get_conditional_response(request, etag=etag,
+                                    last_modified=int(last_modified.timestamp()) if last_modified else None)
+
+
+def add_validators(response, etag, last_modified):
+    # Error pages get no validators, so that a client never revalidates a 500 into a 304.
+    if response.status_code in (200, 304):
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def home_validators(request):
+    merchant = get_request_merchant(request)
+    latest = latest_status_time()
+    tag_versions = get_tiered_cache().tag_versions(scope_tag(merchant), BULK)
+    return make_etag(request, tag_versions, 'home', scope_key(merchant), latest), None
+
+
+def _shipment_validators(request, shipment_id, page, statuses, tag_versions):
+    latest = statuses[-1].date_time if statuses else None
+    return make_etag(request, tag_versions, page, shipment_id, latest, csrf=page == 'detail'), None
+
+
+def detail_validators(request, shipment_id, page='detail'):
+    try:
+        shipment, statuses = get_shipment_detail(shipment_id)
+        # Labels are public: their URL is handed to Salla and the courier.
+        if page == 'detail':
+            check_merchant(shipment, get_request_merchant(request))
+    except Http404:
+        return None, None  # the view answers
+    tag_versions = get_tiered_cache().tag_versions(shipment_tag(shipment_id), BULK)
+    return _shipment_validators(request, shipment_id, page, statuses, tag_versions)
+
+
+async def adetail_validators(request, shipment_id, page='detail'):
+    try:
+        shipment, statuses = await aget_shipment_detail(shipment_id)
+        if page == 'detail':
+            check_merchant(shipment, await aget_request_merchant(request))
+    except Http404:
+        return None, None
+    tag_versions = await get_tiered_cache().atag_versions(shipment_tag(shipment_id), BULK)
+    return _shipment_validators(request, shipment_id, page, statuses, tag_versions)
+
+
+def label_validators(request, shipment_id):
+    return detail_validators(request, shipment_id, page='label')
+
+
+async def alabel_validators(request, shipment_id):
+    return await adetail_validators(request, shipment_id, page='label')
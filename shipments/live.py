@@ -0,0 +1,253 @@
+"""
+Live dashboard updates over server-sent events.
+
+The shipment service calls `announce_shipment()` and `announce_status()` as it saves shipments and statuses. Once the
+transaction commits, the event goes to every dashboard connected to this node, and is published on the
+invalidation bus (shipment_management.invalidation_bus) for the dashboards connected to other nodes.
+
+`live_events` streams the events to the dashboard's EventSource. Each connection stays open, so the view is only
+served by the ASGI app; under WSGI it answers 204 No Content, which tells the browser not to reconnect.
+
+Events carry the shipment's merchant, and each dashboard only receives the events of the merchant its user is
+scoped to (see shipments.scoping).
+
+Each node numbers the events it delivers and keeps the last REPLAY of them, so a client that reconnects with
+Last-Event-ID gets the events it missed. When those are no longer known, were numbered by another node or process,
+or a client falls QUEUE_SIZE events behind, it gets a 'reset' event and reloads the page.
+"""
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import formats, timezone
+from django.utils.dateparse import parse_datetime
+from shipment_management import invalidation_bus
+
+from .scoping import ALL_MERCHANTS, aget_request_merchant
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'HEARTBEAT': 15,
+    'QUEUE_SIZE': 100,
+    'REPLAY': 200,
+    'RETRY_MS': 3000,
+}
+RESET = (None, 'reset', {})
+
+
+def get_live_settings():
+    """
+    Returns the LIVE_UPDATES settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'LIVE_UPDATES', {})}
+
+
+class Broker:
+    """
+    Hands events to the event streams of this process. Streams run on event loops, publishers on any thread.
+    """
+
+    def __init__(self, queue_size, replay):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._recent = deque(maxlen=replay)
+        self._epoch = uuid.uuid4().hex[:8]
+        self._next_id = 1
+
+    def publish(self, event, data):
+        with self._lock:
+            message = (f'{self._epoch}-{self._next_id}', event, data)
+            self._next_id += 1
+            self._recent.append(message)
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, message)
+            except RuntimeError:
+                self.unsubscribe(queue)  # the loop is closed
+
+    def _offer(self, queue, message):
+        if queue.full():
+            # The client fell behind: it reloads instead of receiving a partial history.
+            while not queue.empty():
+                queue.get_nowait()
+            message = RESET
+        queue.put_nowait(message)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Registers a stream on the running event loop.
+
+        Returns:
+        tuple: The stream's asyncio.Queue and the events it missed since `last_event_id`, or None if they are not
+        known.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+            if not last_event_id:
+                return queue, []
+            ids = [message[0] for message in self._recent]
+            if last_event_id not in ids:
+                return queue, None
+            return queue, list(self._recent)[ids.index(last_event_id) + 1:]
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = get_live_settings()
+                _broker = Broker(config['QUEUE_SIZE'], config['REPLAY'])
+    return _broker
+
+
+def broadcast(event, data):
+    """
+    Sends an event to the dashboards connected to every node.
+    """
+    if not get_live_settings()['ENABLED']:
+        return
+    get_broker().publish(event, data)
+    invalidation_bus.publish('live', name=event, data=data)
+
+
+async def abroadcast(event, data):
+    if not get_live_settings()['ENABLED']:
+        return
+    get_broker().publish(event, data)
+    await invalidation_bus.apublish('live', name=event, data=data)
+
+
+def shipment_event(shipment):
+    created_at = shipment.created_at
+    if isinstance(created_at, str):
+        created_at = parse_datetime(created_at)
+    return {
+        'shipment_id': shipment.shipment_id,
+        'merchant': shipment.merchant,
+        'shipping_number': shipment.shipping_number,
+        # Formatted as the dashboard template renders it.
+        'created_at': formats.date_format(timezone.localtime(created_at), 'DATETIME_FORMAT') if created_at else '',
+        'phone': (shipment.ship_from or {}).get('phone', ''),
+        'url': reverse('shipments:shipment_detail', args=[shipment.shipment_id]),
+    }
+
+
+def status_event(shipment_status):
+    return {'shipment_id': shipment_status.shipment_id, 'merchant': shipment_status.shipment.merchant,
+            'status': shipment_status.status}
+
+
+def announce_shipment(shipment):
+    """
+    Announces a new shipment to the live dashboards once the current transaction commits.
+    """
+    data = shipment_event(shipment)
+    transaction.on_commit(lambda: broadcast('shipment', data))
+
+
+def announce_status(shipment_status):
+    """
+    Announces a new status to the live dashboards once the current transaction commits.
+    """
+    data = status_event(shipment_status)
+    transaction.on_commit(lambda: broadcast('status', data))
+
+
+async def aannounce_shipment(shipment):
+    # The async ORM runs in autocommit mode, so the shipment is already committed.
+    await abroadcast('shipment', shipment_event(shipment))
+
+
+async def aannounce_status(shipment_status):
+    await abroadcast('status', status_event(shipment_status))
+
+
+def format_event(message):
+    event_id, event, data = message
+    lines = [f'id: {event_id}'] if event_id else []
+    lines += [f'event: {event}', f'data: {json.dumps(data, separators=(",", ":"))}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def visible(message, merchant):
+    # Events without a merchant, such as 'reset', go to everyone.
+    return merchant is ALL_MERCHANTS or message[2].get('merchant', merchant) == merchant
+
+
+async def event_stream(broker, last_event_id, config, merchant=ALL_MERCHANTS):
+    # Subscribes once the response is iterated, so a response that never is, e.g. because the client went away,
+    # leaves no queue behind.
+    queue, missed = broker.subscribe(last_event_id)
+    try:
+        yield f"retry: {config['RETRY_MS']}\n\n"
+        for message in [RESET] if missed is None else missed:
+            if visible(message, merchant):
+                yield format_event(message)
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), config['HEARTBEAT'])
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection.
+                yield ': ping\n\n'
+                continue
+            if visible(message, merchant):
+                yield format_event(message)
+    finally:
+        broker.unsubscribe(queue)
+
+
+async def live_events(request):
+    """
+    Streams new shipments and status changes to the dashboard as server-sent events.
+
+    Events:
+    shipment: {"shipment_id", "merchant", "shipping_number", "created_at", "phone", "url"}
+    status: {"shipment_id", "merchant", "status"}
+    reset: {} -- the client should reload the page.
+
+    Anonymous users get 204 as well, so that a logged out dashboard stops reconnecting.
+    """
+    config = get_live_settings()
+    if not config['ENABLED'] or not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    if not (await request.auser()).is_authenticated:
+        return HttpResponse(status=204)
+    merchant = await aget_request_merchant(request)
+    response = StreamingHttpResponse(event_stream(get_broker(), request.headers.get('Last-Event-ID'), config, merchant),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _on_live(message):
+    get_broker().publish(message['name'], message['data'])
+
+
+invalidation_bus.subscribe('live', _on_live)
@@ -0,0 +1,111 @@
+"""
+Per-shipment serialization of webhook processing.
+
+Salla can deliver the events of one shipment back to back, e.g. `shipment.creating` followed by
+`shipment.cancelled`, and with several workers they can be processed at the same time: both see no shipment and
+insert it, or the cancellation is recorded before the creation. `shipment_lock()` makes the events of one shipment
+run one after the other, while events of different shipments still run in parallel.
+
+On PostgreSQL it takes a session-level advisory lock keyed on the shipment ID, which holds across threads, processes
+and nodes. The lock does not need a transaction, so the service keeps running in autocommit mode, and it is released
+on exit or when the connection closes. Other databases fall back to a fixed set of re-entrant lanes picked by hashing
+the shipment ID, which only serialize the threads of one process.
+
+A waiter gives up after WAIT_TIMEOUT seconds with ShipmentLockTimeout rather than holding its worker, and its
+database connection, for as long as the holder takes; the webhook is then answered with a 503 for Salla to retry.
+"""
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+
+from .models import Shipment
+
+# The first key of the two-key advisory lock functions ('SHIP'), so that other users of advisory locks on the same
+# database never collide with shipment IDs.
+LOCK_NAMESPACE = 0x53484950
+LANES = 64
+# Seconds a worker waits for the lock of a shipment, and the interval at which it retries on PostgreSQL.
+WAIT_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+
+_lanes = [threading.RLock() for _ in range(LANES)]
+
+
+class ShipmentLockTimeout(Exception):
+    """
+    Raised when the lock of a shipment is not released within WAIT_TIMEOUT seconds.
+    """
+
+
+def _connection():
+    return connections[router.db_for_write(Shipment)]
+
+
+def acquire(shipment_id):
+    connection = _connection()
+    if connection.vendor == 'postgresql':
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [LOCK_NAMESPACE, int(shipment_id)])
+                if cursor.fetchone()[0]:
+                    return
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(POLL_INTERVAL)
+    elif _lanes[hash(int(shipment_id)) % LANES].acquire(timeout=WAIT_TIMEOUT):
+        return
+    raise ShipmentLockTimeout(f"Shipment {shipment_id} is locked by another worker")
+
+
+def release(shipment_id):
+    connection = _connection()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [LOCK_NAMESPACE, int(shipment_id)])
+    else:
+        _lanes[hash(int(shipment_id)) % LANES].release()
+
+
+@contextmanager
+def shipment_lock(shipment_id):
+    """
+    Holds the processing lock of a shipment, waiting for another thread or worker that holds it.
+
+    Args:
+    shipment_id (int): The shipment ID. No lock is taken when it is None, e.g. for payloads the service rejects.
+
+    Raises:
+    ShipmentLockTimeout: If the lock is not released within WAIT_TIMEOUT seconds.
+
+    Example:
+    with shipment_lock(shipment_data.get('shipment_id')):
+        ...
+    """
+    if shipment_id is None:
+        yield
+        return
+    acquire(shipment_id)
+    try:
+        yield
+    finally:
+        release(shipment_id)
+
+
+@asynccontextmanager
+async def ashipment_lock(shipment_id):
+    """
+    Async version of `shipment_lock`. The lock is taken on the connection of the thread that runs the async ORM's
+    queries, so it is released on the same connection.
+    """
+    if shipment_id is None:
+        yield
+        return
+    await sync_to_async(acquire)(shipment_id)
+    try:
+        yield
+    finally:
+        await sync_to_async(release)(shipment_id)
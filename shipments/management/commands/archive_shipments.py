@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shipments.services.archive_service import ARCHIVE_MODES, archive_shipments
+
+
+class Command(BaseCommand):
+    help = 'Archive delivered and cancelled shipments, with their statuses, past the retention horizon'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=180,
+                            help='Days a delivered or cancelled shipment stays in the live tables')
+        parser.add_argument('--mode', choices=ARCHIVE_MODES, default='table',
+                            help='Store archived shipments in the archive table or in compressed NDJSON files')
+        parser.add_argument('--output-dir', help='Directory for NDJSON segments (ndjson mode only)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the shipments that would be archived')
+
+    def handle(self, *args, **options):
+        try:
+            archived = archive_shipments(
+                options['retention_days'],
+                mode=options['mode'],
+                output_dir=options['output_dir'],
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                progress=lambda total: self.stdout.write(f'Archived {total} shipments...'),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['dry_run']:
+            self.stdout.write(f'{archived} shipments would be archived')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully archived {archived} shipments'))
@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shipments.benchmarks.startup import TARGETS, run_startup_benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Measure start-up time, resident memory and loaded dependencies of WSGI/ASGI workers and management '
+            'commands, optionally failing when a budget is exceeded')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--targets', default=','.join(TARGETS), help='Comma-separated targets to measure')
+        parser.add_argument('--commands', default='check',
+                            help='Comma-separated management commands to measure, e.g. "check,showmigrations"')
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes per target')
+        parser.add_argument('--output', help='Where to write the JSON results')
+        parser.add_argument('--max-import-ms', type=float, help='Fail if any target takes longer to start')
+        parser.add_argument('--max-rss-mb', type=float, help='Fail if any target uses more resident memory')
+        parser.add_argument('--forbid-modules', default='weasyprint',
+                            help='Comma-separated dependencies, from HEAVY_MODULES, that no target may load at '
+                                 'start-up')
+
+    def handle(self, *args, **options):
+        targets = [name.strip() for name in options['targets'].split(',') if name.strip()]
+        commands = [command.strip() for command in options['commands'].split(',') if command.strip()]
+        forbidden = {name.strip() for name in options['forbid_modules'].split(',') if name.strip()}
+        try:
+            results = run_startup_benchmarks(targets, commands, runs=options['runs'])
+        except (ValueError, RuntimeError) as e:
+            raise CommandError(str(e))
+
+        violations = []
+        for label, result in results.items():
+            self.stdout.write(f"{label:<28} start-up {result['import_ms']:>7} ms (wall {result['wall_ms']} ms), "
+                              f"RSS {result['rss_mb']} MiB, {result['modules']} modules, "
+                              f"heavy: {', '.join(result['heavy_modules']) or '-'}")
+            if options['max_import_ms'] is not None and result['import_ms'] > options['max_import_ms']:
+                violations.append(f"{label} took {result['import_ms']} ms (budget {options['max_import_ms']} ms)")
+            if options['max_rss_mb'] is not None and result['rss_mb'] > options['max_rss_mb']:
+                violations.append(f"{label} used {result['rss_mb']} MiB (budget {options['max_rss_mb']} MiB)")
+            loaded = forbidden.intersection(result['heavy_modules'])
+            if loaded:
+                violations.append(f"{label} loaded {', '.join(sorted(loaded))} at start-up")
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if violations:
+            raise CommandError('Start-up budget exceeded:\n' + '\n'.join(violations))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shipments.services.bulk_status_service import bulk_status_update, read_manifest
+
+
+class Command(BaseCommand):
+    help = 'Give many shipments the same status, from a list of shipment IDs or a courier manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', help='The new status, e.g. delivered')
+        parser.add_argument('shipment_ids', nargs='*', type=int, help='Shipment IDs')
+        parser.add_argument('--manifest', help='A CSV file with a shipment_id, shipping_number or tracking_number '
+                                               'column, or one shipment ID per line')
+        parser.add_argument('--no-notify', action='store_true',
+                            help='Do not send shipment emails and Salla status updates')
+
+    def handle(self, *args, **options):
+        shipment_ids = list(options['shipment_ids'])
+        unmatched = []
+        try:
+            if options['manifest']:
+                with open(options['manifest'], encoding='utf-8-sig', newline='') as manifest:
+                    manifest_ids, unmatched = read_manifest(manifest)
+                shipment_ids += manifest_ids
+            if not shipment_ids and not unmatched:
+                raise CommandError('Give shipment IDs or a --manifest')
+            result = bulk_status_update(shipment_ids, options['status'], notify=not options['no_notify'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        if result['missing']:
+            self.stdout.write(self.style.WARNING(
+                f"Shipments not found: {', '.join(str(shipment_id) for shipment_id in result['missing'])}"))
+        if unmatched:
+            self.stdout.write(self.style.WARNING(f"Manifest numbers not found: {', '.join(unmatched)}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully marked {result['updated']} shipments as {options['status']}"))
@@ -1,22 +1,97 @@
 from django.core.management.base import BaseCommand
-from django.db import models
-from shipments.models import Shipment
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When, Window
+from django.db.models.functions import FirstValue, RowNumber
+from shipments.models import Shipment, ShipmentStatus
+
+# Each pass groups shipments by these fields; shipments with an empty key are never duplicates.
+DUPLICATE_KEYS = {
+    'shipping_number': (['shipping_number'], ~Q(shipping_number='')),
+    'tracking_number': (['merchant', 'tracking_number'], Q(tracking_number__isnull=False) & ~Q(tracking_number='')),
+}
 
 
 class Command(BaseCommand):
-    help = 'Cleanup duplicate shipments by shipping_number'
+    help = ('Cleanup duplicate shipments by shipping_number, and by tracking_number within a merchant. '
+            'The oldest shipment of each group survives and inherits the statuses of the duplicates.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be removed without changing anything')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of duplicates removed per transaction')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        removed = 0
+
+        for key in DUPLICATE_KEYS:
+            duplicates = self.find_duplicates(key)
+            total = len(duplicates)
+            self.stdout.write(f'{total} duplicate shipments found by {key}')
+
+            for start in range(0, total, batch_size):
+                batch = dict(duplicates[start:start + batch_size])
+                if dry_run:
+                    statuses = ShipmentStatus.objects.filter(shipment_id__in=batch).count()
+                    self.stdout.write(f'{key}: would remove {min(start + batch_size, total)}/{total} shipments '
+                                      f'and re-point {statuses} statuses')
+                    continue
+                statuses, merged = self.remove_batch(batch)
+                self.stdout.write(f'{key}: removed {min(start + batch_size, total)}/{total} shipments, '
+                                  f're-pointed {statuses} statuses, merged {merged} identical statuses')
+            removed += total
+
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f'Dry run: {removed} duplicate shipments would be removed'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully cleaned up {removed} duplicate shipments'))
 
-    def handle(self, *args, **kwargs):
-        duplicates = (
-            Shipment.objects.values('shipping_number')
-            .annotate(count=models.Count('event'))
-            .filter(count__gt=1)
+    def find_duplicates(self, key):
+        """
+        Returns (duplicate shipment_id, survivor shipment_id) pairs for one duplicate key.
+
+        A single window query ranks each group by created_at then shipment_id, so the survivor is deterministic.
+        """
+        fields, condition = DUPLICATE_KEYS[key]
+        partition = [F(field) for field in fields]
+        order = [F('created_at').asc(nulls_last=True), F('shipment_id').asc()]
+        return list(
+            Shipment.objects
+            .filter(condition)
+            .annotate(
+                rank=Window(RowNumber(), partition_by=partition, order_by=order),
+                survivor=Window(FirstValue('shipment_id'), partition_by=partition, order_by=order),
+            )
+            .filter(rank__gt=1)
+            .order_by('shipment_id')
+            .values_list('shipment_id', 'survivor')
         )
 
-        for duplicate in duplicates:
-            shipping_number = duplicate['shipping_number']
-            shipments = Shipment.objects.filter(shipping_number=shipping_number)
-            for shipment in shipments[1:]:
-                shipment.delete()
+    @transaction.atomic
+    def remove_batch(self, batch):
+        """
+        Moves the statuses of a batch of duplicates onto their survivors and deletes the duplicates.
+
+        Returns the number of re-pointed statuses and the number of identical statuses merged away.
+        """
+        statuses = ShipmentStatus.objects.filter(shipment_id__in=batch).update(
+            shipment_id=Case(*[When(shipment_id=duplicate, then=Value(survivor))
+                               for duplicate, survivor in batch.items()])
+        )
+
+        identical = list(
+            ShipmentStatus.objects
+            .filter(shipment_id__in=set(batch.values()))
+            .annotate(rank=Window(
+                RowNumber(),
+                partition_by=[F('shipment_id'), F('status'), F('date_time')],
+                order_by=F('id').asc(),
+            ))
+            .filter(rank__gt=1)
+            .values_list('id', flat=True)
+        )
+        merged, _ = ShipmentStatus.objects.filter(id__in=identical).delete()
 
-        self.stdout.write(self.style.SUCCESS('Successfully cleaned up duplicate shipments'))
+        Shipment.objects.filter(shipment_id__in=batch).delete()
+        Shipment.sync_current_status(set(batch.values()))
+        return statuses, merged
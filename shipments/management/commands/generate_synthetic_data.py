@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from shipments.benchmarks.data import generate_synthetic_data
+from shipments.services.analytics_service import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic merchants, shipments and status histories for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shipments', type=int, default=10000, help='Number of shipments to create')
+        parser.add_argument('--merchants', type=int, default=50, help='Number of merchants to spread shipments over')
+        parser.add_argument('--days', type=int, default=180, help='Spread shipment creation over this many days')
+        parser.add_argument('--seed', type=int, help='Random seed for a reproducible data set')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--rebuild-analytics', action='store_true',
+                            help='Rebuild the analytics rollups after generating the data')
+
+    def handle(self, *args, **options):
+        shipments, statuses = generate_synthetic_data(
+            options['shipments'],
+            merchants=options['merchants'],
+            days=options['days'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            progress=lambda total: self.stdout.write(f'Created {total} shipments...'),
+        )
+        if options['rebuild_analytics']:
+            rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Successfully generated {shipments} shipments and {statuses} statuses'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shipments.services.analytics_service import rebuild_rollups
+from shipments.services.import_service import IMPORT_FORMATS, import_shipments
+
+
+class Command(BaseCommand):
+    help = 'Bulk import a Salla shipment export (NDJSON or CSV, optionally gzip-compressed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the export file')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Export format; detected from the file name by default')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Records loaded per transaction')
+        parser.add_argument('--label-base-url', help='Public base URL for label links of new shipments, '
+                                                     'e.g. https://techsynapse.org')
+        parser.add_argument('--skip-analytics', action='store_true',
+                            help='Do not rebuild the analytics rollups for the imported period')
+
+    def handle(self, *args, **options):
+        try:
+            stats = import_shipments(
+                options['path'],
+                fmt=options['format'],
+                batch_size=options['batch_size'],
+                label_base_url=options['label_base_url'],
+                progress=lambda stats: self.stdout.write(
+                    f"Imported {stats['records']} records ({stats['shipments']} new shipments)..."
+                ),
+            )
+        except FileNotFoundError:
+            raise CommandError(f"File not found: {options['path']}")
+
+        if stats['first_status_at'] and not options['skip_analytics']:
+            self.stdout.write('Rebuilding analytics rollups for the imported period...')
+            rebuild_rollups(since=stats['first_status_at'].date())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully imported {stats['records']} records: {stats['shipments']} new shipments, "
+            f"{stats['statuses']} statuses, {stats['skipped']} skipped"
+        ))
@@ -0,0 +1,90 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from shipments.models import ShipmentStatus
+
+TABLE = ShipmentStatus._meta.db_table
+LEGACY_TABLE = f'{TABLE}_legacy'
+SEQUENCE = f'{TABLE}_id_seq_part'
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = ('Convert the shipment status history into monthly PostgreSQL range partitions on date_time, '
+            'and create the partitions for the coming months')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of future monthly partitions to keep ready')
+        parser.add_argument('--keep-legacy', action='store_true',
+                            help=f'Keep the unpartitioned table as {LEGACY_TABLE} after the conversion')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Status history partitioning requires PostgreSQL')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+            row = cursor.fetchone()
+            if row is None:
+                raise CommandError(f'Table {TABLE} does not exist; run migrate first')
+
+            first_month = timezone.localdate().replace(day=1)
+            if row[0] != 'p':
+                cursor.execute(f"SELECT min(date_time) FROM {TABLE}")
+                oldest = cursor.fetchone()[0]
+                if oldest:
+                    first_month = timezone.localtime(oldest).date().replace(day=1)
+                self.convert(cursor, first_month, options['months_ahead'], options['keep_legacy'])
+            else:
+                self.create_partitions(cursor, first_month, options['months_ahead'])
+
+        self.stdout.write(self.style.SUCCESS(f'{TABLE} is partitioned by month'))
+
+    def convert(self, cursor, first_month, months_ahead, keep_legacy):
+        self.stdout.write(f'Converting {TABLE} into a partitioned table...')
+        cursor.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}")
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}")
+        cursor.execute(f"""
+            CREATE TABLE {TABLE} (
+                id bigint NOT NULL DEFAULT nextval('{SEQUENCE}'),
+                status varchar(100) NOT NULL,
+                date_time timestamp with time zone NOT NULL,
+                shipment_id integer NOT NULL
+                    REFERENCES shipments_shipment (shipment_id) DEFERRABLE INITIALLY DEFERRED,
+                CONSTRAINT {TABLE}_part_pkey PRIMARY KEY (id, date_time)
+            ) PARTITION BY RANGE (date_time)
+        """)
+        cursor.execute(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id")
+        cursor.execute(f"CREATE INDEX {TABLE}_shipment_date_idx ON {TABLE} (shipment_id, date_time)")
+        cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+        self.create_partitions(cursor, first_month, months_ahead)
+
+        cursor.execute(f"""
+            INSERT INTO {TABLE} (id, status, date_time, shipment_id)
+            SELECT id, status, date_time, shipment_id FROM {LEGACY_TABLE}
+        """)
+        self.stdout.write(f'Copied {cursor.rowcount} statuses')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)")
+        if not keep_legacy:
+            cursor.execute(f"DROP TABLE {LEGACY_TABLE}")
+
+    def create_partitions(self, cursor, first_month, months_ahead):
+        last_month = add_months(timezone.localdate().replace(day=1), months_ahead)
+        month = first_month
+        while month <= last_month:
+            following = add_months(month, 1)
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLE}_y{month:%Y}m{month:%m} PARTITION OF {TABLE}
+                FOR VALUES FROM (%s) TO (%s)
+            """, [month.isoformat(), following.isoformat()])
+            month = following
+        self.stdout.write(f'Partitions ready through {last_month:%Y-%m}')
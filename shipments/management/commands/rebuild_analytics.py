@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from shipments.services.analytics_service import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the delivery analytics rollups from the shipment status history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days on or after this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid date for --since: {options['since']}")
+
+        status_rows, latency_rows = rebuild_rollups(since=since)
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully rebuilt {status_rows} status rollups and {latency_rows} latency rollups'
+        ))
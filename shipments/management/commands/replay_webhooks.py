@@ -0,0 +1,72 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from shipments.services.journal_service import replay_webhooks
+
+
+def parse_moment(value, option):
+    """
+    Parses a date (midnight, local time) or an ISO datetime given on the command line.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date for {option}: {value}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = ('Replay journaled webhooks received in a time range through the webhook handlers, skipping events '
+            'the database already holds')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Replay webhooks received at or after this date or datetime')
+        parser.add_argument('--until', help='Replay webhooks received before this date or datetime')
+        parser.add_argument('--event', action='append', dest='events',
+                            help='Only replay this event, e.g. shipment.creating; may be repeated')
+        parser.add_argument('--merchant', type=int, help='Only replay the webhooks of this merchant')
+        parser.add_argument('--workers', type=int, default=8, help='Threads replaying shipments in parallel')
+        parser.add_argument('--base-url', help='Public base URL for label links of new shipments, '
+                                               'e.g. https://techsynapse.org')
+        parser.add_argument('--notify', action='store_true',
+                            help='Send shipment emails and Salla status updates again')
+        parser.add_argument('--include-app-events', action='store_true',
+                            help='Replay app events such as app.installed too; only shipment events by default')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only decode and parse the webhooks, without handling them')
+
+    def handle(self, *args, **options):
+        since = parse_moment(options['since'], '--since') if options['since'] else None
+        until = parse_moment(options['until'], '--until') if options['until'] else None
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        stats = replay_webhooks(
+            since=since,
+            until=until,
+            events=options['events'],
+            merchant=options['merchant'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            notify=options['notify'],
+            base_url=options['base_url'],
+            progress=lambda total: self.stdout.write(f'Read {total} webhooks...'),
+            include_app=options['include_app_events'],
+        )
+
+        for event, count in sorted(stats['events'].items()):
+            self.stdout.write(f'{event}: {count}')
+        outcomes = ', '.join(f'{count} {outcome}' for outcome, count in sorted(stats['outcomes'].items(), key=str))
+        verb = 'Checked' if options['dry_run'] else 'Replayed'
+        message = f"{verb} {stats['webhooks']} webhooks ({outcomes or 'none'})"
+        if stats['outcomes']['error']:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
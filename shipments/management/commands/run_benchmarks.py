@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shipments.benchmarks.data import generate_synthetic_data
+from shipments.benchmarks.suite import SCENARIOS, compare, environment, run_benchmarks
+from shipments.models import Shipment
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the main request paths (latency percentiles, queries per request, peak memory) and write '
+            'the results to a JSON file')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', help='Comma-separated data set sizes, e.g. 10000,100000,1000000. The data set '
+                                            'is grown with synthetic shipments before each run. Defaults to the '
+                                            'current data only.')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per scenario')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenarios to run')
+        parser.add_argument('--output', default='benchmark_results.json', help='Where to write the JSON results')
+        parser.add_argument('--compare', help='A previous results file to compare against')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for generated data')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        sizes = [int(size) for size in options['sizes'].split(',')] if options['sizes'] else [None]
+
+        report = {'environment': environment(), 'runs': []}
+        for size in sizes:
+            if size is not None:
+                missing = size - Shipment.objects.count()
+                if missing > 0:
+                    self.stdout.write(f'Generating {missing} shipments to reach {size}...')
+                    generate_synthetic_data(missing, seed=options['seed'] + size)
+            self.stdout.write(f'Running benchmarks at {Shipment.objects.count()} shipments...')
+            try:
+                run = run_benchmarks(iterations=options['iterations'], scenarios=scenarios)
+            except ValueError as e:
+                raise CommandError(str(e))
+            report['runs'].append(run)
+            for name, result in run['results'].items():
+                if 'error' in result:
+                    self.stdout.write(self.style.WARNING(f"  {name}: {result['error']}"))
+                else:
+                    self.stdout.write(f"  {name}: p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                                      f"{result['queries']} queries, {result['peak_memory_kb']} KiB peak")
+
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as handle:
+                for line in compare(json.load(handle), report):
+                    self.stdout.write(line)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from shipments.models import Shipment
+
+
+class Command(BaseCommand):
+    help = 'Set the current status of shipments from their latest status, e.g. once after adding the column'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Shipments updated per statement')
+
+    def handle(self, *args, **options):
+        last_id = Shipment.objects.aggregate(last=Max('shipment_id'))['last'] or 0
+        updated = 0
+        # Ranges of shipment IDs keep each UPDATE, and the locks it holds, short.
+        for start in range(0, last_id + 1, options['batch_size']):
+            ids = Shipment.objects.filter(shipment_id__gte=start, shipment_id__lt=start + options['batch_size'])
+            updated += Shipment.sync_current_status(ids.values('shipment_id'))
+            self.stdout.write(f'Updated {updated} shipments...')
+        self.stdout.write(self.style.SUCCESS(f'Successfully updated the current status of {updated} shipments'))
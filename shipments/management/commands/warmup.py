@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shipments.warmup import STEPS, get_warmup_settings, run_warmup
+
+
+class Command(BaseCommand):
+    help = ('Warm up label rendering: compile templates, load fonts, connect to the database and render a throwaway '
+            'label, reporting the time each step takes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', default=','.join(get_warmup_settings()['STEPS']),
+                            help=f"Comma-separated steps out of: {', '.join(STEPS)}")
+        parser.add_argument('--timeout', type=float, help='Seconds to wait for all steps (default WARMUP["TIMEOUT"])')
+
+    def handle(self, *args, **options):
+        steps = [name.strip() for name in options['steps'].split(',') if name.strip()]
+        try:
+            report = run_warmup(steps, timeout=options['timeout'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for name, result in report['steps'].items():
+            duration = '-' if result['duration_ms'] is None else f"{result['duration_ms']} ms"
+            line = f"{name:<10} {result['status']:<8} {duration}"
+            if result.get('error'):
+                line += f" ({result['error']})"
+            self.stdout.write(line)
+        self.stdout.write(f"total      {report['total_ms']} ms")
+
+        if report['timed_out']:
+            raise CommandError('Warmup timed out')
+        if not report['ok']:
+            raise CommandError('Warmup failed')
+        self.stdout.write(self.style.SUCCESS('Warmup complete'))
@@ -0,0 +1,103 @@
+"""
+Prometheus metrics for the shipments app, served in text format at /metrics.
+
+When several worker processes serve the app, set PROMETHEUS_MULTIPROC_DIR in their environment to a directory shared
+by all of them (and emptied on every deploy). Each worker then writes its samples to that directory and /metrics
+aggregates them, so the endpoint reports the whole deployment whichever worker answers the scrape. The variable must
+be set before the process starts; prometheus_client reads it when it is first imported.
+"""
+import hmac
+import os
+
+from django.conf import settings
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000)
+# Webhook event names come from the request body; anything else is counted as 'other' to bound label cardinality.
+WEBHOOK_EVENTS = (
+    'app.store.authorize', 'app.installed', 'app.uninstalled', 'shipment.creating', 'shipment.cancelled',
+)
+
+REQUEST_LATENCY = Histogram(
+    'shipments_http_request_duration_seconds', 'HTTP request latency by URL name.',
+    ['view', 'method', 'status'], buckets=LATENCY_BUCKETS,
+)
+WEBHOOK_EVENTS_TOTAL = Counter(
+    'shipments_webhook_events_total', 'Webhook events processed by event type and response status.',
+    ['event', 'status'],
+)
+WEBHOOK_ADMISSIONS = Counter(
+    'shipments_webhook_admissions_total', 'Inbound webhooks accepted or shed by admission control, by outcome.',
+    ['outcome'],
+)
+WEBHOOK_LATENCY = Histogram(
+    'shipments_webhook_handler_duration_seconds', 'Webhook handler latency by event type.',
+    ['event'], buckets=LATENCY_BUCKETS,
+)
+SALLA_REQUEST_LATENCY = Histogram(
+    'shipments_salla_request_duration_seconds', 'Outbound Salla API call latency by operation and status code.',
+    ['operation', 'status'], buckets=LATENCY_BUCKETS,
+)
+TOKEN_REFRESHES = Counter(
+    'shipments_salla_token_refreshes_total', 'Salla access token refreshes by outcome.',
+    ['outcome'],
+)
+EMAIL_SEND_LATENCY = Histogram(
+    'shipments_email_send_duration_seconds', 'SMTP send time of shipment emails by outcome.',
+    ['outcome'], buckets=LATENCY_BUCKETS,
+)
+PDF_RENDER_LATENCY = Histogram(
+    'shipments_pdf_render_duration_seconds', 'Shipment label PDF render time.',
+    buckets=LATENCY_BUCKETS,
+)
+PDF_SIZE = Histogram(
+    'shipments_pdf_size_bytes', 'Shipment label PDF size.',
+    buckets=SIZE_BUCKETS,
+)
+WARMUP_DURATION = Histogram(
+    'shipments_warmup_duration_seconds', 'Start-up warmup time by step and outcome.',
+    ['step', 'outcome'], buckets=LATENCY_BUCKETS,
+)
+
+
+def webhook_event_label(event):
+    return event if event in WEBHOOK_EVENTS else 'other'
+
+
+def get_registry():
+    """
+    Returns the registry to expose: the aggregate of all workers in multiprocess mode, else this process's registry.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def mark_process_dead(pid):
+    """
+    Removes the live samples of an exited worker. Call it from the process manager, e.g. gunicorn's `child_exit`.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+def metrics_view(request):
+    """
+    Serves the metrics in Prometheus text format.
+
+    Args:
+    request (HttpRequest): The scrape request. When settings.METRICS_TOKEN is set it must carry it as a bearer token.
+
+    Returns:
+    HttpResponse: The exposition, or 403 if the token does not match.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Forbidden', status=403)
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -1,8 +1,13 @@
 import uuid
 from django.utils import timezone
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
+from django.core.exceptions import FieldDoesNotExist
 from datetime import datetime
 
+SHIPPING_NUMBER_ATTEMPTS = 5
+
 
 class ShipmentStatus(models.Model):
     """
@@ -17,6 +22,8 @@ class ShipmentStatus(models.Model):
         None
 
     Instance Methods:
+        save(self), delete(self):
+            Keep the `current_status` of the shipment up to date.
         __str__(self):
             Returns a string representation of the shipment status, e.g., "Shipment Status: Created - 2022-01-01 12:00:00".
     """
@@ -35,6 +42,20 @@ class ShipmentStatus(models.Model):
     status = models.CharField(max_length=100, choices=STATUS_CHOICES)
     date_time = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['shipment', 'date_time']),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Shipment.sync_current_status([self.shipment_id])
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Shipment.sync_current_status([self.shipment_id])
+        return result
+
     def __str__(self):
         """
         Returns a string representation of the shipment status, e.g., "Shipment Status: Created - 2022-01-01 12:00:00".
@@ -73,6 +94,9 @@ class Shipment(models.Model):
         ship_from (JSONField): The details of the shipment origin.
         ship_to (JSONField): The details of the shipment destination.
         meta (JSONField): Additional metadata for the shipment.
+        current_status (CharField): The status of the latest ShipmentStatus, kept in sync by ShipmentStatus and by
+            `sync_current_status` after bulk loads, so that shipments can be filtered and counted by status
+            through an index.
 
     Class Methods:
         search_shipments(cls, query):
@@ -111,34 +135,132 @@ class Shipment(models.Model):
     ship_from = models.JSONField(null=True, blank=True)
     ship_to = models.JSONField(null=True, blank=True)
     meta = models.JSONField(null=True, blank=True)
+    current_status = models.CharField(max_length=100, blank=True, default='', choices=ShipmentStatus.STATUS_CHOICES)
 
     def save(self, *args, **kwargs):
-        if not self.shipping_number:
+        if self.shipping_number:
+            return super().save(*args, **kwargs)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'shipping_number'}
+        # Shipments saved concurrently can be allocated the same number; the unique constraint rejects all but one,
+        # and the others retry with the next free number.
+        for attempt in range(SHIPPING_NUMBER_ATTEMPTS):
             self.shipping_number = self.generate_unique_shipping_number()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic(using=kwargs.get('using')):
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == SHIPPING_NUMBER_ATTEMPTS - 1:
+                    raise
+
+    def apply_changes(self, values):
+        """
+        Sets the given field values on the shipment, keeping track of the ones that differ from the current values.
+
+        Incoming values are converted with the field's to_python() first, so that e.g. an ISO created_at string equals
+        the datetime loaded from the database. JSON fields are compared by value.
+
+        Args:
+            values (dict): Field names and their new values. Names that are not fields of Shipment are ignored.
+
+        Returns:
+            list: The attribute names of the changed fields, to be saved with save(update_fields=...). Empty if
+            nothing changed.
+        """
+        changed = []
+        for name, value in values.items():
+            try:
+                field = self._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if not field.concrete or field.primary_key:
+                continue
+            value = field.to_python(value)
+            if getattr(self, field.attname) != value:
+                setattr(self, field.attname, value)
+                changed.append(field.attname)
+        return changed
 
     @staticmethod
     def generate_unique_shipping_number():
+        return Shipment.allocate_shipping_numbers(1)[0]
+
+    @staticmethod
+    def allocate_shipping_numbers(count):
+        """
+        Allocates a block of consecutive shipping numbers for the current month.
+
+        Args:
+            count (int): The number of shipping numbers to allocate.
+
+        Returns:
+            list: A list of `count` shipping numbers of the form NNNNNNMMYYYY.
+        """
         now = datetime.now()
         month_year = now.strftime("%m%Y")
 
         # Find the highest current shipping number for the current month/year
-        last_shipment = Shipment.objects.filter(created_at__year=now.year, created_at__month=now.month).order_by('shipping_number').last()
+        last_shipping_number = (
+            Shipment.objects.filter(shipping_number__endswith=month_year)
+            .order_by('-shipping_number')
+            .values_list('shipping_number', flat=True)
+            .first()
+        )
 
-        if last_shipment and last_shipment.shipping_number:
-            last_count = int(last_shipment.shipping_number[:6]) + 1
+        if last_shipping_number:
+            last_count = int(last_shipping_number[:6]) + 1
         else:
             last_count = 1
 
-        shipping_number = f"{last_count:06d}{month_year}"
-        return shipping_number
+        return [f"{last_count + offset:06d}{month_year}" for offset in range(count)]
 
     class Meta:
         indexes = [
             models.Index(fields=['shipping_number']),
             models.Index(fields=['shipment_id']),
+            # Merchant-scoped pages list a merchant's shipments newest first and count them by status.
+            models.Index(fields=['merchant', '-created_at'], name='shipment_merchant_created_idx'),
+            models.Index(fields=['merchant', 'current_status'], name='shipment_merchant_status_idx'),
+            # The admin lists shipments newest first, filters them by status or courier and finds them by tracking
+            # number.
+            models.Index(fields=['-created_at'], name='shipment_created_idx'),
+            models.Index(fields=['current_status', '-created_at'], name='shipment_status_created_idx'),
+            models.Index(fields=['courier_name', '-created_at'], name='shipment_courier_created_idx'),
+            models.Index(fields=['tracking_number'], name='shipment_tracking_number_idx'),
         ]
 
+    @classmethod
+    def sync_current_status(cls, shipment_ids=None):
+        """
+        Sets `current_status` from the latest ShipmentStatus, in one UPDATE.
+
+        Args:
+            shipment_ids (iterable, optional): The shipments to update, all of them by default, e.g. after a bulk
+                load of statuses.
+
+        Returns:
+            int: The number of shipments updated.
+        """
+        shipments = cls.objects.all() if shipment_ids is None else cls.objects.filter(shipment_id__in=shipment_ids)
+        return shipments.update(
+            current_status=Coalesce(cls.latest_status_subquery(), models.Value(''))
+        )
+
+    @staticmethod
+    def latest_status_subquery(field='status'):
+        """
+        Builds a subquery selecting a field of each shipment's latest status, for use in annotate().
+
+        Args:
+            field (str): The ShipmentStatus field to select, 'status' by default.
+
+        Returns:
+            Subquery: The latest status of the outer shipment. Ordering by date_time lets the lookup use the
+            (shipment, date_time) index; the id breaks ties between statuses recorded at the same moment.
+        """
+        latest = ShipmentStatus.objects.filter(shipment=models.OuterRef('pk')).order_by('-date_time', '-id')
+        return models.Subquery(latest.values(field)[:1])
+
     @classmethod
     def search_shipments(cls, query):
         """
@@ -215,3 +337,170 @@ class MerchantToken(models.Model):
             str: A string representation of the token, e.g., "Merchant 123".
         """
         return f"Merchant {self.merchant_id}"
+
+
+class StatusRollup(models.Model):
+    """
+    Model representing a daily count of status transitions.
+
+    Rows are keyed by day, merchant, courier and status, and are incremented as
+    each ShipmentStatus is recorded so that dashboards never scan the full status
+    history.
+
+    Attributes:
+        day (DateField): The local date on which the status was recorded.
+        merchant (PositiveIntegerField): The merchant of the shipment, 0 when unknown.
+        courier_name (CharField): The courier of the shipment, empty when unknown.
+        status (CharField): The status that was recorded.
+        count (PositiveIntegerField): The number of transitions into the status.
+    """
+    day = models.DateField()
+    merchant = models.PositiveIntegerField(default=0)
+    courier_name = models.CharField(max_length=100, default='', blank=True)
+    status = models.CharField(max_length=100, choices=ShipmentStatus.STATUS_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'merchant', 'courier_name', 'status'],
+                                    name='unique_status_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['merchant', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.status}: {self.count}"
+
+
+class DeliveryLatencyRollup(models.Model):
+    """
+    Model representing a daily histogram of created-to-delivered latency.
+
+    Each row counts the shipments delivered on a day whose latency fell into one
+    logarithmic bucket (see `shipments.services.analytics_service`), which lets
+    p50/p90/p99 be estimated for any date range without touching raw statuses.
+
+    Attributes:
+        day (DateField): The local date on which the shipment was delivered.
+        merchant (PositiveIntegerField): The merchant of the shipment, 0 when unknown.
+        courier_name (CharField): The courier of the shipment, empty when unknown.
+        bucket (PositiveSmallIntegerField): The latency bucket index.
+        count (PositiveIntegerField): The number of deliveries in the bucket.
+    """
+    day = models.DateField()
+    merchant = models.PositiveIntegerField(default=0)
+    courier_name = models.CharField(max_length=100, default='', blank=True)
+    bucket = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'merchant', 'courier_name', 'bucket'],
+                                    name='unique_delivery_latency_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['merchant', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day} bucket {self.bucket}: {self.count}"
+
+
+class ShipmentArchive(models.Model):
+    """
+    Model representing a shipment that was moved out of the live tables.
+
+    Every archived shipment keeps a small index row here so support can still look it up by shipment_id. The
+    shipment and its status history are stored either inline in `payload` or as one line of a compressed NDJSON
+    file named by `segment`.
+
+    Attributes:
+        shipment_id (PositiveIntegerField): The unique identifier of the archived shipment.
+        merchant (PositiveIntegerField): The unique identifier of the merchant.
+        shipping_number (CharField): The shipping number of the archived shipment.
+        final_status (CharField): The last status of the shipment before it was archived.
+        created_at (DateTimeField): The date and time when the shipment was created.
+        archived_at (DateTimeField): The date and time when the shipment was archived.
+        payload (JSONField): The serialized shipment and statuses, when archived to the table.
+        segment (CharField): The NDJSON file holding the serialized shipment, when archived to files.
+    """
+    shipment_id = models.PositiveIntegerField(unique=True)
+    merchant = models.PositiveIntegerField(null=True, blank=True)
+    shipping_number = models.CharField(max_length=12, blank=True)
+    final_status = models.CharField(max_length=100, choices=ShipmentStatus.STATUS_CHOICES)
+    created_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    payload = models.JSONField(null=True, blank=True)
+    segment = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shipping_number']),
+        ]
+
+    def __str__(self):
+        return f"Archived shipment {self.shipment_id}"
+
+
+class RateLimitBucket(models.Model):
+    """
+    Model representing the token bucket of a webhook rate limit, for deployments without a shared cache.
+
+    The bucket is refilled lazily: `tokens` is the count at `refilled_at`, and each webhook refills it for the time
+    elapsed and takes a token in a single conditional UPDATE (see `shipments.services.throttle_service`).
+
+    Attributes:
+        key (CharField): The limited key, e.g. "merchant:123".
+        tokens (FloatField): The tokens left at `refilled_at`.
+        refilled_at (FloatField): The Unix time of the last refill.
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    tokens = models.FloatField()
+    refilled_at = models.FloatField()
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.1f}"
+
+
+class WebhookJournal(models.Model):
+    """
+    Model representing the raw body of an inbound webhook, kept so that webhooks can be replayed.
+
+    The journal is append-only. Bodies are stored compressed, see `shipments.services.journal_service`.
+
+    Attributes:
+        received_at (DateTimeField): The date and time when the webhook was received.
+        event (CharField): The event name, e.g. 'shipment.creating'.
+        merchant (PositiveIntegerField): The merchant that sent the webhook, when known.
+        body (BinaryField): The compressed request body.
+    """
+    received_at = models.DateTimeField(default=timezone.now)
+    event = models.CharField(max_length=50, blank=True)
+    merchant = models.PositiveIntegerField(null=True, blank=True)
+    body = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.event} at {self.received_at}"
+
+
+class MerchantUser(models.Model):
+    """
+    Model linking a dashboard user to the merchant whose shipments they see.
+
+    Staff users are not linked and see every merchant, see `shipments.scoping`.
+
+    Attributes:
+        user (OneToOneField): The user.
+        merchant (PositiveIntegerField): The unique identifier of the merchant.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, related_name='merchant_user', on_delete=models.CASCADE)
+    merchant = models.PositiveIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user} of merchant {self.merchant}"
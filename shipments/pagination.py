@@ -0,0 +1,54 @@
+"""
+Pagination of large tables in the admin.
+
+The admin changelist counts the rows it pages through with an exact COUNT(*), which on PostgreSQL reads the whole
+table or every row matching the filters, and times out on the shipments and status history tables. The
+EstimatedCountPaginator uses the planner's estimate instead: the table statistics in pg_class for an unfiltered
+list, and the row estimate of EXPLAIN for a filtered one. Small results, and other databases, are still counted
+exactly, so the page links are only approximate when there are too many pages to click through anyway.
+"""
+import json
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# The statistics of a partitioned table are those of its partitions, see `manage.py partition_status_history`.
+TABLE_ESTIMATE_SQL = """
+    SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_class c
+    WHERE c.oid = %s::regclass OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+"""
+
+
+def estimated_count(queryset):
+    """
+    Returns the planner's estimate of the number of rows of a queryset.
+
+    Returns:
+    int: The estimate, or None on databases other than PostgreSQL.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.has_filters():
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(TABLE_ESTIMATE_SQL, [table, table])
+            return int(cursor.fetchone()[0] or 0)
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that counts with `estimated_count()` when the estimate is at least EXACT_BELOW rows.
+    """
+
+    EXACT_BELOW = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is None or estimate < self.EXACT_BELOW:
+            return super().count
+        return estimate
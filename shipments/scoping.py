@@ -0,0 +1,87 @@
+"""
+Merchant scoping of the dashboard.
+
+A user linked to a merchant by a MerchantUser row only sees that merchant's shipments, in every view that lists,
+searches, exports or shows shipments. Staff users see every merchant. Any other user is refused.
+
+Views look the merchant up with `get_request_merchant()` before they touch shipments, and filter with
+`scope_shipments()`, whose queries use the (merchant, ...) indexes of Shipment.
+"""
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+
+from .cache import ALL_SHIPMENTS, merchant_tag
+from .models import MerchantUser
+
+# The scope of staff users.
+ALL_MERCHANTS = None
+
+
+def _merchant_of(user, merchant):
+    if user.is_staff:
+        return ALL_MERCHANTS
+    if merchant is None:
+        raise PermissionDenied("The user is not linked to a merchant")
+    return merchant
+
+
+def get_request_merchant(request):
+    """
+    Returns the merchant whose shipments the user of a request may see, once per request.
+
+    Returns:
+    int: The merchant ID, or ALL_MERCHANTS for staff users.
+
+    Raises:
+    PermissionDenied: If the user is neither staff nor linked to a merchant.
+    """
+    if not hasattr(request, '_merchant'):
+        user = request.user
+        merchant = None
+        if user.is_authenticated and not user.is_staff:
+            merchant = MerchantUser.objects.filter(user_id=user.pk).values_list('merchant', flat=True).first()
+        request._merchant = _merchant_of(user, merchant)
+    return request._merchant
+
+
+async def aget_request_merchant(request):
+    """
+    Async version of `get_request_merchant`.
+    """
+    if not hasattr(request, '_merchant'):
+        user = await request.auser()
+        merchant = None
+        if user.is_authenticated and not user.is_staff:
+            merchant = await MerchantUser.objects.filter(user_id=user.pk).values_list('merchant', flat=True).afirst()
+        request._merchant = _merchant_of(user, merchant)
+    return request._merchant
+
+
+def scope_shipments(queryset, merchant):
+    """
+    Restricts a Shipment queryset to a merchant, unless it is ALL_MERCHANTS.
+    """
+    return queryset if merchant is ALL_MERCHANTS else queryset.filter(merchant=merchant)
+
+
+def check_merchant(shipment, merchant):
+    """
+    Raises:
+    Http404: If the shipment belongs to another merchant, so that other merchants' shipment IDs are not disclosed.
+    """
+    if merchant is not ALL_MERCHANTS and shipment.merchant != merchant:
+        raise Http404("No Shipment matches the given query.")
+
+
+def scope_key(merchant):
+    """
+    Returns the part of cache keys and ETags that differs between scopes.
+    """
+    return 'all' if merchant is ALL_MERCHANTS else f'merchant={merchant}'
+
+
+def scope_tag(merchant):
+    """
+    Returns the cache tag invalidated by writes to any shipment in a scope.
+    """
+    return ALL_SHIPMENTS if merchant is ALL_MERCHANTS else merchant_tag(merchant)
@@ -1,5 +1,42 @@
-from .webhook_service import *
-from .notification_service import *
-from .pdf_service import *
-from .salla_service import *
-from .shipment_service import *
+"""
+Shipment services.
+
+The service functions are importable from this package as before (`from shipments.services import
+handle_status_update`), but each module is only imported when one of its names is first used (PEP 562). Importing
+`shipments.views` or running a management command therefore no longer loads every service and its dependencies.
+"""
+import importlib
+
+_EXPORTS = {
+    'webhook_service': ('webhook_handler', 'dispatch_event', 'awebhook_handler', 'adispatch_event'),
+    'notification_service': ('send_shipment_email', 'send_shipment_emails'),
+    'pdf_service': ('generate_pdf_label', 'render_label_pdf', 'html_to_pdf', 'agenerate_pdf_label',
+                    'arender_label_pdf'),
+    'salla_service': ('handle_store_authorize', 'handle_app_installed', 'handle_app_uninstalled', 'refresh_token',
+                      'get_access_token', 'update_salla_api', 'arefresh_token', 'aget_access_token',
+                      'aupdate_salla_api', 'bulk_update_salla_api'),
+    'shipment_service': ('handle_shipment_creation_or_update', 'handle_shipment_creation', 'handle_shipment_update',
+                         'handle_status_update', 'build_shipment_data', 'parse_shipment_data',
+                         'ahandle_shipment_creation_or_update', 'ahandle_shipment_creation', 'ahandle_shipment_update',
+                         'ahandle_status_update'),
+    'analytics_service': ('latency_bucket', 'bucket_bounds', 'histogram_percentiles', 'record_status_transition',
+                          'record_status_transitions', 'rebuild_rollups', 'get_rollup_report'),
+    'bulk_status_service': ('bulk_status_update', 'read_manifest', 'parse_shipment_ids'),
+    'archive_service': ('archivable_shipments', 'serialize_shipment', 'archive_shipments', 'get_archived_shipment'),
+}
+_MODULE_BY_NAME = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_MODULE_BY_NAME)
+
+
+def __getattr__(name):
+    module = _MODULE_BY_NAME.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
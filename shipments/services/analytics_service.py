@@ -0,0 +1,338 @@
+import logging
+import math
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ..cache import invalidate_all
+from ..models import DeliveryLatencyRollup, ShipmentStatus, StatusRollup
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets grow geometrically: bucket i covers [2**(i/8), 2**((i+1)/8)) minutes,
+# so any percentile read back from the histogram is within ~9% of the true value.
+BUCKETS_PER_DOUBLING = 8
+PERCENTILES = (50, 90, 99)
+GROUP_BY_FIELDS = {
+    'day': 'day',
+    'merchant': 'merchant',
+    'courier': 'courier_name',
+}
+
+
+def latency_bucket(minutes):
+    """
+    Returns the histogram bucket index for a latency expressed in minutes.
+
+    Args:
+    minutes (float): The created-to-delivered latency in minutes.
+
+    Returns:
+    int: The bucket index; latencies under a minute fall into bucket 0.
+    """
+    if minutes <= 1:
+        return 0
+    return int(math.log2(minutes) * BUCKETS_PER_DOUBLING)
+
+
+def bucket_bounds(bucket):
+    """
+    Returns the lower and upper latency bounds, in minutes, of a bucket.
+
+    Args:
+    bucket (int): The bucket index.
+
+    Returns:
+    tuple: A tuple of (lower, upper) bounds in minutes.
+    """
+    lower = 0.0 if bucket == 0 else 2 ** (bucket / BUCKETS_PER_DOUBLING)
+    upper = 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING)
+    return lower, upper
+
+
+def histogram_percentiles(histogram, percentiles=PERCENTILES):
+    """
+    Estimates percentiles from a latency histogram.
+
+    Args:
+    histogram (dict): A mapping of bucket index to count.
+    percentiles (iterable): The percentiles to estimate, e.g. (50, 90, 99).
+
+    Returns:
+    dict: A mapping such as {'p50': 26.3, ...} of latencies in hours, or None values if the histogram is empty.
+
+    The value is linearly interpolated inside the bucket that contains the requested rank.
+    """
+    total = sum(histogram.values())
+    if not total:
+        return {f'p{p}': None for p in percentiles}
+
+    buckets = sorted(histogram.items())
+    result = {}
+    for p in percentiles:
+        rank = total * p / 100
+        seen = 0
+        for bucket, count in buckets:
+            if seen + count >= rank:
+                lower, upper = bucket_bounds(bucket)
+                fraction = (rank - seen) / count if count else 0
+                result[f'p{p}'] = round((lower + (upper - lower) * fraction) / 60, 2)
+                break
+            seen += count
+    return result
+
+
+def _increment(model, amount=1, **keys):
+    """
+    Atomically adds `amount` to the rollup row identified by `keys`, creating it if necessary.
+    """
+    if model.objects.filter(**keys).update(count=F('count') + amount):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(count=amount, **keys)
+    except IntegrityError:
+        # Another worker created the row between our update and insert.
+        model.objects.filter(**keys).update(count=F('count') + amount)
+
+
+def record_status_transition(shipment_status):
+    """
+    Folds a newly saved ShipmentStatus into the daily rollups.
+
+    Args:
+    shipment_status (ShipmentStatus): The status that was just recorded.
+
+    Returns:
+    None
+
+    The status count for the day is incremented. If this is the first 'delivered' status of the shipment, its
+    created-to-delivered latency is added to the latency histogram as well. Errors are logged and swallowed so
+    that analytics can never fail a webhook or a status update.
+    """
+    try:
+        shipment = shipment_status.shipment
+        keys = {
+            'day': timezone.localdate(shipment_status.date_time),
+            'merchant': shipment.merchant or 0,
+            'courier_name': shipment.courier_name or '',
+        }
+        _increment(StatusRollup, status=shipment_status.status, **keys)
+
+        if shipment_status.status != 'delivered' or not shipment.created_at:
+            return
+        already_delivered = (
+            ShipmentStatus.objects
+            .filter(shipment_id=shipment.shipment_id, status='delivered')
+            .exclude(pk=shipment_status.pk)
+            .exists()
+        )
+        if already_delivered:
+            return
+        minutes = (shipment_status.date_time - shipment.created_at).total_seconds() / 60
+        _increment(DeliveryLatencyRollup, bucket=latency_bucket(max(minutes, 0)), **keys)
+    except Exception as e:
+        logger.error("Error recording status transition for analytics: %s", e)
+
+
+def record_status_transitions(shipment_statuses):
+    """
+    Folds many newly saved ShipmentStatus objects into the daily rollups, e.g. after a bulk status update.
+
+    Args:
+    shipment_statuses (list): The statuses that were just recorded, with their shipment loaded.
+
+    Returns:
+    None
+
+    Equivalent to calling `record_status_transition` on each status, with one update per rollup row and one query
+    for the shipments that were delivered before, instead of a few queries per status. Errors are logged and
+    swallowed.
+    """
+    try:
+        status_counts = Counter()
+        histogram = Counter()
+        delivered = [s for s in shipment_statuses if s.status == 'delivered' and s.shipment.created_at]
+        delivered_before = set(
+            ShipmentStatus.objects
+            .filter(shipment_id__in=[s.shipment_id for s in delivered], status='delivered')
+            .exclude(pk__in=[s.pk for s in delivered])
+            .values_list('shipment_id', flat=True)
+        ) if delivered else set()
+
+        for shipment_status in shipment_statuses:
+            shipment = shipment_status.shipment
+            keys = (timezone.localdate(shipment_status.date_time), shipment.merchant or 0, shipment.courier_name or '')
+            status_counts[keys + (shipment_status.status,)] += 1
+        for shipment_status in delivered:
+            if shipment_status.shipment_id in delivered_before:
+                continue
+            delivered_before.add(shipment_status.shipment_id)
+            shipment = shipment_status.shipment
+            minutes = (shipment_status.date_time - shipment.created_at).total_seconds() / 60
+            keys = (timezone.localdate(shipment_status.date_time), shipment.merchant or 0, shipment.courier_name or '')
+            histogram[keys + (latency_bucket(max(minutes, 0)),)] += 1
+
+        for (day, merchant, courier_name, status), count in status_counts.items():
+            _increment(StatusRollup, count, day=day, merchant=merchant, courier_name=courier_name, status=status)
+        for (day, merchant, courier_name, bucket), count in histogram.items():
+            _increment(DeliveryLatencyRollup, count, day=day, merchant=merchant, courier_name=courier_name,
+                       bucket=bucket)
+    except Exception as e:
+        logger.error("Error recording status transitions for analytics: %s", e)
+
+
+def rebuild_rollups(since=None):
+    """
+    Recomputes the rollups from the raw status history.
+
+    Args:
+    since (date, optional): Only rebuild days on or after this date. Rebuilds everything when omitted.
+
+    Returns:
+    tuple: The number of (status, latency) rollup rows written.
+
+    The affected rollup rows are deleted and rewritten in a single transaction. Status counts are aggregated in
+    the database; delivery latencies are streamed and bucketed in Python.
+    """
+    statuses = ShipmentStatus.objects.all()
+    if since:
+        statuses = statuses.filter(date_time__date__gte=since)
+
+    status_rows = (
+        statuses
+        .annotate(day=TruncDate('date_time'))
+        .values('day', 'status', 'shipment__merchant', 'shipment__courier_name')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    status_rollups = [
+        StatusRollup(
+            day=row['day'],
+            merchant=row['shipment__merchant'] or 0,
+            courier_name=row['shipment__courier_name'] or '',
+            status=row['status'],
+            count=row['count'],
+        )
+        for row in status_rows.iterator()
+    ]
+
+    deliveries = (
+        ShipmentStatus.objects
+        .filter(status='delivered', shipment__created_at__isnull=False)
+        .values('shipment_id', 'shipment__created_at', 'shipment__merchant', 'shipment__courier_name')
+        .annotate(delivered_at=Min('date_time'))
+        .order_by()
+    )
+    if since:
+        # Only shipments delivered since then, first delivered since then, instead of the whole history.
+        midnight = timezone.make_aware(datetime.combine(since, time.min))
+        recent = ShipmentStatus.objects.filter(status='delivered', date_time__gte=midnight).values('shipment_id')
+        deliveries = deliveries.filter(shipment_id__in=recent, delivered_at__gte=midnight)
+    histogram = Counter()
+    for row in deliveries.iterator():
+        day = timezone.localdate(row['delivered_at'])
+        if since and day < since:
+            continue
+        minutes = (row['delivered_at'] - row['shipment__created_at']).total_seconds() / 60
+        key = (day, row['shipment__merchant'] or 0, row['shipment__courier_name'] or '', latency_bucket(max(minutes, 0)))
+        histogram[key] += 1
+    latency_rollups = [
+        DeliveryLatencyRollup(day=day, merchant=merchant, courier_name=courier_name, bucket=bucket, count=count)
+        for (day, merchant, courier_name, bucket), count in histogram.items()
+    ]
+
+    with transaction.atomic():
+        stale_status = StatusRollup.objects.all()
+        stale_latency = DeliveryLatencyRollup.objects.all()
+        if since:
+            stale_status = stale_status.filter(day__gte=since)
+            stale_latency = stale_latency.filter(day__gte=since)
+        stale_status.delete()
+        stale_latency.delete()
+        StatusRollup.objects.bulk_create(status_rollups, batch_size=1000)
+        DeliveryLatencyRollup.objects.bulk_create(latency_rollups, batch_size=1000)
+
+    invalidate_all()
+    logger.info("Rebuilt %s status rollups and %s latency rollups", len(status_rollups), len(latency_rollups))
+    return len(status_rollups), len(latency_rollups)
+
+
+def get_rollup_report(start=None, end=None, merchant=None, courier_name=None, group_by='day'):
+    """
+    Builds a chart-friendly report from the rollups.
+
+    Args:
+    start (date, optional): The first day to include. Defaults to 30 days before `end`.
+    end (date, optional): The last day to include. Defaults to today.
+    merchant (int, optional): Restrict the report to one merchant.
+    courier_name (str, optional): Restrict the report to one courier.
+    group_by (str): One of 'day', 'merchant' or 'courier'.
+
+    Returns:
+    dict: A dictionary with the requested range, one series entry per group and the overall totals. Each entry
+    holds status counts, the number of delivered shipments and latency percentiles in hours.
+
+    Raises:
+    ValueError: If `group_by` is not supported.
+    """
+    if group_by not in GROUP_BY_FIELDS:
+        raise ValueError(f"Unsupported group_by '{group_by}'")
+    field = GROUP_BY_FIELDS[group_by]
+    end = end or timezone.localdate()
+    start = start or end - timedelta(days=30)
+
+    filters = {'day__gte': start, 'day__lte': end}
+    if merchant is not None:
+        filters['merchant'] = merchant
+    if courier_name is not None:
+        filters['courier_name'] = courier_name
+
+    counts = defaultdict(dict)
+    total_counts = Counter()
+    status_rows = (
+        StatusRollup.objects.filter(**filters)
+        .values(field, 'status')
+        .annotate(total=Sum('count'))
+        .order_by()
+    )
+    for row in status_rows:
+        counts[row[field]][row['status']] = row['total']
+        total_counts[row['status']] += row['total']
+
+    histograms = defaultdict(Counter)
+    total_histogram = Counter()
+    latency_rows = (
+        DeliveryLatencyRollup.objects.filter(**filters)
+        .values(field, 'bucket')
+        .annotate(total=Sum('count'))
+        .order_by()
+    )
+    for row in latency_rows:
+        histograms[row[field]][row['bucket']] += row['total']
+        total_histogram[row['bucket']] += row['total']
+
+    series = []
+    for key in sorted(set(counts) | set(histograms), key=str):
+        series.append({
+            group_by: key.isoformat() if hasattr(key, 'isoformat') else key,
+            'counts': counts.get(key, {}),
+            'delivered': sum(histograms[key].values()),
+            'latency_hours': histogram_percentiles(histograms[key]),
+        })
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group_by': group_by,
+        'series': series,
+        'totals': {
+            'counts': dict(total_counts),
+            'delivered': sum(total_histogram.values()),
+            'latency_hours': histogram_percentiles(total_histogram),
+        },
+    }
@@ -0,0 +1,197 @@
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.forms.models import model_to_dict
+from django.utils import timezone
+
+from ..cache import invalidate_all
+from ..models import Shipment, ShipmentArchive, ShipmentStatus
+
+logger = logging.getLogger(__name__)
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+ARCHIVE_MODES = ('table', 'ndjson')
+# The fields of an archive row replaced when a shipment that was archived before, e.g. one restored by a webhook
+# replay, is archived again.
+ARCHIVE_FIELDS = ['merchant', 'shipping_number', 'final_status', 'created_at', 'archived_at', 'payload', 'segment']
+
+
+def archivable_shipments(retention_days):
+    """
+    Returns the shipments whose last status is final and older than the retention horizon.
+
+    Args:
+    retention_days (int): The number of days a delivered or cancelled shipment stays in the live tables.
+
+    Returns:
+    QuerySet: A QuerySet of Shipment objects annotated with `final_status` and `final_status_at`, ordered by shipment_id.
+    """
+    horizon = timezone.now() - timedelta(days=retention_days)
+    latest = ShipmentStatus.objects.filter(shipment=OuterRef('pk')).order_by('-date_time', '-id')
+    return (
+        Shipment.objects
+        .annotate(
+            final_status=Subquery(latest.values('status')[:1]),
+            final_status_at=Subquery(latest.values('date_time')[:1]),
+        )
+        .filter(final_status__in=ARCHIVABLE_STATUSES, final_status_at__lt=horizon)
+        .order_by('shipment_id')
+    )
+
+
+def serialize_shipment(shipment, statuses):
+    """
+    Serializes a shipment and its statuses into a JSON-compatible dictionary.
+
+    Args:
+    shipment (Shipment): The shipment to serialize.
+    statuses (iterable): The ShipmentStatus objects of the shipment.
+
+    Returns:
+    dict: A dictionary with the shipment fields and a chronological 'statuses' list.
+    """
+    record = model_to_dict(shipment)
+    record['statuses'] = [
+        {'status': status.status, 'date_time': status.date_time}
+        for status in sorted(statuses, key=lambda s: (s.date_time, s.pk))
+    ]
+    return json.loads(json.dumps(record, cls=DjangoJSONEncoder))
+
+
+def append_to_segment(segment, records):
+    """
+    Appends records to an NDJSON segment as a new gzip member and syncs the file to disk.
+
+    Args:
+    segment (str): The path of the segment file.
+    records (list): The JSON-compatible records to append.
+
+    Returns:
+    int: The size of the file before the records were appended, to truncate it back to.
+    """
+    with open(segment, 'ab') as raw:
+        size = raw.tell()
+        with gzip.GzipFile(fileobj=raw, mode='ab') as handle:
+            for record in records:
+                handle.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    return size
+
+
+def archive_shipments(retention_days, mode='table', output_dir=None, batch_size=500, dry_run=False, progress=None):
+    """
+    Moves delivered and cancelled shipments past the retention horizon into the archive.
+
+    Args:
+    retention_days (int): The number of days a final shipment stays in the live tables.
+    mode (str): 'table' to store payloads in ShipmentArchive, 'ndjson' to write gzip-compressed NDJSON files.
+    output_dir (str, optional): The directory for NDJSON files. Required in 'ndjson' mode.
+    batch_size (int): The number of shipments archived per transaction.
+    dry_run (bool): Count the archivable shipments without moving anything.
+    progress (callable, optional): Called with the running total after each batch.
+
+    Returns:
+    int: The number of shipments archived, or that would be archived in dry-run mode.
+
+    Raises:
+    ValueError: If the mode is unknown or the output directory is missing in 'ndjson' mode.
+
+    Each batch writes the archive records and deletes the live shipments, cascading to their statuses, in one
+    transaction. In 'ndjson' mode all batches of a run are appended to a single segment file, and the
+    ShipmentArchive index row points at it. A shipment that is already archived gets its archive row replaced by
+    the newer copy.
+    """
+    if mode not in ARCHIVE_MODES:
+        raise ValueError(f"Unknown archive mode '{mode}'")
+    if mode == 'ndjson' and not output_dir:
+        raise ValueError("An output directory is required for the 'ndjson' archive mode")
+
+    candidates = archivable_shipments(retention_days)
+    if dry_run:
+        return candidates.count()
+
+    segment = None
+    if mode == 'ndjson':
+        os.makedirs(output_dir, exist_ok=True)
+        segment = os.path.join(output_dir, f"shipments-{timezone.now():%Y%m%d-%H%M%S}.ndjson.gz")
+
+    archived = 0
+    last_id = -1
+    while True:
+        batch = list(candidates.filter(shipment_id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].shipment_id
+
+        statuses = {}
+        for status in ShipmentStatus.objects.filter(shipment_id__in=[s.shipment_id for s in batch]):
+            statuses.setdefault(status.shipment_id, []).append(status)
+        records = [(shipment, serialize_shipment(shipment, statuses.get(shipment.shipment_id, [])))
+                   for shipment in batch]
+
+        # The records are synced to the segment before the shipments are deleted, and cut off again if the
+        # transaction fails, so a failed batch leaves nothing behind in the file.
+        segment_size = append_to_segment(segment, [record for _, record in records]) if segment else None
+        try:
+            with transaction.atomic():
+                ShipmentArchive.objects.bulk_create([
+                    ShipmentArchive(
+                        shipment_id=shipment.shipment_id,
+                        merchant=shipment.merchant,
+                        shipping_number=shipment.shipping_number,
+                        final_status=shipment.final_status,
+                        created_at=shipment.created_at,
+                        payload=None if segment else record,
+                        segment=segment,
+                    )
+                    for shipment, record in records
+                ], update_conflicts=True, unique_fields=['shipment_id'], update_fields=ARCHIVE_FIELDS)
+                Shipment.objects.filter(shipment_id__in=[s.shipment_id for s in batch]).delete()
+        except Exception:
+            if segment:
+                os.truncate(segment, segment_size)
+            raise
+
+        archived += len(batch)
+        logger.info(f"Archived {archived} shipments")
+        if progress:
+            progress(archived)
+
+    if archived:
+        invalidate_all()
+    return archived
+
+
+def get_archived_shipment(shipment_id):
+    """
+    Looks up an archived shipment by its shipment_id.
+
+    Args:
+    shipment_id (int): The unique identifier of the shipment.
+
+    Returns:
+    dict: The serialized shipment with its statuses, or None if it has not been archived.
+    """
+    entry = ShipmentArchive.objects.filter(shipment_id=shipment_id).first()
+    if entry is None:
+        return None
+    if entry.payload is not None:
+        return entry.payload
+    try:
+        with gzip.open(entry.segment, 'rt', encoding='utf-8') as handle:
+            for line in handle:
+                record = json.loads(line)
+                if record.get('shipment_id') == entry.shipment_id:
+                    return record
+    except OSError as e:
+        logger.error(f"Error reading archive segment {entry.segment}: {str(e)}")
+        return None
+    logger.error(f"Shipment {shipment_id} not found in archive segment {entry.segment}")
+    return None
@@ -0,0 +1,148 @@
+"""
+Bulk status updates, e.g. from a courier manifest.
+
+Marking hundreds of shipments delivered with `handle_status_update` costs a few queries, an email and a Salla request
+per shipment, one after the other. `bulk_status_update()` records all the statuses with one bulk_create and sets the
+shipments' current status with one UPDATE, then sends the emails over one mail connection and the Salla updates
+concurrently. It backs the bulk endpoint, the Shipment admin actions and `manage.py bulk_update_status`.
+"""
+import csv
+import logging
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from shipment_management.tracing import set_span_attributes, traced
+
+from ..cache import invalidate_shipments
+from ..live import announce_status
+from ..models import Shipment, ShipmentStatus
+from ..scoping import ALL_MERCHANTS, scope_shipments
+from .analytics_service import record_status_transitions
+from .notification_service import send_shipment_emails
+from .salla_service import bulk_update_salla_api
+from .shipment_service import notifications_enabled
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_SHIPMENTS': 5000,
+    'BATCH_SIZE': 1000,
+    'SALLA_CONCURRENCY': 10,
+}
+# Manifest columns that identify a shipment, in order of preference.
+MANIFEST_COLUMNS = ('shipment_id', 'shipping_number', 'tracking_number')
+
+
+def get_bulk_status_settings():
+    """
+    Returns the BULK_STATUS_UPDATES settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'BULK_STATUS_UPDATES', {})}
+
+
+def parse_shipment_ids(text):
+    """
+    Parses shipment IDs separated by commas or whitespace.
+
+    Raises:
+    ValueError: If one of them is not a number.
+    """
+    ids = []
+    for value in re.split(r'[\s,;]+', text.strip()):
+        if not value:
+            continue
+        if not value.isdigit():
+            raise ValueError(f"Invalid shipment ID: {value}")
+        ids.append(int(value))
+    return ids
+
+
+def read_manifest(lines, merchant=ALL_MERCHANTS):
+    """
+    Returns the shipments listed in a manifest.
+
+    Args:
+    lines (iterable): The lines of a CSV file. If its header names a shipment_id, shipping_number or
+    tracking_number column, that column identifies the shipments; otherwise the first column of each line is a
+    shipment ID.
+    merchant (int, optional): Only match shipping and tracking numbers of this merchant's shipments.
+
+    Returns:
+    tuple: The shipment IDs, and the shipping or tracking numbers that match no shipment.
+
+    Raises:
+    ValueError: If a shipment ID is not a number.
+    """
+    rows = [row for row in csv.reader(lines) if row and row[0].strip()]
+    if not rows:
+        return [], []
+    header = [name.strip().lower() for name in rows[0]]
+    column = next((name for name in MANIFEST_COLUMNS if name in header), None)
+    if column is None:
+        return parse_shipment_ids(' '.join(row[0] for row in rows)), []
+
+    index = header.index(column)
+    values = [row[index].strip() for row in rows[1:] if len(row) > index and row[index].strip()]
+    if column == 'shipment_id':
+        return parse_shipment_ids(' '.join(values)), []
+    shipments = scope_shipments(Shipment.objects.filter(**{f'{column}__in': values}), merchant)
+    found = dict(shipments.values_list(column, 'shipment_id'))
+    return [found[value] for value in values if value in found], [value for value in values if value not in found]
+
+
+@traced('shipment.bulk_status_update')
+def bulk_status_update(shipment_ids, status, merchant=ALL_MERCHANTS, notify=True):
+    """
+    Gives many shipments the same new status.
+
+    Args:
+    shipment_ids (iterable): The shipment IDs. Duplicates are updated once.
+    status (str): The new status, one of ShipmentStatus.STATUS_CHOICES.
+    merchant (int, optional): Only update this merchant's shipments; the others are reported as missing.
+    notify (bool): Send the staff emails and Salla updates, as `handle_status_update` does.
+
+    Returns:
+    dict: 'updated', the number of shipments given the status, and 'missing', the IDs of the shipments that do not
+    exist or belong to another merchant.
+
+    Raises:
+    ValueError: If the status is unknown or there are more than MAX_SHIPMENTS shipments.
+
+    The statuses, the shipments' current status and the cache invalidation are committed together. The analytics
+    rollups and the notifications follow once committed.
+    """
+    config = get_bulk_status_settings()
+    if status not in dict(ShipmentStatus.STATUS_CHOICES):
+        raise ValueError(f"Unknown status: {status}")
+    shipment_ids = list(dict.fromkeys(int(shipment_id) for shipment_id in shipment_ids))
+    if len(shipment_ids) > config['MAX_SHIPMENTS']:
+        raise ValueError(f"At most {config['MAX_SHIPMENTS']} shipments can be updated at once")
+    set_span_attributes(status=status, shipments=len(shipment_ids))
+    logger.info("Updating status of %s shipments to %s", len(shipment_ids), status)
+
+    shipments = list(scope_shipments(Shipment.objects.filter(shipment_id__in=shipment_ids), merchant)
+                     .order_by('shipment_id'))
+    found = {shipment.shipment_id for shipment in shipments}
+    missing = [shipment_id for shipment_id in shipment_ids if shipment_id not in found]
+    now = timezone.now()
+    with transaction.atomic():
+        statuses = ShipmentStatus.objects.bulk_create(
+            [ShipmentStatus(shipment=shipment, status=status, date_time=now) for shipment in shipments],
+            batch_size=config['BATCH_SIZE'],
+        )
+        # bulk_create does not call ShipmentStatus.save(), which keeps current_status in sync.
+        Shipment.sync_current_status(found)
+        invalidate_shipments(shipments)
+        for shipment_status in statuses:
+            announce_status(shipment_status)
+
+    record_status_transitions(statuses)
+    if notify and notifications_enabled.get():
+        if status == 'created' or status == 'cancelled':
+            send_shipment_emails(shipments, status)
+        if status != 'cancelled':
+            bulk_update_salla_api(shipments, status, config['SALLA_CONCURRENCY'])
+    logger.info("Updated status of %s shipments to %s, %s missing", len(shipments), status, len(missing))
+    return {'updated': len(shipments), 'missing': missing}
@@ -0,0 +1,284 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+from itertools import islice
+
+from dateutil.parser import parse as parse_date
+from django.db import connection, transaction
+from django.urls import reverse
+
+from .shipment_service import build_shipment_data
+from ..cache import invalidate_all
+from ..models import Shipment, ShipmentStatus
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+# Webhook events map onto statuses the same way `webhook_handler` does.
+EVENT_STATUSES = {
+    'shipment.creating': 'created',
+    'shipment.cancelled': 'cancelled',
+}
+STATUS_VALUES = {value for value, _ in ShipmentStatus.STATUS_CHOICES}
+TOP_LEVEL_KEYS = ('event', 'merchant', 'created_at')
+# Columns that a re-import must never overwrite on an existing shipment.
+PRESERVED_FIELDS = ('shipment_id', 'shipping_number', 'label', 'current_status')
+COPY_NULL = '\\N'
+
+
+def detect_format(path):
+    """
+    Guesses the import format from a file name.
+
+    Args:
+    path (str): The path of the export file.
+
+    Returns:
+    str: Either 'ndjson' or 'csv'.
+    """
+    name = path.lower()
+    if name.endswith('.csv') or name.endswith('.csv.gz'):
+        return 'csv'
+    return 'ndjson'
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def _decode(value):
+    if value is None or value == '':
+        return None
+    if value[0] in '{[':
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _csv_record(row):
+    """
+    Turns a CSV row into a Salla event dictionary.
+
+    Rows either carry the event payload as a JSON `data` column, or one column per payload field with nested
+    values (ship_to, packages, ...) encoded as JSON.
+    """
+    record = {key: row.get(key) for key in TOP_LEVEL_KEYS}
+    if row.get('data'):
+        record['data'] = json.loads(row['data'])
+    else:
+        record['data'] = {key: _decode(value) for key, value in row.items() if key not in TOP_LEVEL_KEYS}
+    if record['data'].get('id') is not None:
+        record['data']['id'] = int(record['data']['id'])
+    return record
+
+
+def iter_records(path, fmt=None):
+    """
+    Streams Salla shipment events from an NDJSON or CSV export, optionally gzip-compressed.
+
+    Args:
+    path (str): The path of the export file.
+    fmt (str, optional): 'ndjson' or 'csv'. Detected from the file name when omitted.
+
+    Yields:
+    dict: One Salla shipment event per record.
+    """
+    fmt = fmt or detect_format(path)
+    with _open(path) as handle:
+        if fmt == 'csv':
+            for row in csv.DictReader(handle):
+                yield _csv_record(row)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _record_status(record, status):
+    status = EVENT_STATUSES.get(record.get('event'), status)
+    return status if status in STATUS_VALUES else None
+
+
+def _map_batch(records, stats):
+    """
+    Maps a batch of events through `build_shipment_data`.
+
+    Returns the shipments keyed by shipment_id, the last event winning, and the list of (shipment_id, status,
+    date_time) tuples to record.
+    """
+    shipments = {}
+    statuses = []
+    for record in records:
+        try:
+            shipment_data, status = build_shipment_data(record)
+            if not shipment_data['shipment_id']:
+                raise ValueError("Missing shipment id")
+        except Exception as e:
+            stats['skipped'] += 1
+            logger.warning(f"Skipping import record: {str(e)}")
+            continue
+        shipments[shipment_data['shipment_id']] = {
+            key: value for key, value in shipment_data.items()
+            if value is not None or Shipment._meta.get_field(key).null
+        }
+        status = _record_status(record, status)
+        if status:
+            statuses.append((shipment_data['shipment_id'], status, parse_date(shipment_data['created_at'])))
+    return shipments, statuses
+
+
+def _prepare_new_shipments(shipments, label_base_url):
+    """
+    Gives the shipments that are not in the database yet a shipping number, allocated in one block, and a label.
+    """
+    existing = set(Shipment.objects.filter(shipment_id__in=shipments).values_list('shipment_id', flat=True))
+    new_ids = sorted(set(shipments) - existing)
+    for shipment_id, shipping_number in zip(new_ids, Shipment.allocate_shipping_numbers(len(new_ids))):
+        shipments[shipment_id]['shipping_number'] = shipping_number
+        if label_base_url:
+            path = reverse('shipments:generate_pdf_label', args=[shipment_id])
+            shipments[shipment_id]['label'] = {'url': label_base_url.rstrip('/') + path}
+    return len(new_ids)
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([COPY_NULL if value is None else value for value in row])
+    buffer.seek(0)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sql, buffer)
+    else:
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def _load_with_copy(shipments, statuses):
+    """
+    Loads a batch through COPY into temporary staging tables and upserts it into the live tables.
+    """
+    fields = Shipment._meta.concrete_fields
+    columns = [field.column for field in fields]
+    shipment_table = Shipment._meta.db_table
+    status_table = ShipmentStatus._meta.db_table
+
+    def value(field, data):
+        raw = data.get(field.attname)
+        if raw is None and not field.null:
+            return field.get_default()
+        if raw is not None and field.get_internal_type() == 'JSONField':
+            return json.dumps(raw, ensure_ascii=False)
+        return raw
+
+    updates = ', '.join(f'{field.column} = EXCLUDED.{field.column}'
+                        for field in fields if field.attname not in PRESERVED_FIELDS)
+    with connection.cursor() as cursor:
+        # ON COMMIT DROP cleans up after each batch; the DROP covers batches nested in an outer transaction.
+        cursor.execute("DROP TABLE IF EXISTS import_shipment_staging, import_status_staging")
+        cursor.execute(f"CREATE TEMP TABLE import_shipment_staging (LIKE {shipment_table}) ON COMMIT DROP")
+        cursor.execute("CREATE TEMP TABLE import_status_staging "
+                       "(shipment_id integer, status varchar(100), date_time timestamptz) ON COMMIT DROP")
+        _copy_rows(cursor, 'import_shipment_staging', columns,
+                   ([value(field, data) for field in fields] for data in shipments.values()))
+        _copy_rows(cursor, 'import_status_staging', ['shipment_id', 'status', 'date_time'],
+                   ((shipment_id, status, date_time.isoformat()) for shipment_id, status, date_time in statuses))
+
+        cursor.execute(f"""
+            INSERT INTO {shipment_table} ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM import_shipment_staging
+            ON CONFLICT (shipment_id) DO UPDATE SET {updates}
+        """)
+        cursor.execute(f"""
+            INSERT INTO {status_table} (shipment_id, status, date_time)
+            SELECT DISTINCT s.shipment_id, s.status, s.date_time FROM import_status_staging s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {status_table} t
+                WHERE t.shipment_id = s.shipment_id AND t.status = s.status AND t.date_time = s.date_time
+            )
+        """)
+        return cursor.rowcount
+
+
+def _load_with_bulk_create(shipments, statuses):
+    """
+    Loads a batch with bulk_create on databases without COPY.
+    """
+    update_fields = [field.name for field in Shipment._meta.concrete_fields if field.attname not in PRESERVED_FIELDS]
+    Shipment.objects.bulk_create(
+        [Shipment(**data) for data in shipments.values()],
+        update_conflicts=True,
+        unique_fields=['shipment_id'],
+        update_fields=update_fields,
+    )
+    existing = set(
+        ShipmentStatus.objects
+        .filter(shipment_id__in={shipment_id for shipment_id, _, _ in statuses})
+        .values_list('shipment_id', 'status', 'date_time')
+    )
+    new_statuses = [
+        ShipmentStatus(shipment_id=shipment_id, status=status, date_time=date_time)
+        for shipment_id, status, date_time in dict.fromkeys(statuses)
+        if (shipment_id, status, date_time) not in existing
+    ]
+    ShipmentStatus.objects.bulk_create(new_statuses)
+    return len(new_statuses)
+
+
+def import_shipments(path, fmt=None, batch_size=5000, label_base_url=None, progress=None):
+    """
+    Bulk imports a Salla shipment export into Shipment and ShipmentStatus.
+
+    Args:
+    path (str): The path of the NDJSON or CSV export, optionally gzip-compressed.
+    fmt (str, optional): 'ndjson' or 'csv'. Detected from the file name when omitted.
+    batch_size (int): The number of records loaded per transaction.
+    label_base_url (str, optional): The public base URL used to build label links for new shipments.
+    progress (callable, optional): Called with the running statistics after each batch.
+
+    Returns:
+    dict: Counts of 'records' read, 'shipments' created, 'statuses' recorded and records 'skipped'.
+
+    Raises:
+    FileNotFoundError: If the export file does not exist.
+
+    Records are streamed and mapped through the same logic as the webhook. Each batch is loaded with PostgreSQL COPY
+    into staging tables and upserted, or with bulk_create on other databases. Re-importing the same file is
+    idempotent: existing shipments keep their shipping number and label, and identical statuses are not duplicated.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    stats = {'records': 0, 'shipments': 0, 'statuses': 0, 'skipped': 0, 'first_status_at': None}
+    load = _load_with_copy if connection.vendor == 'postgresql' else _load_with_bulk_create
+    records = iter_records(path, fmt)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        stats['records'] += len(batch)
+        shipments, statuses = _map_batch(batch, stats)
+        if not shipments:
+            continue
+        with transaction.atomic():
+            stats['shipments'] += _prepare_new_shipments(shipments, label_base_url)
+            stats['statuses'] += load(shipments, statuses)
+            Shipment.sync_current_status(shipments.keys())
+        if statuses:
+            earliest = min(date_time for _, _, date_time in statuses)
+            if stats['first_status_at'] is None or earliest < stats['first_status_at']:
+                stats['first_status_at'] = earliest
+        logger.info(f"Imported {stats['records']} records from {path}")
+        if progress:
+            progress(stats)
+    if stats['shipments'] or stats['statuses']:
+        invalidate_all()
+    return stats
@@ -0,0 +1,326 @@
+"""
+Journal of raw webhook bodies, and their replay.
+
+Every admitted webhook is appended to WebhookJournal before it is handled, so that a bad status can be traced back
+to what Salla sent, and state can be rebuilt after a bug in `parse_shipment_data` without asking Salla to resend.
+
+Webhook bodies are small JSON documents that repeat the same keys, which compress poorly on their own. Each body is
+deflated with a preset dictionary of those keys, which makes a typical shipment event several times smaller. The
+first byte of a stored body is its format, so that the dictionary can be extended without rewriting old rows. The
+OAuth tokens of `app.store.authorize` webhooks are redacted before they are stored, so that the journal holds no
+credentials.
+
+`replay_webhooks()` runs a time range of the journal through the normal handlers again. Events are spread over
+worker threads by shipment, so that the events of a shipment are replayed in order by one worker while shipments
+are replayed in parallel. Customers and Salla are not notified again unless asked to. Only shipment events are
+replayed unless app events are asked for: replaying `app.store.authorize` would write tokens that Salla has since
+rotated over the current ones, and break every Salla call of the merchant. Its tokens are redacted anyway, so it is
+never replayed.
+
+Replay does not repeat what is already in the database: a `shipment.creating` of a shipment that exists would
+overwrite it and record its status again, and an event whose status is already recorded would add it twice to the
+history and the analytics rollups. Such events are skipped (see `already_applied`), so replaying a range twice, or a
+range the database already holds, changes nothing. To apply a range again, delete its shipments first.
+"""
+import json
+import logging
+import queue
+import threading
+import zlib
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest
+
+from ..models import Shipment, ShipmentStatus, WebhookJournal
+from .shipment_service import build_shipment_data, notifications_enabled
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'LEVEL': 6,
+}
+
+FORMAT_DEFLATE = 1
+# Strings that occur in most Salla webhooks, the most frequent last. Never change it: extend it under a new format.
+DICTIONARY_V1 = (
+    b'"description":"","city":"","district":"","street_number":"","block":"","postal_code":"",'
+    b'"latitude":null,"longitude":null,"address_line":"","short_address":"","country":"SA","email":"",'
+    b'"country_code":"SA","branch_id":null,"name":"","phone":"+966","city_en":"","is_return":false,'
+    b'"courier_logo":"https://cdn.salla.sa/","tracking_link":"https://","tracking_number":"",'
+    b'"payment_method":"cod","cash_on_delivery":{"amount":0,"currency":"SAR"},"label":{"format":"pdf","url":""},'
+    b'"total_weight":{"value":0,"units":"kg"},"packages":[{"item_id":0,"external_company_id":null,"price":'
+    b'{"amount":0,"currency":"SAR"},"quantity":1,"weight":{"value":0,"units":"kg"}}],'
+    b'"ship_from":{"type":"branch","name":""},"ship_to":{"type":"address","name":""},"meta":{},'
+    b'"total":{"amount":0,"currency":"SAR"},"created_at":{"date":"2024-01-01 00:00:00.000000",'
+    b'"timezone_type":3,"timezone":"Asia/Riyadh"},"courier_name":"","shipping_number":null,"source":"api",'
+    b'"type":"shipment","status":"created","order_id":0,"order_reference_id":0,"id":0,'
+    b'{"event":"shipment.creating","merchant":0,"created_at":"Mon, 01 Jan 2024 00:00:00 GMT","data":{'
+)
+DICTIONARIES = {
+    FORMAT_DEFLATE: DICTIONARY_V1,
+}
+# The prefix of the events replayed by default.
+SHIPMENT_EVENTS = 'shipment.'
+# Keys of webhook payloads that hold credentials, and the events whose journaled body is useless without them.
+SECRET_KEYS = ('access_token', 'refresh_token')
+REDACTED = '[redacted]'
+NEVER_REPLAYED = ('app.store.authorize',)
+# The status each shipment event records, see webhook_service.dispatch_event.
+EVENT_STATUSES = {
+    'shipment.creating': 'created',
+    'shipment.cancelled': 'cancelled',
+}
+
+
+def get_journal_settings():
+    """
+    Returns the WEBHOOK_JOURNAL settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'WEBHOOK_JOURNAL', {})}
+
+
+def compress_body(body, level=DEFAULTS['LEVEL']):
+    compressor = zlib.compressobj(level, zdict=DICTIONARIES[FORMAT_DEFLATE])
+    return bytes([FORMAT_DEFLATE]) + compressor.compress(body) + compressor.flush()
+
+
+def decompress_body(stored):
+    """
+    Returns the raw body of a journaled webhook.
+
+    Raises:
+    ValueError: If the body was stored in an unknown format.
+    """
+    stored = bytes(stored)
+    if not stored or stored[0] not in DICTIONARIES:
+        raise ValueError(f"Unknown journal format {stored[:1]!r}")
+    decompressor = zlib.decompressobj(zdict=DICTIONARIES[stored[0]])
+    return decompressor.decompress(stored[1:]) + decompressor.flush()
+
+
+def redact_body(body, data):
+    """
+    Returns a webhook body with the values of SECRET_KEYS in its payload replaced by REDACTED, or the body itself
+    when it holds none.
+    """
+    payload = data.get('data')
+    if not isinstance(payload, dict) or not any(key in payload for key in SECRET_KEYS):
+        return body
+    payload = {**payload, **{key: REDACTED for key in SECRET_KEYS if key in payload}}
+    return json.dumps({**data, 'data': payload}, separators=(',', ':')).encode()
+
+
+def _journal_entry(body, data, level):
+    merchant = data.get('merchant')
+    return WebhookJournal(
+        event=str(data.get('event') or '')[:50],
+        merchant=merchant if isinstance(merchant, int) and merchant >= 0 else None,
+        body=compress_body(redact_body(body, data), level),
+    )
+
+
+def journal_webhook(body, data):
+    """
+    Appends a webhook to the journal. Failures are logged and do not fail the webhook.
+
+    Args:
+    body (bytes): The raw request body.
+    data (dict): The decoded body.
+    """
+    config = get_journal_settings()
+    if not config['ENABLED']:
+        return
+    try:
+        _journal_entry(body, data, config['LEVEL']).save()
+    except Exception as e:
+        logger.error("Error journaling webhook %s: %s", data.get('event'), e)
+
+
+async def ajournal_webhook(body, data):
+    config = get_journal_settings()
+    if not config['ENABLED']:
+        return
+    try:
+        await _journal_entry(body, data, config['LEVEL']).asave()
+    except Exception as e:
+        logger.error("Error journaling webhook %s: %s", data.get('event'), e)
+
+
+def journal_entries(since=None, until=None, events=None, merchant=None, include_app=False):
+    """
+    Returns the journaled webhooks received in a time range, in the order they were received.
+
+    Args:
+    since (datetime, optional): The start of the range, inclusive.
+    until (datetime, optional): The end of the range, exclusive.
+    events (iterable, optional): Only replay these event names.
+    merchant (int, optional): Only replay the webhooks of this merchant.
+    include_app (bool): Include app events such as `app.installed`, except NEVER_REPLAYED; only shipment events
+    otherwise.
+
+    Returns:
+    QuerySet: A QuerySet of WebhookJournal objects ordered by id.
+    """
+    entries = WebhookJournal.objects.order_by('id')
+    if since:
+        entries = entries.filter(received_at__gte=since)
+    if until:
+        entries = entries.filter(received_at__lt=until)
+    if events:
+        entries = entries.filter(event__in=list(events))
+    if merchant is not None:
+        entries = entries.filter(merchant=merchant)
+    if not include_app:
+        entries = entries.filter(event__startswith=SHIPMENT_EVENTS)
+    return entries.exclude(event__in=NEVER_REPLAYED)
+
+
+class ReplayRequest(HttpRequest):
+    """
+    The request replayed webhooks are handled with; handlers use it to build absolute label URLs.
+    """
+
+    def __init__(self, base_url):
+        super().__init__()
+        parts = urlsplit(base_url)
+        self.method = 'POST'
+        self.path = self.path_info = '/'
+        self.META['HTTP_HOST'] = parts.netloc
+        self._replay_scheme = parts.scheme or 'https'
+
+    def _get_scheme(self):
+        return self._replay_scheme
+
+
+def replay_key(data):
+    """
+    Returns the key that orders a webhook with others: its shipment, else its merchant.
+    """
+    payload = data.get('data')
+    if str(data.get('event')).startswith('shipment.') and isinstance(payload, dict) and payload.get('id'):
+        return f"shipment:{payload['id']}"
+    return f"merchant:{data.get('merchant')}"
+
+
+def already_applied(event, data, received_at):
+    """
+    Tells whether replaying a journaled shipment event would repeat what the database already holds.
+
+    Args:
+    event (str): The event name.
+    data (dict): The decoded webhook body.
+    received_at (datetime): When the webhook was journaled, just before it was first handled.
+
+    Returns:
+    bool: True if the shipment exists and the event is a creation, which would overwrite it, or if the event's
+    status was recorded for the shipment at or after the webhook was received.
+    """
+    payload = data.get('data') if isinstance(data.get('data'), dict) else {}
+    status = EVENT_STATUSES.get(event)
+    if status is None or not payload.get('id') or not Shipment.objects.filter(shipment_id=payload['id']).exists():
+        return False
+    # A return shipment updates the existing shipment instead of creating it.
+    if event == 'shipment.creating' and payload.get('type') != 'return':
+        return True
+    return ShipmentStatus.objects.filter(shipment_id=payload['id'], status=status, date_time__gte=received_at).exists()
+
+
+def _check(event, data):
+    """
+    Parses a webhook the way the handlers would, for dry runs.
+    """
+    if str(event).startswith('shipment.'):
+        build_shipment_data(data)
+
+
+def _replay_lane(lane, base_url, notify, dry_run, stats, lock):
+    from .webhook_service import dispatch_event
+
+    notifications_enabled.set(notify)
+    request = ReplayRequest(base_url)
+    try:
+        while True:
+            item = lane.get()
+            if item is None:
+                return
+            entry_id, event, data, received_at = item
+            try:
+                if already_applied(event, data, received_at):
+                    outcome = 'skipped'
+                elif dry_run:
+                    _check(event, data)
+                    outcome = 'ok'
+                else:
+                    outcome = dispatch_event(event, data, request).status_code
+            except Exception as e:
+                logger.error("Error replaying webhook %s: %s", entry_id, e)
+                outcome = 'error'
+            with lock:
+                stats['outcomes'][outcome] += 1
+    finally:
+        connection.close()
+
+
+def replay_webhooks(since=None, until=None, events=None, merchant=None, workers=8, dry_run=False, notify=False,
+                    base_url=None, chunk_size=2000, progress=None, include_app=False):
+    """
+    Runs journaled webhooks through the webhook handlers again.
+
+    Args:
+    since (datetime, optional): The start of the range, inclusive.
+    until (datetime, optional): The end of the range, exclusive.
+    events (iterable, optional): Only replay these event names.
+    merchant (int, optional): Only replay the webhooks of this merchant.
+    workers (int): The number of threads replaying in parallel.
+    dry_run (bool): Decode and parse the webhooks without handling them.
+    notify (bool): Send emails and Salla status updates as the handlers normally do.
+    base_url (str, optional): The public base URL for label links of new shipments; defaults to the first
+    ALLOWED_HOSTS entry.
+    chunk_size (int): The number of journal rows fetched at a time.
+    progress (callable, optional): Called with the number of webhooks read every `chunk_size` webhooks.
+    include_app (bool): Replay app events as well as shipment events.
+
+    Returns:
+    dict: 'webhooks', the number read; 'events', a Counter by event name; 'outcomes', a Counter of response
+    status codes ('ok' in dry runs), 'skipped' for events already applied and 'error' for webhooks that could not be
+    decoded or raised.
+
+    The reading thread decodes the journal and hands each webhook to the worker of its shipment (see `replay_key`),
+    through a bounded queue so that memory stays flat over a large range.
+    """
+    base_url = base_url or f'https://{settings.ALLOWED_HOSTS[0]}'
+    stats = {'webhooks': 0, 'events': Counter(), 'outcomes': Counter()}
+    lock = threading.Lock()
+    lanes = [queue.Queue(maxsize=chunk_size) for _ in range(max(1, workers))]
+    threads = [threading.Thread(target=_replay_lane, args=(lane, base_url, notify, dry_run, stats, lock),
+                                name=f'replay-{number}', daemon=True)
+               for number, lane in enumerate(lanes)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        entries = journal_entries(since, until, events, merchant, include_app)
+        entries = entries.values_list('id', 'event', 'body', 'received_at')
+        for entry_id, event, body, received_at in entries.iterator(chunk_size=chunk_size):
+            stats['webhooks'] += 1
+            stats['events'][event] += 1
+            try:
+                data = json.loads(decompress_body(body))
+            except ValueError as e:
+                logger.error("Error decoding journaled webhook %s: %s", entry_id, e)
+                with lock:
+                    stats['outcomes']['error'] += 1
+                continue
+            lanes[hash(replay_key(data)) % len(lanes)].put((entry_id, event, data, received_at))
+            if progress and stats['webhooks'] % chunk_size == 0:
+                progress(stats['webhooks'])
+    finally:
+        for lane in lanes:
+            lane.put(None)
+        for thread in threads:
+            thread.join()
+    return stats
@@ -1,9 +1,13 @@
 import logging
+import time
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import get_connection, send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
+from shipment_management.tracing import span
+
+from ..metrics import EMAIL_SEND_LATENCY
 
 # from twilio.rest import Client
 
@@ -13,13 +17,14 @@ logger = logging.getLogger(__name__)
 # twilio_client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
 
 
-def send_shipment_email(shipment, status):
+def send_shipment_email(shipment, status, connection=None):
     """
     Sends an email to internal staff about a shipment with a specified status.
 
     Args:
     shipment (Shipment): The shipment object containing details about the shipment.
     status (str): The status of the shipment, such as "shipped", "delivered", etc.
+    connection (optional): An open mail connection to send through, see `send_shipment_emails`.
 
     Returns:
     None
@@ -32,7 +37,7 @@ def send_shipment_email(shipment, status):
     >>> shipment = Shipment.objects.get(shipment_id=123)
     >>> send_shipment_email(shipment, "shipped")
     """
-    logger.info(f"Sending email for shipment {shipment.shipment_id} with status {status}")
+    logger.info("Sending email for shipment %s with status %s", shipment.shipment_id, status)
     try:
         subject = f"Shipment {status.capitalize()} - {shipment.shipping_number}"
         context = {
@@ -48,10 +53,45 @@ def send_shipment_email(shipment, status):
         from_email = settings.DEFAULT_FROM_EMAIL
         to_email = settings.INTERNAL_STAFF_EMAILS  # List of internal staff emails
 
-        send_mail(subject, plain_message, from_email, to_email, html_message=html_message)
-        logger.info(f"Email sent successfully for shipment {shipment.shipment_id} with status {status}")
+        options = {'html_message': html_message}
+        if connection is not None:
+            options['connection'] = connection
+
+        start = time.perf_counter()
+        try:
+            with span('smtp.send', kind='client', shipment_id=shipment.shipment_id, status=status,
+                      recipients=len(to_email)):
+                send_mail(subject, plain_message, from_email, to_email, **options)
+        except Exception:
+            EMAIL_SEND_LATENCY.labels('failure').observe(time.perf_counter() - start)
+            raise
+        EMAIL_SEND_LATENCY.labels('success').observe(time.perf_counter() - start)
+        logger.info("Email sent successfully for shipment %s with status %s", shipment.shipment_id, status)
+    except Exception as e:
+        logger.error("Failed to send email for shipment %s with status %s: %s", shipment.shipment_id, status, e)
+
+
+def send_shipment_emails(shipments, status):
+    """
+    Sends the staff email of many shipments with a status, over one mail connection.
+
+    Args:
+    shipments (iterable): The Shipment objects.
+    status (str): The status the shipments were given.
+
+    Returns:
+    None
+
+    Opening an SMTP connection, with its TLS handshake and login, costs more than sending a message, so a bulk
+    status update reuses one connection for all its emails. Failures are logged per shipment, as in
+    `send_shipment_email`.
+    """
+    try:
+        with get_connection() as connection:
+            for shipment in shipments:
+                send_shipment_email(shipment, status, connection)
     except Exception as e:
-        logger.error(f"Failed to send email for shipment {shipment.shipment_id} with status {status}: {str(e)}")
+        logger.error("Failed to open a mail connection for status %s: %s", status, e)
 
 # def send_sms(shipment):
 #     try:
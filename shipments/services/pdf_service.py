@@ -1,12 +1,23 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
 from django.http import HttpResponse, JsonResponse
 from django.template.loader import render_to_string
-from weasyprint import HTML
+from shipment_management.tracing import span
+
+from ..conditional import alabel_validators, conditional, label_validators
+from ..metrics import PDF_RENDER_LATENCY, PDF_SIZE
 from ..models import Shipment
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@conditional(label_validators)
 def generate_pdf_label(request, shipment_id):
     """
     Generates a PDF label for a shipment.
@@ -18,24 +29,121 @@ def generate_pdf_label(request, shipment_id):
     HttpResponse: The HTTP response containing the PDF label.
     """
     try:
-        logger.info(f"Generating PDF label for shipment ID: {shipment_id}")
+        logger.info("Generating PDF label for shipment ID: %s", shipment_id)
         shipment = Shipment.objects.get(shipment_id=shipment_id)
     except Shipment.DoesNotExist:
-        logger.error(f"Shipment with ID {shipment_id} does not exist.")
+        logger.error("Shipment with ID %s does not exist.", shipment_id)
+        return JsonResponse({'error': 'Shipment not found'}, status=404)
+    except Exception as e:
+        logger.error("Error retrieving shipment: %s", e)
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+    try:
+        pdf_file = render_label_pdf(shipment)
+
+        response = HttpResponse(pdf_file, content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="shipment_label_{shipment_id}.pdf"'
+        logger.info("PDF label generated successfully for shipment ID: %s", shipment_id)
+        return response
+    except Exception as e:
+        logger.error("Error generating PDF: %s", e)
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+
+def render_label_pdf(shipment, observe=True):
+    """
+    Renders the label of a shipment to PDF.
+
+    Args:
+    shipment (Shipment): The shipment; it does not need to be saved.
+    observe (bool): Whether to record the render in the PDF metrics. Warm-up renders are left out.
+
+    Returns:
+    bytes: The PDF document.
+    """
+    html_string = render_to_string('shipment_label.html', {'shipment': shipment})
+    start = time.perf_counter()
+    with span('pdf.render', shipment_id=shipment.shipment_id) as render_span:
+        pdf_file = html_to_pdf(html_string)
+        render_span.set_attribute('pdf.size', len(pdf_file))
+    if observe:
+        PDF_RENDER_LATENCY.observe(time.perf_counter() - start)
+        PDF_SIZE.observe(len(pdf_file))
+    return pdf_file
+
+
+def html_to_pdf(html_string):
+    """
+    Converts an HTML document to PDF with WeasyPrint. It touches neither Django nor the database, so that it can run
+    in a process pool.
+    """
+    # WeasyPrint (with its pango/cairo bindings) is imported on the first render, not at worker start-up.
+    from weasyprint import HTML
+    return HTML(string=html_string).write_pdf()
+
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+
+def get_pdf_executor():
+    """
+    Returns the process-wide executor that async views render PDFs in, as configured by
+    settings.ASYNC_VIEWS['PDF_EXECUTOR'] ('thread' or 'process') and ['PDF_WORKERS'].
+
+    A process pool keeps WeasyPrint's CPU time off the worker's GIL, at the cost of shipping the HTML to and the PDF
+    back from the pool.
+    """
+    global _pdf_executor
+    if _pdf_executor is None:
+        with _pdf_executor_lock:
+            if _pdf_executor is None:
+                config = settings.ASYNC_VIEWS
+                if config['PDF_EXECUTOR'] == 'process':
+                    _pdf_executor = ProcessPoolExecutor(config['PDF_WORKERS'], initializer=django.setup)
+                else:
+                    _pdf_executor = ThreadPoolExecutor(config['PDF_WORKERS'], thread_name_prefix='pdf-render')
+    return _pdf_executor
+
+
+async def arender_label_pdf(shipment):
+    """
+    Async version of `render_label_pdf`: the template is rendered on the event loop and WeasyPrint runs in the PDF
+    executor, so the loop keeps serving other requests meanwhile.
+    """
+    html_string = render_to_string('shipment_label.html', {'shipment': shipment})
+    start = time.perf_counter()
+    with span('pdf.render', shipment_id=shipment.shipment_id) as render_span:
+        loop = asyncio.get_running_loop()
+        pdf_file = await loop.run_in_executor(get_pdf_executor(), html_to_pdf, html_string)
+        render_span.set_attribute('pdf.size', len(pdf_file))
+    PDF_RENDER_LATENCY.observe(time.perf_counter() - start)
+    PDF_SIZE.observe(len(pdf_file))
+    return pdf_file
+
+
+@conditional(alabel_validators)
+async def agenerate_pdf_label(request, shipment_id):
+    """
+    Async version of `generate_pdf_label`.
+    """
+    try:
+        logger.info("Generating PDF label for shipment ID: %s", shipment_id)
+        shipment = await Shipment.objects.aget(shipment_id=shipment_id)
+    except Shipment.DoesNotExist:
+        logger.error("Shipment with ID %s does not exist.", shipment_id)
         return JsonResponse({'error': 'Shipment not found'}, status=404)
     except Exception as e:
-        logger.error(f"Error retrieving shipment: {str(e)}")
+        logger.error("Error retrieving shipment: %s", e)
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
     try:
-        html_string = render_to_string('shipment_label.html', {'shipment': shipment})
-        html = HTML(string=html_string)
-        pdf_file = html.write_pdf()
+        pdf_file = await arender_label_pdf(shipment)
 
         response = HttpResponse(pdf_file, content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="shipment_label_{shipment_id}.pdf"'
-        logger.info(f"PDF label generated successfully for shipment ID: {shipment_id}")
+        logger.info("PDF label generated successfully for shipment ID: %s", shipment_id)
         return response
     except Exception as e:
-        logger.error(f"Error generating PDF: {str(e)}")
+        logger.error("Error generating PDF: %s", e)
         return JsonResponse({'error': 'Internal server error'}, status=500)
@@ -1,15 +1,27 @@
+import asyncio
 import logging
+import time
+import weakref
+from contextvars import ContextVar
 from datetime import datetime
 
 import pytz
-import requests
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.http import JsonResponse
+from shipment_management.tracing import span
 
+from ..cache import (ainvalidate_merchant_token, cache_access_token, cached_access_token,
+                     invalidate_merchant_token)
+from ..metrics import SALLA_REQUEST_LATENCY, TOKEN_REFRESHES
 from ..models import MerchantToken
 
 logger = logging.getLogger(__name__)
 
+REFRESH_URL = 'https://accounts.salla.sa/oauth2/token'
+SHIPMENT_URL = 'https://api.salla.dev/admin/v2/shipments/{shipment_id}'
+SALLA_TIMEOUT = 10
+
 
 def handle_store_authorize(data):
     """
@@ -48,10 +60,11 @@ def handle_store_authorize(data):
                 'expires_at': expires_at
             }
         )
-        logger.info(f"App added to store for merchant id {merchant_id}")
+        invalidate_merchant_token(merchant_id)
+        logger.info("App added to store for merchant id %s", merchant_id)
         return JsonResponse({'message': f'App added to store for merchant id {merchant_id}'}, status=201)
     except Exception as e:
-        logger.error(f"Error handling store authorization: {str(e)}")
+        logger.error("Error handling store authorization: %s", e)
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 
@@ -75,10 +88,10 @@ def handle_app_installed(data):
     """
     try:
         merchant_id = data.get('merchant')
-        logger.info(f"App installed for merchant id {merchant_id}")
+        logger.info("App installed for merchant id %s", merchant_id)
         return JsonResponse({'message': f'App installed for merchant id {merchant_id}'}, status=200)
     except Exception as e:
-        logger.error(f"Error handling app installation: {str(e)}")
+        logger.error("Error handling app installation: %s", e)
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 
@@ -106,12 +119,12 @@ def handle_app_uninstalled(data):
 
     try:
         merchant = MerchantToken.objects.filter(merchant_id=merchant_id)
-        logger.info(f"App uninstalled for merchant id {merchant_id}")
+        logger.info("App uninstalled for merchant id %s", merchant_id)
         return JsonResponse({'message': f'App uninstalled for merchant id {merchant_id}'}, status=200)
     except MerchantToken.DoesNotExist:
         return JsonResponse({'error': f'MerchantToken with merchant id {merchant_id} does not exist'}, status=404)
     except Exception as e:
-        logger.error(f"Error handling app uninstallation: {str(e)}")
+        logger.error("Error handling app uninstallation: %s", e)
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 
@@ -142,26 +155,30 @@ def refresh_token(merchant_token):
     Note: This function assumes that the 'requests' library is imported and that the 'settings' module contains the necessary API keys and secrets.
     """
     try:
-        refresh_url = 'https://accounts.salla.sa/oauth2/token'
-        payload = {
-            'grant_type': 'refresh_token',
-            'refresh_token': merchant_token.refresh_token,
-            'client_id': settings.SALLA_API_KEY,
-            'client_secret': settings.SALLA_API_SECRET,
-        }
-        response = requests.post(refresh_url, data=payload)
+        payload = _refresh_payload(merchant_token)
+        start = time.perf_counter()
+        with span('salla.refresh_token', kind='client', merchant=merchant_token.merchant_id) as salla_span:
+            try:
+                import requests  # imported on first use, keeping it out of worker start-up
+                response = requests.post(REFRESH_URL, data=payload, timeout=SALLA_TIMEOUT)
+            except Exception:
+                SALLA_REQUEST_LATENCY.labels('refresh_token', 'error').observe(time.perf_counter() - start)
+                raise
+            SALLA_REQUEST_LATENCY.labels('refresh_token', str(response.status_code)).observe(time.perf_counter() - start)
+            salla_span.set_attribute('http.status_code', response.status_code)
         if response.status_code == 200:
-            token_data = response.json()
-            merchant_token.access_token = token_data.get('access_token')
-            expires_in = token_data.get('expires')
-            merchant_token.expires_at = datetime.fromtimestamp(expires_in, pytz.UTC)
+            _apply_refreshed_token(merchant_token, response.json())
             merchant_token.save()
-            logger.info(f"Token refreshed for merchant id {merchant_token.merchant_id}")
+            invalidate_merchant_token(merchant_token.merchant_id)
+            logger.info("Token refreshed for merchant id %s", merchant_token.merchant_id)
+            TOKEN_REFRESHES.labels('success').inc()
             return True
-        logger.error(f"Failed to refresh token: {response.content}")
+        logger.error("Failed to refresh token: %s", response.content)
+        TOKEN_REFRESHES.labels('failure').inc()
         return False
     except Exception as e:
-        logger.error(f"Error refreshing token: {str(e)}")
+        logger.error("Error refreshing token: %s", e)
+        TOKEN_REFRESHES.labels('error').inc()
         return False
 
 
@@ -187,20 +204,24 @@ def get_access_token(merchant_id):
         print("Failed to retrieve access token")
     ```
 
-    The function first attempts to retrieve the merchant token object from the database using the provided merchant ID. If the token is expired, it attempts to refresh the token using the `refresh_token` function. If the token retrieval or refresh is successful, the function returns the access token; otherwise, it returns None. If an error occurs during the token retrieval process, the function raises an Exception.
+    Tokens are cached in the worker, see shipments.cache.cached_access_token. On a miss, the function attempts to retrieve the merchant token object from the database using the provided merchant ID. If the token is expired, it attempts to refresh the token using the `refresh_token` function. If the token retrieval or refresh is successful, the function returns the access token; otherwise, it returns None. If an error occurs during the token retrieval process, the function raises an Exception.
 
     Note: This function assumes that the 'requests' library is imported and that the 'settings' module contains the necessary API keys and secrets.
     """
     try:
+        access_token = cached_access_token(merchant_id)
+        if access_token:
+            return access_token
         merchant_token = MerchantToken.objects.get(merchant_id=merchant_id)
         if merchant_token.is_expired():
             if not refresh_token(merchant_token):
                 return None
+        cache_access_token(merchant_token)
         return merchant_token.access_token
     except MerchantToken.DoesNotExist:
         return None
     except Exception as e:
-        logger.error(f"Error getting access token: {str(e)}")
+        logger.error("Error getting access token: %s", e)
         return None
 
 
@@ -229,32 +250,211 @@ def update_salla_api(shipment, status):
     Note: This function assumes that the 'requests' library is imported and that the 'settings' module contains the necessary API keys and secrets.
     """
     try:
-        logger.info(f"Updating Salla API for shipment {shipment.shipment_id} status {status}")
+        logger.info("Updating Salla API for shipment %s status %s", shipment.shipment_id, status)
         token = get_access_token(shipment.merchant)
         if not token:
             logger.error("Unable to retrieve access token")
             return
 
         shipment_id = shipment.shipment_id
-        api_url = f'https://api.salla.dev/admin/v2/shipments/{shipment_id}'
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        if status == 'created':
-            payload = {
-                'shipment_number': str(shipment.shipping_number),
-                'status': status,
-                'pdf_label': shipment.label.get('url', '') if shipment.label else '',
-                'cost': 19
-            }
-        else:
-            payload = {
-                'shipment_number': str(shipment.shipping_number),
-                'status': status
-            }
-        response = requests.put(api_url, headers=headers, json=payload)
+        api_url, headers, payload = _shipment_request(shipment, status, token)
+        start = time.perf_counter()
+        with span('salla.update_shipment', kind='client', shipment_id=shipment_id, status=status) as salla_span:
+            try:
+                import requests
+                response = requests.put(api_url, headers=headers, json=payload, timeout=SALLA_TIMEOUT)
+            except Exception:
+                SALLA_REQUEST_LATENCY.labels('update_shipment', 'error').observe(time.perf_counter() - start)
+                raise
+            SALLA_REQUEST_LATENCY.labels('update_shipment', str(response.status_code)).observe(time.perf_counter() - start)
+            salla_span.set_attribute('http.status_code', response.status_code)
+        if response.status_code != 200:
+            logger.error("Failed to update Salla API: %s", response.content)
+    except Exception as e:
+        logger.error("Error updating Salla API: %s", e)
+
+
+def _refresh_payload(merchant_token):
+    return {
+        'grant_type': 'refresh_token',
+        'refresh_token': merchant_token.refresh_token,
+        'client_id': settings.SALLA_API_KEY,
+        'client_secret': settings.SALLA_API_SECRET,
+    }
+
+
+def _apply_refreshed_token(merchant_token, token_data):
+    merchant_token.access_token = token_data.get('access_token')
+    merchant_token.expires_at = datetime.fromtimestamp(token_data.get('expires'), pytz.UTC)
+
+
+def _shipment_request(shipment, status, token):
+    """
+    Returns the URL, headers and payload of the Salla request that updates a shipment's status.
+    """
+    api_url = SHIPMENT_URL.format(shipment_id=shipment.shipment_id)
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json'
+    }
+    payload = {
+        'shipment_number': str(shipment.shipping_number),
+        'status': status
+    }
+    if status == 'created':
+        payload['pdf_label'] = shipment.label.get('url', '') if shipment.label else ''
+        payload['cost'] = 19
+    return api_url, headers, payload
+
+
+# Async API, used by the async views under ASGI. Salla is called through one pooled httpx.AsyncClient per event
+# loop, so a worker can wait on many Salla requests at once without holding a thread for each. Code that runs on a
+# short-lived loop of its own, like `bulk_update_salla_api` under async_to_sync, sets `scoped_client` to a client it
+# closes before the loop ends instead.
+
+_async_clients = weakref.WeakKeyDictionary()
+scoped_client = ContextVar('salla_client', default=None)
+
+
+def new_async_client():
+    import httpx
+    return httpx.AsyncClient(timeout=SALLA_TIMEOUT)
+
+
+def get_async_client():
+    """
+    Returns the `scoped_client`, or the httpx.AsyncClient of the running event loop, creating it on first use.
+    """
+    if scoped_client.get() is not None:
+        return scoped_client.get()
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = new_async_client()
+    return client
+
+
+async def _asalla_request(operation, method, url, span_attributes, **kwargs):
+    start = time.perf_counter()
+    with span(f'salla.{operation}', kind='client', **span_attributes) as salla_span:
+        try:
+            response = await get_async_client().request(method, url, **kwargs)
+        except Exception:
+            SALLA_REQUEST_LATENCY.labels(operation, 'error').observe(time.perf_counter() - start)
+            raise
+        SALLA_REQUEST_LATENCY.labels(operation, str(response.status_code)).observe(time.perf_counter() - start)
+        salla_span.set_attribute('http.status_code', response.status_code)
+    return response
+
+
+async def arefresh_token(merchant_token):
+    """
+    Async version of `refresh_token`.
+    """
+    try:
+        response = await _asalla_request('refresh_token', 'POST', REFRESH_URL,
+                                         {'merchant': merchant_token.merchant_id},
+                                         data=_refresh_payload(merchant_token))
+        if response.status_code == 200:
+            _apply_refreshed_token(merchant_token, response.json())
+            await merchant_token.asave()
+            await ainvalidate_merchant_token(merchant_token.merchant_id)
+            logger.info("Token refreshed for merchant id %s", merchant_token.merchant_id)
+            TOKEN_REFRESHES.labels('success').inc()
+            return True
+        logger.error("Failed to refresh token: %s", response.content)
+        TOKEN_REFRESHES.labels('failure').inc()
+        return False
+    except Exception as e:
+        logger.error("Error refreshing token: %s", e)
+        TOKEN_REFRESHES.labels('error').inc()
+        return False
+
+
+async def aget_access_token(merchant_id):
+    """
+    Async version of `get_access_token`.
+    """
+    try:
+        access_token = cached_access_token(merchant_id)
+        if access_token:
+            return access_token
+        merchant_token = await MerchantToken.objects.aget(merchant_id=merchant_id)
+        if merchant_token.is_expired():
+            if not await arefresh_token(merchant_token):
+                return None
+        cache_access_token(merchant_token)
+        return merchant_token.access_token
+    except MerchantToken.DoesNotExist:
+        return None
+    except Exception as e:
+        logger.error("Error getting access token: %s", e)
+        return None
+
+
+async def aupdate_salla_api(shipment, status, token=None):
+    """
+    Async version of `update_salla_api`. `token` is the merchant's access token, when the caller already has it.
+    """
+    try:
+        logger.info("Updating Salla API for shipment %s status %s", shipment.shipment_id, status)
+        token = token or await aget_access_token(shipment.merchant)
+        if not token:
+            logger.error("Unable to retrieve access token")
+            return
+
+        api_url, headers, payload = _shipment_request(shipment, status, token)
+        response = await _asalla_request('update_shipment', 'PUT', api_url,
+                                         {'shipment_id': shipment.shipment_id, 'status': status},
+                                         headers=headers, json=payload)
         if response.status_code != 200:
-            logger.error(f"Failed to update Salla API: {response.content}")
+            logger.error("Failed to update Salla API: %s", response.content)
     except Exception as e:
-        logger.error(f"Error updating Salla API: {str(e)}")
+        logger.error("Error updating Salla API: %s", e)
+
+
+def bulk_update_salla_api(shipments, status, concurrency=10):
+    """
+    Updates many shipments in the Salla API with the same status, e.g. after a bulk status update.
+
+    Args:
+    shipments (iterable): The Shipment objects to update.
+    status (str): The new status of the shipments.
+    concurrency (int): The number of requests in flight at a time.
+
+    Returns:
+    None
+
+    Salla has no bulk shipment endpoint, so one request is still sent per shipment, but they are sent `concurrency`
+    at a time over the pooled async client instead of one after the other. Errors are logged per shipment, as in
+    `update_salla_api`.
+
+    The access token of each merchant is resolved once before the requests are sent: Salla rotates the refresh
+    token, so concurrent refreshes of an expired token with the same refresh token would all but one fail.
+    """
+    shipments = list(shipments)
+
+    async def update_all():
+        merchants = list({shipment.merchant for shipment in shipments})
+        tokens = dict(zip(merchants, await asyncio.gather(*(aget_access_token(merchant) for merchant in merchants))))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def update(shipment):
+            if not tokens[shipment.merchant]:
+                logger.error("Unable to retrieve access token for shipment %s", shipment.shipment_id)
+                return
+            async with semaphore:
+                await aupdate_salla_api(shipment, status, tokens[shipment.merchant])
+
+        await asyncio.gather(*(update(shipment) for shipment in shipments))
+
+    async def update_all_with_client():
+        # async_to_sync runs each call on a new event loop; its client is closed with it.
+        async with new_async_client() as client:
+            token = scoped_client.set(client)
+            try:
+                await update_all()
+            finally:
+                scoped_client.reset(token)
+
+    async_to_sync(update_all_with_client)()
@@ -1,17 +1,90 @@
-import json
+import asyncio
 import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 
-from dateutil.parser import parse as parse_date
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from django.urls import reverse
+from shipment_management.logging_pipeline import log_payload
+from shipment_management.tracing import set_span_attributes, traced
 
+from .analytics_service import record_status_transition
+from ..cache import ainvalidate_shipment, invalidate_shipment
+from ..locks import ShipmentLockTimeout, ashipment_lock, shipment_lock
+from ..live import aannounce_shipment, aannounce_status, announce_shipment, announce_status
 from .notification_service import send_shipment_email
-from .salla_service import update_salla_api
+from .salla_service import aupdate_salla_api, update_salla_api
 from ..models import Shipment, ShipmentStatus
 
 # Initialize the logger
 logger = logging.getLogger(__name__)
 
+# Cleared while webhooks are replayed from the journal, so that customers and Salla are not notified again of
+# events they were notified of when the webhook first arrived.
+notifications_enabled = ContextVar('notifications_enabled', default=True)
+# Set while the lock of a shipment is held: the status updates queue their email and Salla update in it, and they are
+# sent once the lock is released, so that a slow SMTP server or Salla API does not hold up the shipment's next event.
+pending_notifications = ContextVar('pending_notifications', default=None)
+
+
+@traced('shipment.notify')
+def send_notifications(shipment, status):
+    """
+    Sends the staff email and the Salla update of a new status of a shipment.
+    """
+    if status == 'created' or status == 'cancelled':
+        send_shipment_email(shipment, status)
+    # if status == 'delivery':
+    #    send_sms(shipment)
+    if status != 'cancelled':
+        update_salla_api(shipment, status)
+
+
+@traced('shipment.notify')
+async def asend_notifications(shipment, status):
+    """
+    Async version of `send_notifications`. The email and the Salla update are sent concurrently.
+    """
+    notifications = []
+    if status == 'created' or status == 'cancelled':
+        notifications.append(sync_to_async(send_shipment_email, thread_sensitive=False)(shipment, status))
+    if status != 'cancelled':
+        notifications.append(aupdate_salla_api(shipment, status))
+    await asyncio.gather(*notifications)
+
+
+@contextmanager
+def notifying_after_lock(shipment_id):
+    """
+    Holds the lock of a shipment, sending the notifications of the statuses recorded under it once it is released.
+    """
+    pending = []
+    token = pending_notifications.set(pending)
+    try:
+        with shipment_lock(shipment_id):
+            yield
+    finally:
+        pending_notifications.reset(token)
+    for shipment, status in pending:
+        send_notifications(shipment, status)
+
+
+@asynccontextmanager
+async def anotifying_after_lock(shipment_id):
+    """
+    Async version of `notifying_after_lock`.
+    """
+    pending = []
+    token = pending_notifications.set(pending)
+    try:
+        async with ashipment_lock(shipment_id):
+            yield
+    finally:
+        pending_notifications.reset(token)
+    for shipment, status in pending:
+        await asend_notifications(shipment, status)
+
 
 def handle_shipment_creation_or_update(shipment_data, status, request):
     """
@@ -29,28 +102,35 @@ def handle_shipment_creation_or_update(shipment_data, status, request):
     Raises:
     Exception: If an error occurs during shipment creation or update.
 
+    Events of the same shipment are processed one at a time, see shipments.locks; events of different shipments run in parallel. The email and the Salla update are sent after the lock is released, and an event that waits too long for the lock is answered with a 503 for Salla to retry.
+
     This function first checks if an existing shipment with the same shipment ID exists. If it does, it handles the update accordingly. If the shipment is a return shipment, it updates the return shipment. If the status is 'cancelled', it updates the cancelled shipment. If the shipment is an existing shipment, it updates the existing shipment. If the shipment is a new shipment, it creates a new shipment, updates the status, and returns a JSON response with a success message and the shipment ID. If an error occurs during shipment creation or update, it logs the error and returns a JSON response with an error message.
     """
     try:
-        existing_shipment = Shipment.objects.filter(shipment_id=shipment_data.get('shipment_id')).first()
-        if existing_shipment and shipment_data.get('type') == 'return':
-            logger.info(f"Updating return shipment: {shipment_data.get('shipment_id')}")
-            handle_shipment_update(shipment_data)
-            return handle_status_update(shipment_data.get('shipment_id'), status)
-        elif existing_shipment and status == 'cancelled':
-            logger.info(f"Updating cancelled shipment: {shipment_data.get('shipment_id')}")
-            return handle_status_update(shipment_data.get('shipment_id'), status)
-        else:
-            logger.info(f"Creating new shipment: {shipment_data.get('shipment_id')}")
-            shipment = handle_shipment_creation(shipment_data, request)
-            handle_status_update(shipment.shipment_id, status)
-            return JsonResponse({'message': 'Shipment created successfully', 'shipment_id': shipment.shipment_id},
-                                status=201)
+        with notifying_after_lock(shipment_data.get('shipment_id')):
+            existing_shipment = Shipment.objects.filter(shipment_id=shipment_data.get('shipment_id')).first()
+            if existing_shipment and shipment_data.get('type') == 'return':
+                logger.info("Updating return shipment: %s", shipment_data.get('shipment_id'))
+                handle_shipment_update(shipment_data)
+                return handle_status_update(shipment_data.get('shipment_id'), status)
+            elif existing_shipment and status == 'cancelled':
+                logger.info("Updating cancelled shipment: %s", shipment_data.get('shipment_id'))
+                return handle_status_update(shipment_data.get('shipment_id'), status)
+            else:
+                logger.info("Creating new shipment: %s", shipment_data.get('shipment_id'))
+                shipment = handle_shipment_creation(shipment_data, request)
+                handle_status_update(shipment.shipment_id, status)
+                return JsonResponse({'message': 'Shipment created successfully', 'shipment_id': shipment.shipment_id},
+                                    status=201)
+    except ShipmentLockTimeout as e:
+        logger.warning("%s", e)
+        return JsonResponse({'error': str(e)}, status=503)
     except Exception as e:
-        logger.error(f"Error in handle_shipment_creation_or_update: {str(e)}")
+        logger.error("Error in handle_shipment_creation_or_update: %s", e)
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@traced('shipment.create')
 def handle_shipment_creation(shipment_data, request):
     """
     Creates a new shipment and returns the newly created shipment object.
@@ -68,7 +148,8 @@ def handle_shipment_creation(shipment_data, request):
     This function first creates a new Shipment object using the provided shipment data. It then saves the new shipment to the database. After that, it generates a PDF label for the shipment and saves it to the Shipment object. Finally, it returns the newly created shipment object. If an error occurs during shipment creation, it logs the error and returns a JSON response with an error message.
     """
     shipment_id = shipment_data.get('shipment_id')
-    logger.info(f"Creating shipment with ID:{shipment_id}")
+    set_span_attributes(shipment_id=shipment_id)
+    logger.info("Creating shipment with ID:%s", shipment_id)
     try:
         new_shipment = Shipment(**shipment_data)
         new_shipment.save()
@@ -78,14 +159,17 @@ def handle_shipment_creation(shipment_data, request):
         )
         new_shipment.label = {'url': pdf_label_url}
         new_shipment.save()
+        invalidate_shipment(new_shipment.shipment_id, new_shipment.merchant)
+        announce_shipment(new_shipment)
 
-        logger.info(f"Shipment created successfully with ID: {new_shipment.shipment_id}")
+        logger.info("Shipment created successfully with ID: %s", new_shipment.shipment_id)
         return new_shipment
     except Exception as e:
-        logger.error(f"Error in handle_shipment_creation: {str(e)}")
+        logger.error("Error in handle_shipment_creation: %s", e)
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@traced('shipment.update')
 def handle_shipment_update(shipment_data):
     """
     Updates an existing shipment based on the provided shipment data.
@@ -99,7 +183,7 @@ def handle_shipment_update(shipment_data):
     Raises:
     Exception: If an error occurs during shipment update.
 
-    This function first checks if the provided shipment data contains a shipment ID. If it does, it retrieves the corresponding Shipment object from the database. It then iterates through the key-value pairs in the shipment data and updates the corresponding attributes of the Shipment object. Finally, it saves the updated Shipment object to the database and returns a JSON response with a success message and the shipment ID. If an error occurs during shipment update, it logs the error and returns a JSON response with an error message.
+    This function first checks if the provided shipment data contains a shipment ID. If it does, it retrieves the corresponding Shipment object from the database. It then applies the shipment data with `Shipment.apply_changes`, saves only the fields whose values changed and invalidates the cached shipment pages; when nothing changed it writes nothing. Finally, it returns a JSON response with a success message and the shipment ID. If an error occurs during shipment update, it logs the error and returns a JSON response with an error message.
     """
     shipment_id = shipment_data.get('shipment_id')
 
@@ -107,7 +191,8 @@ def handle_shipment_update(shipment_data):
         logger.warning("Missing shipping id in payload")
         return JsonResponse({'error': 'Missing shipping id in payload'}, status=400)
 
-    logger.info(f"Updating shipment with ID: {shipment_id}")
+    set_span_attributes(shipment_id=shipment_id)
+    logger.info("Updating shipment with ID: %s", shipment_id)
 
     try:
         if shipment_data is None:
@@ -115,20 +200,23 @@ def handle_shipment_update(shipment_data):
             return JsonResponse({'error': 'No shipment data provided'}, status=400)
 
         shipment = Shipment.objects.get(shipment_id=shipment_id)
-        for key, value in shipment_data.items():
-            setattr(shipment, key, value)
-        shipment.save()
-
-        logger.info(f"Shipment update event processed for shipment_id: {shipment_id}")
+        changed = shipment.apply_changes(shipment_data)
+        if changed:
+            shipment.save(update_fields=changed)
+            invalidate_shipment(shipment_id, shipment.merchant)
+            logger.info("Shipment update event processed for shipment_id: %s, changed: %s", shipment_id, changed)
+        else:
+            logger.info("Shipment update event for shipment_id: %s changed nothing", shipment_id)
         return JsonResponse({'message': 'Shipment update event processed'}, status=200)
     except Shipment.DoesNotExist:
-        logger.error(f"Shipment with shipment_id {shipment_id} does not exist.")
+        logger.error("Shipment with shipment_id %s does not exist.", shipment_id)
         return JsonResponse({'error': f"Shipment with shipment_id {shipment_id} does not exist."}, status=400)
     except Exception as e:
-        logger.error(f"Error in handle_shipment_update: {str(e)}")
+        logger.error("Error in handle_shipment_update: %s", e)
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@traced('shipment.status_update')
 def handle_status_update(shipment_id, status):
     """
     Updates the status of a shipment in the database and performs additional actions based on the status.
@@ -146,7 +234,8 @@ def handle_status_update(shipment_id, status):
 
     This function first retrieves the Shipment object with the given shipment ID from the database. It then creates a new ShipmentStatus object with the provided status and the retrieved Shipment object. The new ShipmentStatus object is saved to the database. Depending on the new status, additional actions are performed. If the status is 'created' or 'cancelled', a shipment email is sent. If the status is 'delivery', a shipment SMS is sent. If the status is not 'cancelled', the SALLA API is updated. Finally, a JSON response containing a success message and the shipment ID is returned if the status update is successful. If the shipment with the given shipment ID does not exist, a 'Shipment not found' error message is returned. If an error occurs during the status update process, an error message containing the error details is returned.
     """
-    logger.info(f"Updating status for shipment_id: {shipment_id} to {status}")
+    set_span_attributes(shipment_id=shipment_id, status=status)
+    logger.info("Updating status for shipment_id: %s to %s", shipment_id, status)
     try:
         shipment = Shipment.objects.get(shipment_id=shipment_id)
         new_status = ShipmentStatus(
@@ -154,22 +243,195 @@ def handle_status_update(shipment_id, status):
             status=status
         )
         new_status.save()
-        if status == 'created' or status == 'cancelled':
-            send_shipment_email(shipment, status)
-        # if status == 'delivery':
-        #    send_sms(shipment)
-        if status != 'cancelled':
-            update_salla_api(shipment, status)
-        logger.info(f"Shipment status updated successfully for shipment_id: {shipment_id}")
+        invalidate_shipment(shipment_id, shipment.merchant)
+        announce_status(new_status)
+        record_status_transition(new_status)
+        if notifications_enabled.get():
+            if pending_notifications.get() is not None:
+                pending_notifications.get().append((shipment, status))
+            else:
+                send_notifications(shipment, status)
+        logger.info("Shipment status updated successfully for shipment_id: %s", shipment_id)
         return JsonResponse({'message': 'Shipment status updated successfully'}, status=200)
     except Shipment.DoesNotExist:
-        logger.error(f"Shipment not found for shipment_id {shipment_id}")
+        logger.error("Shipment not found for shipment_id %s", shipment_id)
         return JsonResponse({'error': 'Shipment not found'}, status=404)
     except Exception as e:
-        logger.error(f"Error in handle_status_update: {str(e)}")
+        logger.error("Error in handle_status_update: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+# Async versions of the webhook path, used by the async webhook view under ASGI. Database access goes through
+# Django's async ORM and Salla is called with httpx; the SMTP send and the analytics rollups, which have no async
+# API, run in a worker thread.
+
+
+async def ahandle_shipment_creation_or_update(shipment_data, status, request):
+    """
+    Async version of `handle_shipment_creation_or_update`.
+    """
+    try:
+        shipment_id = shipment_data.get('shipment_id')
+        async with anotifying_after_lock(shipment_id):
+            existing_shipment = await Shipment.objects.filter(shipment_id=shipment_id).afirst()
+            if existing_shipment and shipment_data.get('type') == 'return':
+                logger.info("Updating return shipment: %s", shipment_id)
+                await ahandle_shipment_update(shipment_data)
+                return await ahandle_status_update(shipment_id, status)
+            elif existing_shipment and status == 'cancelled':
+                logger.info("Updating cancelled shipment: %s", shipment_id)
+                return await ahandle_status_update(shipment_id, status)
+            else:
+                logger.info("Creating new shipment: %s", shipment_id)
+                shipment = await ahandle_shipment_creation(shipment_data, request)
+                await ahandle_status_update(shipment.shipment_id, status)
+                return JsonResponse({'message': 'Shipment created successfully', 'shipment_id': shipment.shipment_id},
+                                    status=201)
+    except ShipmentLockTimeout as e:
+        logger.warning("%s", e)
+        return JsonResponse({'error': str(e)}, status=503)
+    except Exception as e:
+        logger.error("Error in ahandle_shipment_creation_or_update: %s", e)
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@traced('shipment.create')
+async def ahandle_shipment_creation(shipment_data, request):
+    """
+    Async version of `handle_shipment_creation`. Errors are logged and raised to the caller.
+    """
+    shipment_id = shipment_data.get('shipment_id')
+    set_span_attributes(shipment_id=shipment_id)
+    logger.info("Creating shipment with ID:%s", shipment_id)
+    try:
+        new_shipment = Shipment(**shipment_data)
+        await new_shipment.asave()
+
+        pdf_label_url = request.build_absolute_uri(
+            reverse('shipments:generate_pdf_label', args=[new_shipment.shipment_id])
+        )
+        new_shipment.label = {'url': pdf_label_url}
+        await new_shipment.asave()
+        await ainvalidate_shipment(new_shipment.shipment_id, new_shipment.merchant)
+        await aannounce_shipment(new_shipment)
+
+        logger.info("Shipment created successfully with ID: %s", new_shipment.shipment_id)
+        return new_shipment
+    except Exception as e:
+        logger.error("Error in ahandle_shipment_creation: %s", e)
+        raise
+
+
+@traced('shipment.update')
+async def ahandle_shipment_update(shipment_data):
+    """
+    Async version of `handle_shipment_update`.
+    """
+    shipment_id = shipment_data.get('shipment_id')
+    if shipment_id is None:
+        logger.warning("Missing shipping id in payload")
+        return JsonResponse({'error': 'Missing shipping id in payload'}, status=400)
+
+    set_span_attributes(shipment_id=shipment_id)
+    logger.info("Updating shipment with ID: %s", shipment_id)
+    try:
+        shipment = await Shipment.objects.aget(shipment_id=shipment_id)
+        changed = shipment.apply_changes(shipment_data)
+        if changed:
+            await shipment.asave(update_fields=changed)
+            await ainvalidate_shipment(shipment_id, shipment.merchant)
+            logger.info("Shipment update event processed for shipment_id: %s, changed: %s", shipment_id, changed)
+        else:
+            logger.info("Shipment update event for shipment_id: %s changed nothing", shipment_id)
+        return JsonResponse({'message': 'Shipment update event processed'}, status=200)
+    except Shipment.DoesNotExist:
+        logger.error("Shipment with shipment_id %s does not exist.", shipment_id)
+        return JsonResponse({'error': f"Shipment with shipment_id {shipment_id} does not exist."}, status=400)
+    except Exception as e:
+        logger.error("Error in ahandle_shipment_update: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@traced('shipment.status_update')
+async def ahandle_status_update(shipment_id, status):
+    """
+    Async version of `handle_status_update`.
+    """
+    set_span_attributes(shipment_id=shipment_id, status=status)
+    logger.info("Updating status for shipment_id: %s to %s", shipment_id, status)
+    try:
+        shipment = await Shipment.objects.aget(shipment_id=shipment_id)
+        new_status = ShipmentStatus(shipment=shipment, status=status)
+        await new_status.asave()
+        await ainvalidate_shipment(shipment_id, shipment.merchant)
+        await aannounce_status(new_status)
+        await sync_to_async(record_status_transition)(new_status)
+        if notifications_enabled.get():
+            if pending_notifications.get() is not None:
+                pending_notifications.get().append((shipment, status))
+            else:
+                await asend_notifications(shipment, status)
+        logger.info("Shipment status updated successfully for shipment_id: %s", shipment_id)
+        return JsonResponse({'message': 'Shipment status updated successfully'}, status=200)
+    except Shipment.DoesNotExist:
+        logger.error("Shipment not found for shipment_id %s", shipment_id)
+        return JsonResponse({'error': 'Shipment not found'}, status=404)
+    except Exception as e:
+        logger.error("Error in ahandle_status_update: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def build_shipment_data(data):
+    """
+    Maps a Salla shipment event onto Shipment fields.
+
+    Args:
+    data (dict): A dictionary containing the shipment event, as sent by Salla.
+
+    Returns:
+    tuple: A tuple containing a dictionary of shipment data and the status of the shipment.
+
+    Raises:
+    ValueError: If the 'created_at' field is missing in the shipment data.
+    KeyError: If the 'data' field is missing in the shipment data.
+
+    This is the mapping shared by the webhook path (`parse_shipment_data`) and bulk imports; it does no logging so that
+    it stays cheap when called for millions of records.
+    """
+    created_at_str = data.get('created_at')
+    if not created_at_str:
+        raise ValueError("Missing 'created_at' field in the shipment data")
+
+    from dateutil.parser import parse as parse_date
+    created_at = parse_date(created_at_str).isoformat()
+
+    status = data['data'].get('status')
+
+    shipment_data = {
+        'event': data.get('event'),
+        'merchant': data.get('merchant'),
+        'created_at': created_at,
+        'shipment_id': data['data'].get('id'),
+        'type': data['data'].get('type'),
+        'courier_name': data['data'].get('courier_name'),
+        'courier_logo': data['data'].get('courier_logo'),
+        'tracking_number': data['data'].get('tracking_number'),
+        'tracking_link': data['data'].get('tracking_link'),
+        'payment_method': data['data'].get('payment_method'),
+        'total': data['data'].get('total'),
+        'cash_on_delivery': data['data'].get('cash_on_delivery'),
+        'label': data['data'].get('label'),
+        'total_weight': data['data'].get('total_weight'),
+        'created_at_details': data['data'].get('created_at'),
+        'packages': data['data'].get('packages'),
+        'ship_from': data['data'].get('ship_from'),
+        'ship_to': data['data'].get('ship_to'),
+        'meta': data['data'].get('meta'),
+    }
+    return shipment_data, status
+
+
+@traced('shipment.parse')
 def parse_shipment_data(data):
     """
     Parses the provided shipment data and returns a dictionary containing the parsed data.
@@ -185,41 +447,12 @@ def parse_shipment_data(data):
 
     This function first checks if the 'created_at' field is present in the shipment data. If it is, it parses the 'created_at' field using the 'datetime' module and formats it as an ISO 8601 string. It then extracts the remaining shipment data from the 'data' field of the input dictionary. The parsed shipment data is then formatted as a JSON string and logged using the 'logger' object. Finally, the parsed shipment data and the status of the shipment are returned as a tuple. If the 'created_at' field is missing in the shipment data, a ValueError is raised with an appropriate error message.
     """
-    formatted_data = json.dumps(data, indent=4, ensure_ascii=False)
-    logger.info(f"Parsing shipment data:\n{formatted_data}")
+    log_payload(logger, "Parsing shipment data:", data)
     try:
-        created_at_str = data.get('created_at')
-        if not created_at_str:
-            raise ValueError("Missing 'created_at' field in the shipment data")
-
-        created_at = parse_date(created_at_str).isoformat()
-
-        status = data['data'].get('status')
-
-        shipment_data = {
-            'event': data.get('event'),
-            'merchant': data.get('merchant'),
-            'created_at': created_at,
-            'shipment_id': data['data'].get('id'),
-            'type': data['data'].get('type'),
-            'courier_name': data['data'].get('courier_name'),
-            'courier_logo': data['data'].get('courier_logo'),
-            'tracking_number': data['data'].get('tracking_number'),
-            'tracking_link': data['data'].get('tracking_link'),
-            'payment_method': data['data'].get('payment_method'),
-            'total': data['data'].get('total'),
-            'cash_on_delivery': data['data'].get('cash_on_delivery'),
-            'label': data['data'].get('label'),
-            'total_weight': data['data'].get('total_weight'),
-            'created_at_details': data['data'].get('created_at'),
-            'packages': data['data'].get('packages'),
-            'ship_from': data['data'].get('ship_from'),
-            'ship_to': data['data'].get('ship_to'),
-            'meta': data['data'].get('meta'),
-        }
-        formatted_data = json.dumps(shipment_data, indent=4, ensure_ascii=False)
-        logger.info(f"Parsed shipment data successfully:\n{formatted_data}")
+        shipment_data, status = build_shipment_data(data)
+        set_span_attributes(shipment_id=shipment_data.get('shipment_id'))
+        log_payload(logger, "Parsed shipment data successfully:", shipment_data)
         return shipment_data, status
     except Exception as e:
-        logger.error(f"Error in parse_shipment_data: {str(e)}")
+        logger.error("Error in parse_shipment_data: %s", e)
         raise ValueError(f"Error parsing shipment data: {str(e)}")
@@ -0,0 +1,211 @@
+"""
+Admission control for inbound webhooks.
+
+A merchant running a bulk action in Salla can send thousands of events at once. Two limits keep that from starving
+the other merchants:
+
+- Each merchant has a token bucket of BURST events refilled at RATE events per second. Over it, the webhook is
+  answered 429 Too Many Requests with a Retry-After of the time until the next token.
+- Each worker process handles at most MAX_IN_FLIGHT webhooks at a time. Over it, the webhook is answered 503 Service
+  Unavailable with a Retry-After of OVERLOAD_RETRY_AFTER seconds, without touching the database.
+
+The merchant comes from the webhook body, which is not authenticated, so only merchants that installed the app get
+a bucket of their own. Webhooks of any other merchant ID share the UNKNOWN_BUCKET, and cannot create buckets, or
+escape their limit, by making merchant IDs up.
+
+Buckets are shared by all workers. With BACKEND 'cache' they live in CACHES[ALIAS], which must be shared and
+increment atomically (Redis): the bucket is then approximated by a counter of BURST events per window of
+BURST / RATE seconds. With BACKEND 'database' they are RateLimitBucket rows, refilled and taken from in one UPDATE.
+A bucket unused for BURST / RATE seconds is full, so the rows of those are deleted whenever a bucket is created.
+If the backend fails, webhooks are admitted.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Value
+from django.db.models.functions import Least
+from django.db.models.lookups import GreaterThanOrEqual
+from django.http import JsonResponse
+
+from ..cache import merchant_installed
+from ..metrics import WEBHOOK_ADMISSIONS
+from ..models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'database',
+    'ALIAS': 'default',
+    'RATE': 20.0,
+    'BURST': 200,
+    'MAX_IN_FLIGHT': 32,
+    'OVERLOAD_RETRY_AFTER': 5,
+}
+UNKNOWN_BUCKET = 'merchant:unknown'
+
+
+def get_throttle_settings():
+    """
+    Returns the WEBHOOK_LIMITS settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'WEBHOOK_LIMITS', {})}
+
+
+class InFlight:
+    """
+    Counts the webhooks this process is handling.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def enter(self, limit):
+        with self._lock:
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.count -= 1
+
+
+in_flight = InFlight()
+
+
+def take_from_cache(key, config, now):
+    """
+    Takes a token from a merchant's bucket in the cache.
+
+    Returns:
+    float: 0 if a token was taken, else the seconds until the next one.
+    """
+    cache = caches[config['ALIAS']]
+    window = config['BURST'] / config['RATE']
+    started = now - now % window
+    window_key = f'webhook-limit:{key}:{int(started / window)}'
+    cache.add(window_key, 0, timeout=math.ceil(window) + 1)
+    try:
+        count = cache.incr(window_key)
+    except ValueError:
+        # The window expired between add() and incr().
+        cache.set(window_key, 1, timeout=math.ceil(window) + 1)
+        count = 1
+    return 0 if count <= config['BURST'] else started + window - now
+
+
+def take_from_database(key, config, now):
+    """
+    Takes a token from a merchant's RateLimitBucket.
+
+    Returns:
+    float: 0 if a token was taken, else the seconds until the next one.
+    """
+    rate, burst = float(config['RATE']), float(config['BURST'])
+    available = Least(Value(burst), F('tokens') + (Value(now) - F('refilled_at')) * Value(rate))
+    taken = RateLimitBucket.objects.filter(GreaterThanOrEqual(available, 1.0), key=key).update(
+        tokens=available - Value(1.0), refilled_at=Value(now))
+    if taken:
+        return 0
+    bucket, created = RateLimitBucket.objects.get_or_create(key=key, defaults={'tokens': burst - 1,
+                                                                               'refilled_at': now})
+    if created:
+        prune_buckets(config, now)
+        return 0
+    tokens = min(burst, bucket.tokens + (now - bucket.refilled_at) * rate)
+    # A token may have been refilled since the UPDATE; the webhook is still refused, for the shortest wait.
+    return max((1 - tokens) / rate, 1 / rate)
+
+
+def prune_buckets(config, now):
+    """
+    Deletes the RateLimitBuckets that have refilled completely, which are the same as no bucket.
+
+    Returns:
+    int: The number of buckets deleted.
+    """
+    horizon = now - float(config['BURST']) / float(config['RATE'])
+    deleted, _ = RateLimitBucket.objects.filter(refilled_at__lt=horizon).delete()
+    return deleted
+
+
+def bucket_key(merchant):
+    """
+    Returns the key of the bucket of a webhook's merchant, UNKNOWN_BUCKET unless it installed the app.
+    """
+    # Out of range IDs would fail the lookup, which admits the webhook.
+    if isinstance(merchant, int) and 0 < merchant < 2 ** 31 and merchant_installed(merchant):
+        return f'merchant:{merchant}'
+    return UNKNOWN_BUCKET
+
+
+BACKENDS = {
+    'cache': take_from_cache,
+    'database': take_from_database,
+}
+
+
+def merchant_wait(merchant, config, now=None):
+    """
+    Takes a token from a merchant's bucket.
+
+    Args:
+    merchant (int): The merchant ID from the webhook body, None when missing.
+    config (dict): The WEBHOOK_LIMITS settings.
+    now (float): The Unix time, the current time by default.
+
+    Returns:
+    float: 0 if the webhook is admitted, else the seconds until the merchant's next token.
+    """
+    take = BACKENDS[config['BACKEND']]
+    try:
+        return take(bucket_key(merchant), config, time.time() if now is None else now)
+    except Exception as e:
+        logger.warning("Webhook rate limit check failed, admitting the webhook: %s", e)
+        return 0
+
+
+def rejection(status, message, retry_after):
+    response = JsonResponse({'error': message}, status=status)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def admit_webhook(merchant):
+    """
+    Admits a webhook of a merchant, or sheds it.
+
+    Args:
+    merchant (int): The merchant ID from the webhook body.
+
+    Returns:
+    JsonResponse: A 503 or 429 response with a Retry-After header if the webhook is shed. None if it is admitted,
+    in which case the caller must call `release_webhook()` once it is handled.
+    """
+    config = get_throttle_settings()
+    if not config['ENABLED']:
+        in_flight.enter(math.inf)
+        return None
+    if not in_flight.enter(config['MAX_IN_FLIGHT']):
+        logger.warning("Shedding webhook of merchant %s: %s webhooks in flight", merchant, in_flight.count)
+        WEBHOOK_ADMISSIONS.labels('overloaded').inc()
+        return rejection(503, 'Server busy', config['OVERLOAD_RETRY_AFTER'])
+    wait = merchant_wait(merchant, config)
+    if wait:
+        in_flight.leave()
+        logger.warning("Rate limiting webhooks of merchant %s for %.1fs", merchant, wait)
+        WEBHOOK_ADMISSIONS.labels('rate_limited').inc()
+        return rejection(429, 'Too many webhooks for this merchant', wait)
+    WEBHOOK_ADMISSIONS.labels('accepted').inc()
+    return None
+
+
+def release_webhook():
+    in_flight.leave()
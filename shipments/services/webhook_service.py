@@ -1,11 +1,20 @@
 import json
 import logging
+import time
 
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
+from .journal_service import ajournal_webhook, journal_webhook
 from .salla_service import handle_store_authorize, handle_app_installed, handle_app_uninstalled
-from .shipment_service import handle_shipment_creation_or_update, parse_shipment_data
+from .shipment_service import (
+    ahandle_shipment_creation_or_update, handle_shipment_creation_or_update, parse_shipment_data,
+)
+from .throttle_service import admit_webhook, release_webhook
+from shipment_management.tracing import span
+
+from ..metrics import WEBHOOK_EVENTS_TOTAL, WEBHOOK_LATENCY, webhook_event_label
 
 # Initialize the logger
 logger = logging.getLogger(__name__)
@@ -30,6 +39,8 @@ def webhook_handler(request):
 
        If the request method is POST, it attempts to parse the request body as JSON. If this fails, it returns a JSON response with an error message.
 
+       The webhook then goes through admission control (see `throttle_service`): when its merchant is over its rate limit it is answered 429, and when the worker is handling too many webhooks it is answered 503, both with a Retry-After header. Admitted webhooks are appended to the journal (see `journal_service`) before they are handled.
+
        If the parsed JSON contains an 'event' field, the function processes the event accordingly. If the 'event' field is 'app.store.authorize', it calls `handle_store_authorize` with the parsed JSON as argument.
 
        If the 'event' field is 'app.installed', it calls `handle_app_installed` with the parsed JSON as argument.
@@ -47,31 +58,122 @@ def webhook_handler(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            event = data.get('event')
-            logger.info(f"Received webhook event: {event}")
-            if event == 'app.store.authorize':
-                logger.info("Calling handle_store_authorize")
-                return handle_store_authorize(data)
-            elif event == 'app.installed':
-                logger.info("Calling handle_app_installed")
-                return handle_app_installed(data)
-            elif event == 'app.uninstalled':
-                logger.info("Calling handle_app_uninstalled")
-                return handle_app_uninstalled(data)
-            else:
-                shipment_data, status = parse_shipment_data(data)
-                if event == 'shipment.creating':
-                    logger.info("Calling handle_shipment_creation_or_update for creating")
-                    return handle_shipment_creation_or_update(shipment_data, "created", request)
-                elif event == 'shipment.cancelled':
-                    logger.info("Calling handle_shipment_creation_or_update for cancelled")
-                    return handle_shipment_creation_or_update(shipment_data, "cancelled", request)
-                else:
-                    logger.warning(f"Unknown event type: {event}")
-                    return JsonResponse({'error': 'Unknown event type'}, status=400)
         except json.JSONDecodeError:
             logger.error("Invalid JSON data received")
             return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+        event = data.get('event')
+        logger.info("Received webhook event: %s", event)
+        event_label = webhook_event_label(event)
+        start = time.perf_counter()
+        status = 500
+        rejection = admit_webhook(data.get('merchant'))
+        try:
+            if rejection is not None:
+                status = rejection.status_code
+                return rejection
+            journal_webhook(request.body, data)
+            with span('webhook.dispatch', event=event, merchant=data.get('merchant')) as dispatch_span:
+                response = dispatch_event(event, data, request)
+                status = response.status_code
+                dispatch_span.set_attribute('http.status_code', status)
+            return response
+        finally:
+            if rejection is None:
+                release_webhook()
+            WEBHOOK_LATENCY.labels(event_label).observe(time.perf_counter() - start)
+            WEBHOOK_EVENTS_TOTAL.labels(event_label, str(status)).inc()
+    else:
+        logger.warning("Method not allowed: %s", request.method)
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+def dispatch_event(event, data, request):
+    """
+    Routes a decoded webhook event to its handler.
+
+    Args:
+    event (str): The event name, e.g. 'shipment.creating'.
+    data (dict): The decoded webhook body.
+    request (HttpRequest): The incoming HTTP request.
+
+    Returns:
+    JsonResponse: The response of the handler, or a 400 response for unknown event types.
+    """
+    if event == 'app.store.authorize':
+        logger.info("Calling handle_store_authorize")
+        return handle_store_authorize(data)
+    elif event == 'app.installed':
+        logger.info("Calling handle_app_installed")
+        return handle_app_installed(data)
+    elif event == 'app.uninstalled':
+        logger.info("Calling handle_app_uninstalled")
+        return handle_app_uninstalled(data)
     else:
-        logger.warning(f"Method not allowed: {request.method}")
+        shipment_data, status = parse_shipment_data(data)
+        if event == 'shipment.creating':
+            logger.info("Calling handle_shipment_creation_or_update for creating")
+            return handle_shipment_creation_or_update(shipment_data, "created", request)
+        elif event == 'shipment.cancelled':
+            logger.info("Calling handle_shipment_creation_or_update for cancelled")
+            return handle_shipment_creation_or_update(shipment_data, "cancelled", request)
+        else:
+            logger.warning("Unknown event type: %s", event)
+            return JsonResponse({'error': 'Unknown event type'}, status=400)
+
+
+@csrf_exempt
+async def awebhook_handler(request):
+    """
+    Async version of `webhook_handler`, served when settings.ASYNC_VIEWS['ENABLED'] is on under ASGI.
+
+    While a webhook waits on the database, SMTP or Salla, the worker's event loop keeps serving other requests
+    instead of holding a thread per webhook.
+    """
+    if request.method != 'POST':
+        logger.warning("Method not allowed: %s", request.method)
         return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON data received")
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    event = data.get('event')
+    logger.info("Received webhook event: %s", event)
+    event_label = webhook_event_label(event)
+    start = time.perf_counter()
+    status = 500
+    rejection = await sync_to_async(admit_webhook)(data.get('merchant'))
+    try:
+        if rejection is not None:
+            status = rejection.status_code
+            return rejection
+        await ajournal_webhook(request.body, data)
+        with span('webhook.dispatch', event=event, merchant=data.get('merchant')) as dispatch_span:
+            response = await adispatch_event(event, data, request)
+            status = response.status_code
+            dispatch_span.set_attribute('http.status_code', status)
+        return response
+    finally:
+        if rejection is None:
+            release_webhook()
+        WEBHOOK_LATENCY.labels(event_label).observe(time.perf_counter() - start)
+        WEBHOOK_EVENTS_TOTAL.labels(event_label, str(status)).inc()
+
+
+async def adispatch_event(event, data, request):
+    """
+    Async version of `dispatch_event`. Shipment events take the async path; the rare app lifecycle events reuse
+    their sync handlers in a thread.
+    """
+    if event in ('app.store.authorize', 'app.installed', 'app.uninstalled'):
+        return await sync_to_async(dispatch_event)(event, data, request)
+    shipment_data, status = parse_shipment_data(data)
+    if event == 'shipment.creating':
+        logger.info("Calling ahandle_shipment_creation_or_update for creating")
+        return await ahandle_shipment_creation_or_update(shipment_data, "created", request)
+    elif event == 'shipment.cancelled':
+        logger.info("Calling ahandle_shipment_creation_or_update for cancelled")
+        return await ahandle_shipment_creation_or_update(shipment_data, "cancelled", request)
+    else:
+        logger.warning("Unknown event type: %s", event)
+        return JsonResponse({'error': 'Unknown event type'}, status=400)
@@ -0,0 +1,40 @@
+from django import template
+from shipment_management.tiered_cache import get_tiered_cache
+
+register = template.Library()
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, key, tags):
+        self.nodelist = nodelist
+        self.key = key
+        self.tags = tags
+
+    def render(self, context):
+        key = self.key.resolve(context)
+        if not key:
+            # e.g. a variable missing from the context: rendered without caching rather than under a shared key.
+            return self.nodelist.render(context)
+        key = f'fragment:{key}'
+        tags = [tag.resolve(context) for tag in self.tags]
+        return get_tiered_cache().get_or_set(key, lambda: self.nodelist.render(context), tags=tags)
+
+
+@register.tag
+def cachedfragment(parser, token):
+    """
+    Caches the rendered content of the block in the tiered cache until one of its tags is invalidated.
+
+    Usage:
+    {% load shipment_cache %}
+    {% cachedfragment table_cache_key scope_tag 'shipments:bulk' %} ... {% endcachedfragment %}
+
+    Only cache content that is the same for every user who gets the key: the fragment is rendered once and served to
+    all of them. Content that depends on the user needs a key per user or scope, e.g. per merchant.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a key and optional tags")
+    nodelist = parser.parse(('endcachedfragment',))
+    parser.delete_first_token()
+    return CachedFragmentNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
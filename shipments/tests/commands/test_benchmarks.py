@@ -0,0 +1,60 @@
+import json
+import pytest
+from io import StringIO
+from django.core.management import call_command, CommandError
+from shipments.models import MerchantToken, Shipment, ShipmentStatus
+
+
+@pytest.mark.django_db
+def test_generate_synthetic_data():
+    call_command('generate_synthetic_data', '--shipments', '25', '--merchants', '3', '--seed', '1',
+                 '--batch-size', '10', stdout=StringIO())
+    assert Shipment.objects.count() == 25
+    assert MerchantToken.objects.count() == 3
+    assert len(set(Shipment.objects.values_list('shipping_number', flat=True))) == 25
+    assert ShipmentStatus.objects.filter(status='created').count() == 25
+    shipment = Shipment.objects.first()
+    assert {'name', 'city', 'phone', 'latitude'} <= set(shipment.ship_to)
+    assert shipment.packages[0]['price']['currency'] == 'SAR'
+
+    # Running again grows the data set
+    call_command('generate_synthetic_data', '--shipments', '5', '--merchants', '3', stdout=StringIO())
+    assert Shipment.objects.count() == 30
+
+
+@pytest.mark.django_db
+def test_run_benchmarks_writes_results(tmp_path):
+    output = tmp_path / 'results.json'
+    call_command('run_benchmarks', '--sizes', '20', '--iterations', '2',
+                 '--scenarios', 'shipment_detail,webhook_handler,search_shipments',
+                 '--output', str(output), stdout=StringIO())
+    report = json.loads(output.read_text())
+    run = report['runs'][0]
+    assert run['shipments'] == 20
+    assert set(run['results']) == {'shipment_detail', 'webhook_handler', 'search_shipments'}
+    assert run['results']['webhook_handler']['status_code'] == 201
+    assert run['results']['shipment_detail']['status_code'] == 200
+    assert run['results']['search_shipments']['status_code'] == 200
+    # Repeated detail requests are served from the tiered cache; only the session and the user are loaded
+    assert run['results']['shipment_detail']['queries'] == 2
+    # Shipments created by the webhook benchmark are cleaned up
+    assert Shipment.objects.count() == 20
+
+
+def test_benchmark_startup_keeps_weasyprint_lazy(tmp_path):
+    output = tmp_path / 'startup.json'
+    call_command('benchmark_startup', '--targets', 'wsgi', '--commands', 'check', '--runs', '1',
+                 '--output', str(output), stdout=StringIO())
+
+    results = json.loads(output.read_text())
+    assert set(results) == {'wsgi', 'manage.py check'}
+    for result in results.values():
+        assert result['import_ms'] > 0 and result['rss_mb'] > 0
+        assert 'weasyprint' not in result['heavy_modules']
+        assert 'requests' not in result['heavy_modules']
+
+
+def test_benchmark_startup_enforces_budget():
+    with pytest.raises(CommandError, match='Start-up budget exceeded'):
+        call_command('benchmark_startup', '--targets', 'django_setup', '--commands', '', '--runs', '1',
+                     '--max-import-ms', '0.001', stdout=StringIO())
@@ -0,0 +1,40 @@
+import pytest
+from io import StringIO
+from django.core.management import call_command, CommandError
+from shipments.models import Shipment, ShipmentStatus
+
+
+@pytest.fixture
+def shipments(db):
+    for shipment_id in (1, 2):
+        shipment = Shipment.objects.create(shipment_id=shipment_id, event='shipment.creating', merchant=123,
+                                           shipping_number=f'{shipment_id:06d}012024')
+        ShipmentStatus.objects.create(shipment=shipment, status='created')
+
+
+def test_bulk_update_status_from_manifest(shipments, tmp_path, mocker):
+    update_salla = mocker.patch('shipments.services.bulk_status_service.bulk_update_salla_api')
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('shipping_number,courier\n000002012024,SMSA\n000009012024,SMSA\n')
+    out = StringIO()
+
+    call_command('bulk_update_status', 'delivered', '1', '--manifest', str(manifest), stdout=out)
+
+    assert set(Shipment.objects.values_list('current_status', flat=True)) == {'delivered'}
+    assert 'Manifest numbers not found: 000009012024' in out.getvalue()
+    assert 'Successfully marked 2 shipments as delivered' in out.getvalue()
+    update_salla.assert_called_once()
+
+
+def test_bulk_update_status_without_notifications(shipments, mocker):
+    update_salla = mocker.patch('shipments.services.bulk_status_service.bulk_update_salla_api')
+    call_command('bulk_update_status', 'returned', '1', '7', '--no-notify', stdout=StringIO())
+    assert Shipment.objects.get(shipment_id=1).current_status == 'returned'
+    update_salla.assert_not_called()
+
+
+def test_bulk_update_status_needs_shipments(shipments):
+    with pytest.raises(CommandError):
+        call_command('bulk_update_status', 'delivered', stdout=StringIO())
+    with pytest.raises(CommandError, match='Unknown status'):
+        call_command('bulk_update_status', 'lost', '1', stdout=StringIO())
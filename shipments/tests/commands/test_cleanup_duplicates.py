@@ -0,0 +1,48 @@
+import pytest
+from io import StringIO
+from django.core.management import call_command
+from shipments.models import Shipment, ShipmentStatus
+
+
+def create_shipment(shipment_id, created_at, tracking_number, merchant=123, statuses=('created',)):
+    shipment = Shipment.objects.create(
+        shipment_id=shipment_id,
+        event='shipment.creating',
+        merchant=merchant,
+        created_at=created_at,
+        shipping_number=f'{shipment_id:06d}012024',
+        tracking_number=tracking_number,
+    )
+    for status in statuses:
+        ShipmentStatus.objects.create(shipment=shipment, status=status, date_time='2024-01-02T00:00:00Z')
+    return shipment
+
+
+@pytest.fixture
+def duplicates():
+    create_shipment(3, '2024-01-01T00:00:00Z', 'TN1', statuses=('created',))
+    create_shipment(1, '2024-01-01T05:00:00Z', 'TN1', statuses=('created', 'delivered'))
+    create_shipment(2, '2024-01-01T09:00:00Z', 'TN1', statuses=('returned',))
+    create_shipment(4, '2024-01-01T09:00:00Z', 'TN1', merchant=456)
+    create_shipment(5, '2024-01-01T09:00:00Z', '')
+    create_shipment(6, '2024-01-01T09:00:00Z', '')
+
+
+@pytest.mark.django_db
+def test_cleanup_duplicates_dry_run(duplicates):
+    out = StringIO()
+    call_command('cleanup_duplicates', '--dry-run', stdout=out)
+    assert 'Dry run: 2 duplicate shipments would be removed' in out.getvalue()
+    assert Shipment.objects.count() == 6
+
+
+@pytest.mark.django_db
+def test_cleanup_duplicates_keeps_oldest_and_merges_statuses(duplicates):
+    out = StringIO()
+    call_command('cleanup_duplicates', '--batch-size', '1', stdout=out)
+    assert 'Successfully cleaned up 2 duplicate shipments' in out.getvalue()
+    assert sorted(Shipment.objects.values_list('shipment_id', flat=True)) == [3, 4, 5, 6]
+    # The identical 'created' statuses collapse into one on the survivor
+    assert sorted(ShipmentStatus.objects.filter(shipment_id=3).values_list('status', flat=True)) == [
+        'created', 'delivered', 'returned'
+    ]
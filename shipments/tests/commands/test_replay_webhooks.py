@@ -0,0 +1,39 @@
+import json
+import pytest
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from shipments.models import WebhookJournal
+from shipments.services.journal_service import journal_webhook
+
+
+@pytest.fixture
+def journaled():
+    for merchant in (1, 2):
+        data = {'event': 'app.installed', 'merchant': merchant}
+        journal_webhook(json.dumps(data).encode(), data)
+    WebhookJournal.objects.filter(merchant=1).update(received_at=timezone.now() - timedelta(days=3))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_replay_webhooks_dry_run_in_range(journaled):
+    out = StringIO()
+    since = (timezone.localdate() - timedelta(days=1)).isoformat()
+    call_command('replay_webhooks', '--since', since, '--include-app-events', '--dry-run', stdout=out)
+    output = out.getvalue()
+    assert 'app.installed: 1' in output
+    assert 'Checked 1 webhooks (1 ok)' in output
+
+
+@pytest.mark.django_db(transaction=True)
+def test_replay_webhooks_skips_app_events_by_default(journaled):
+    out = StringIO()
+    call_command('replay_webhooks', '--dry-run', stdout=out)
+    assert 'Checked 0 webhooks (none)' in out.getvalue()
+
+
+def test_replay_webhooks_rejects_invalid_dates():
+    with pytest.raises(CommandError):
+        call_command('replay_webhooks', '--since', 'yesterday')
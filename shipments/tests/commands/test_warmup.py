@@ -0,0 +1,53 @@
+import threading
+import pytest
+from io import StringIO
+from django.core.management import call_command, CommandError
+from shipments import warmup
+
+
+@pytest.mark.django_db
+def test_warmup_command_reports_steps():
+    out = StringIO()
+    call_command('warmup', '--steps', 'templates,database,label', stdout=out)
+    output = out.getvalue()
+    assert 'Warmup complete' in output
+    for step in ('templates', 'database', 'label'):
+        assert f'{step:<10} ok' in output
+
+
+def test_warmup_records_errors_and_timeouts(monkeypatch):
+    def failing_step():
+        raise RuntimeError('boom')
+
+    release = threading.Event()
+    monkeypatch.setitem(warmup.STEPS, 'templates', failing_step)
+    monkeypatch.setitem(warmup.STEPS, 'fonts', release.wait)
+    try:
+        report = warmup.run_warmup(['templates', 'fonts', 'label'], timeout=0.2)
+    finally:
+        release.set()
+    assert not report['ok'] and report['timed_out']
+    assert report['steps']['templates']['status'] == 'error'
+    assert report['steps']['templates']['error'] == 'boom'
+    assert report['steps']['fonts']['status'] == 'timeout'
+    assert report['steps']['fonts']['duration_ms'] > 100
+    assert report['steps']['label'] == {'status': 'skipped', 'duration_ms': None}
+
+
+def test_warmup_command_fails_on_unknown_step():
+    with pytest.raises(CommandError, match='Unknown warmup steps: nope'):
+        call_command('warmup', '--steps', 'templates,nope', stdout=StringIO())
+
+
+def test_ready_only_warms_serving_processes(monkeypatch, settings):
+    from django.apps import apps
+    started = []
+    monkeypatch.setattr(warmup, 'start_warmup', lambda: started.append(True))
+    settings.WARMUP = {'ENABLED': True}
+    config = apps.get_app_config('shipments')
+
+    monkeypatch.setattr('sys.argv', ['manage.py', 'migrate'])
+    config.ready()
+    monkeypatch.setattr('sys.argv', ['gunicorn', 'shipment_management.wsgi'])
+    config.ready()
+    assert started == [True]
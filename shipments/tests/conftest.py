@@ -0,0 +1,51 @@
+import pytest
+
+from shipment_management.query_budget import assert_query_budget
+from shipment_management.tiered_cache import get_tiered_cache
+from shipments.models import MerchantUser
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Asserts SQL budgets in tests, e.g. `with query_budget(view_name='shipments:home'): client.get(url)`.
+    """
+    return assert_query_budget
+
+
+@pytest.fixture(autouse=True)
+def tiered_cache():
+    """
+    Empties the tiered cache around every test, so that cached pages never outlive the rows of the test.
+    """
+    cache = get_tiered_cache()
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def static_storage(settings):
+    """
+    Serves static files without the manifest that only `collectstatic` writes.
+    """
+    settings.STORAGES = {**settings.STORAGES,
+                         'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+
+
+@pytest.fixture
+def merchant_client(client, django_user_model):
+    """
+    A client logged in as a user of merchant 123.
+    """
+    user = django_user_model.objects.create_user('merchant-123', password='secret')
+    MerchantUser.objects.create(user=user, merchant=123)
+    client.force_login(user)
+    return client
+
+
+def shipment_queries(captured):
+    """
+    Returns the captured SQL that read or wrote shipments, leaving out the session and user lookups of logins.
+    """
+    return [query['sql'] for query in captured if 'shipments_' in query['sql']]
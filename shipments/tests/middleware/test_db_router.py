@@ -0,0 +1,74 @@
+import pytest
+from django.http import HttpResponse
+from django.urls import reverse
+from shipment_management.db_router import PrimaryReplicaRouter, routing, use_replica
+from shipment_management.middleware import DatabaseRoutingMiddleware
+from shipments.cache import get_shipment_detail, invalidate_shipment
+from shipments.models import Shipment
+
+router = PrimaryReplicaRouter()
+
+
+@pytest.fixture
+def replica(settings, monkeypatch):
+    # Only the router sees the alias; no connection to it is ever opened.
+    monkeypatch.setitem(settings.DATABASES, 'replica', dict(settings.DATABASES['default']))
+    settings.DATABASE_ROUTING = {'READ_ONLY_VIEWS': ('shipments:home',), 'STICKY_SECONDS': 5}
+
+
+@pytest.fixture
+def middleware():
+    # The "view" reports where a read would go.
+    return DatabaseRoutingMiddleware(lambda request: HttpResponse(router.db_for_read(Shipment)))
+
+
+def test_reads_use_replica_in_scope_until_a_write(replica):
+    assert router.db_for_read(Shipment) == 'default'
+    with use_replica():
+        assert router.db_for_read(Shipment) == 'replica'
+        assert router.db_for_write(Shipment) == 'default'
+        assert router.db_for_read(Shipment) == 'default'
+    with routing():
+        assert router.db_for_read(Shipment) == 'default'
+
+
+def test_reads_use_primary_without_replica():
+    with use_replica():
+        assert router.db_for_read(Shipment) == 'default'
+
+
+def test_middleware_routes_read_only_views(rf, replica, middleware):
+    assert middleware(rf.get(reverse('shipments:home'))).content == b'replica'
+    assert middleware(rf.get(reverse('shipments:faq'))).content == b'default'
+    assert middleware(rf.get('/no-such-page/')).content == b'default'
+
+
+def test_search_reads_from_replica(rf, settings, monkeypatch, middleware):
+    # The project's READ_ONLY_VIEWS, not the fixture's.
+    monkeypatch.setitem(settings.DATABASES, 'replica', dict(settings.DATABASES['default']))
+    request = rf.get(reverse('shipments:search_shipments'), {'q': '123'})
+    assert middleware(request).content == b'replica'
+
+
+def test_middleware_pins_client_to_primary_after_write(rf, replica, middleware):
+    response = middleware(rf.post(reverse('shipments:home')))
+    assert response.content == b'default'
+    assert response.cookies['db_primary']['max-age'] == 5
+
+    request = rf.get(reverse('shipments:home'))
+    request.COOKIES['db_primary'] = '1'
+    assert middleware(request).content == b'default'
+
+
+@pytest.mark.django_db
+def test_cache_is_filled_from_primary(replica, django_capture_on_commit_callbacks):
+    Shipment.objects.create(shipment_id=1, shipping_number='123456')
+    with django_capture_on_commit_callbacks(execute=True):
+        invalidate_shipment(1)
+
+    with use_replica():
+        assert router.db_for_read(Shipment) == 'replica'
+        shipment, _ = get_shipment_detail(1)
+    assert shipment._state.db == 'default'
+    # The cached copy is the primary's too.
+    assert get_shipment_detail(1)[0]._state.db == 'default'
@@ -0,0 +1,126 @@
+import gzip
+import brotli
+import pytest
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+from shipment_management.middleware import CompressionMiddleware, StaticFilesMiddleware
+from django.utils.http import http_date
+from shipments.cache import invalidate_shipment
+from shipments.models import Shipment, ShipmentStatus
+from shipments.services.shipment_service import handle_status_update
+from shipments.tests.conftest import shipment_queries
+
+PAGE = 'shipment history ' * 100
+
+
+@pytest.fixture
+def shipment(db):
+    shipment = Shipment.objects.create(shipment_id=1, shipping_number='123456', type='shipment')
+    ShipmentStatus.objects.create(shipment=shipment, status='created')
+    return shipment
+
+
+@pytest.mark.parametrize('url', [
+    reverse('shipments:home'),
+    reverse('shipments:shipment_detail', args=[1]),
+])
+def test_unchanged_page_is_not_modified(admin_client, shipment, django_assert_max_num_queries, url):
+    # The first visit sets the CSRF cookie, which is part of the ETag of pages with forms.
+    admin_client.get(url)
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    assert response['Cache-Control'] == 'private, no-cache'
+    assert 'Last-Modified' not in response
+
+    with django_assert_max_num_queries(2) as captured:
+        response = admin_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert shipment_queries(captured) == []
+    assert response.status_code == 304
+    assert response.content == b''
+
+
+def test_status_update_changes_validators(admin_client, shipment, django_capture_on_commit_callbacks, mocker):
+    mocker.patch('shipments.services.shipment_service.update_salla_api')
+    url = reverse('shipments:shipment_detail', args=[1])
+    etag = admin_client.get(url)['ETag']
+
+    with django_capture_on_commit_callbacks(execute=True):
+        handle_status_update(1, 'delivered')
+
+    response = admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert response.context['latest_status'].status == 'delivered'
+
+
+def test_edit_without_status_is_not_a_304(admin_client, shipment, django_capture_on_commit_callbacks):
+    url = reverse('shipments:home')
+    admin_client.get(url)
+    etag = admin_client.get(url)['ETag']
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Shipment.objects.filter(shipment_id=1).update(courier_name='SMSA')
+        invalidate_shipment(1, shipment.merchant)
+
+    assert admin_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+    assert admin_client.get(url, HTTP_IF_MODIFIED_SINCE=http_date()).status_code == 200
+
+
+def test_label_is_not_rendered_again(client, shipment, mocker):
+    render = mocker.patch('shipments.services.pdf_service.render_label_pdf', return_value=b'%PDF')
+    url = reverse('shipments:generate_pdf_label', args=[1])
+    etag = client.get(url)['ETag']
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    render.assert_called_once()
+
+
+def test_missing_shipment_gets_no_validators(client, db):
+    response = client.get(reverse('shipments:generate_pdf_label', args=[999]))
+    assert response.status_code == 404
+    assert 'ETag' not in response
+
+
+@pytest.mark.parametrize('accept_encoding, encoding', [
+    ('gzip, deflate, br', 'br'),
+    ('gzip, br;q=0', 'gzip'),
+    ('identity', None),
+])
+def test_compression_picks_accepted_encoding(accept_encoding, encoding):
+    middleware = CompressionMiddleware(lambda request: HttpResponse(PAGE, headers={'ETag': '"abc"'}))
+    response = middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding))
+
+    assert response.get('Content-Encoding') == encoding
+    assert 'Accept-Encoding' in response['Vary']
+    decompress = {'br': brotli.decompress, 'gzip': gzip.decompress, None: bytes}[encoding]
+    assert decompress(response.content) == PAGE.encode()
+    if encoding:
+        assert response['ETag'] == 'W/"abc"'
+
+
+def test_short_responses_are_not_compressed():
+    middleware = CompressionMiddleware(lambda request: HttpResponse('ok'))
+    response = middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='br'))
+    assert 'Content-Encoding' not in response
+
+
+def test_collected_static_files_are_precompressed_and_immutable(settings, tmp_path):
+    source = tmp_path / 'static'
+    (source / 'css').mkdir(parents=True)
+    (source / 'css' / 'site.css').write_text('body { margin: 0; }\n' * 100)
+    settings.STATICFILES_DIRS = [str(source)]
+    settings.STATIC_ROOT = str(tmp_path / 'collected')
+    settings.STORAGES = {**settings.STORAGES, 'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'}}
+    settings.WHITENOISE_AUTOREFRESH = False
+    call_command('collectstatic', '--noinput', verbosity=0)
+    hashed = next((tmp_path / 'collected' / 'css').glob('site.*.css'))
+
+    middleware = StaticFilesMiddleware(lambda request: HttpResponse('view', status=404))
+    response = middleware(RequestFactory().get(f'/static/css/{hashed.name}', HTTP_ACCEPT_ENCODING='gzip, br'))
+
+    assert response.status_code == 200
+    assert response['Content-Encoding'] == 'br'
+    assert 'immutable' in response['Cache-Control']
+    assert brotli.decompress(b''.join(response.streaming_content)) == hashed.read_bytes()
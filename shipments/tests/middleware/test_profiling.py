@@ -0,0 +1,76 @@
+import json
+import time
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory
+from shipment_management.middleware import ProfilingMiddleware
+from shipment_management.profiling import SamplingProfiler
+
+
+def busy_view(request):
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    return HttpResponse('ok')
+
+
+def staff_user(mocker, is_staff=True):
+    return mocker.Mock(is_active=True, is_staff=is_staff)
+
+
+@pytest.fixture
+def profiling(settings, tmp_path):
+    settings.PROFILING = {'ENABLED': True, 'OUTPUT_DIR': str(tmp_path), 'INTERVAL_MS': 1, 'TOKEN': 'profile-secret'}
+    return tmp_path
+
+
+def test_sampling_profiler_formats():
+    with SamplingProfiler(interval=0.001) as profiler:
+        busy_view(None)
+
+    assert sum(profiler.samples.values()) > 0
+    assert 'busy_view (test_profiling.py:' in profiler.collapsed()
+    speedscope = profiler.speedscope('busy')
+    assert speedscope['profiles'][0]['type'] == 'sampled'
+    assert any(frame['name'] == 'busy_view' for frame in speedscope['shared']['frames'])
+
+
+def test_staff_header_writes_speedscope(mocker, profiling):
+    request = RequestFactory().get('/', HTTP_X_PROFILE='speedscope')
+    request.user = staff_user(mocker)
+    request.resolver_match = None
+
+    response = ProfilingMiddleware(busy_view)(request)
+
+    profile = json.loads((profiling / response['X-Profile-File']).read_text())
+    assert profile['profiles'][0]['samples']
+
+
+def test_token_profiles_sessionless_request(profiling):
+    request = RequestFactory().post('/shipments/webhook/', HTTP_X_PROFILE_TOKEN='profile-secret')
+    request.user = AnonymousUser()
+    request.resolver_match = None
+
+    response = ProfilingMiddleware(busy_view)(request)
+
+    assert response['X-Profile-File'].endswith('.folded')
+    assert (profiling / response['X-Profile-File']).read_text()
+
+
+def test_unauthorized_requests_not_profiled(mocker, profiling):
+    for user, headers in ((AnonymousUser(), {'HTTP_X_PROFILE': '1'}),
+                          (staff_user(mocker, is_staff=False), {'HTTP_X_PROFILE': '1'}),
+                          (AnonymousUser(), {'HTTP_X_PROFILE_TOKEN': 'wrong'})):
+        request = RequestFactory().get('/', **headers)
+        request.user = user
+        assert 'X-Profile-File' not in ProfilingMiddleware(busy_view)(request)
+    assert not list(profiling.iterdir())
+
+
+def test_sample_rate(settings, profiling):
+    settings.PROFILING = {**settings.PROFILING, 'SAMPLE_RATE': 1.0}
+    request = RequestFactory().get('/')
+    request.user = AnonymousUser()
+    request.resolver_match = None
+    assert 'X-Profile-File' in ProfilingMiddleware(busy_view)(request)
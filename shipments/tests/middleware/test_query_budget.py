@@ -0,0 +1,73 @@
+import logging
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+from shipment_management.middleware import QueryBudgetMiddleware
+from shipment_management.query_budget import fingerprint
+from shipments.models import Shipment, ShipmentStatus
+
+
+def create_shipments(count):
+    for shipment_id in range(1, count + 1):
+        shipment = Shipment.objects.create(shipment_id=shipment_id, event='shipment.creating', merchant=123,
+                                           created_at=timezone.now(), shipping_number=f'{shipment_id:06d}012024')
+        ShipmentStatus.objects.create(shipment=shipment, status='created')
+        ShipmentStatus.objects.create(shipment=shipment, status='delivered' if shipment_id % 2 else 'cancelled')
+
+
+def n_plus_one_view(request):
+    for shipment in Shipment.objects.all():
+        shipment.statuses.last()
+    return HttpResponse('ok')
+
+
+def test_fingerprint_normalizes_parameters():
+    assert fingerprint("SELECT * FROM t WHERE id = 1 AND name = 'a'") == \
+        fingerprint("SELECT * FROM t WHERE id = 42 AND name = 'b''c'")
+    assert fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)') == fingerprint('SELECT * FROM t WHERE id IN (%s)')
+
+
+@pytest.mark.django_db
+def test_middleware_flags_n_plus_one(settings, caplog):
+    settings.QUERY_BUDGET = {'HEADERS': True, 'MAX_QUERIES': 3, 'N_PLUS_ONE_THRESHOLD': 5}
+    create_shipments(6)
+    request = RequestFactory().get('/')
+    request.resolver_match = None
+
+    with caplog.at_level(logging.WARNING, logger='shipment_management.middleware'):
+        response = QueryBudgetMiddleware(n_plus_one_view)(request)
+
+    assert response['X-DB-Query-Count'] == '7'
+    assert response['X-DB-Budget-Exceeded'] == 'queries,n+1'
+    assert response['X-DB-Repeated-Queries'] == '6'
+    assert 'SQL budget exceeded' in caplog.text
+
+
+@pytest.mark.django_db
+def test_middleware_disabled(settings):
+    settings.QUERY_BUDGET = {'ENABLED': False, 'HEADERS': True}
+    response = QueryBudgetMiddleware(lambda request: HttpResponse('ok'))(RequestFactory().get('/'))
+    assert 'X-DB-Query-Count' not in response
+
+
+@pytest.mark.django_db
+def test_home_within_query_budget(merchant_client, settings, query_budget):
+    create_shipments(10)
+    Shipment.objects.create(shipment_id=11, event='shipment.creating', merchant=456, created_at=timezone.now())
+    with query_budget(view_name='shipments:home'):
+        response = merchant_client.get(reverse('shipments:home'), HTTP_HOST=settings.ALLOWED_HOSTS[0])
+
+    assert response.status_code == 200
+    assert response.context['shipment_total'] == 10
+    assert response.context['shipment_delivered'] == 5
+    assert response.context['shipment_canceled'] == 5
+
+
+@pytest.mark.django_db
+def test_query_budget_reports_n_plus_one(query_budget):
+    create_shipments(6)
+    with pytest.raises(AssertionError, match='N\\+1: 6 x'):
+        with query_budget(max_queries=100):
+            n_plus_one_view(None)
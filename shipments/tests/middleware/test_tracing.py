@@ -0,0 +1,102 @@
+import json
+import threading
+import pytest
+from datetime import timedelta
+from django.urls import reverse
+from django.utils import timezone
+from shipment_management import tracing
+from shipments.models import MerchantToken
+
+
+@pytest.fixture
+def traces(settings, tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    settings.TRACING = {'ENABLED': True, 'EXPORTER': 'file', 'FILE_PATH': str(path)}
+    tracing._exporter = None
+
+    def read():
+        tracing.get_exporter().flush()
+        return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+    yield read
+    tracing._exporter = None
+
+
+@pytest.mark.django_db
+def test_webhook_trace_covers_parse_db_salla_and_smtp(client, settings, mocker, traces):
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    MerchantToken.objects.create(merchant_id=77, access_token='token', refresh_token='refresh',
+                                 expires_at=timezone.now() + timedelta(days=1))
+    mocker.patch('requests.put', return_value=mocker.Mock(status_code=200))
+    payload = {
+        'event': 'shipment.creating', 'merchant': 77, 'created_at': '2024-01-01T10:00:00+03:00',
+        'data': {'id': 501, 'status': 'creating', 'type': 'shipment', 'ship_from': {}, 'ship_to': {}},
+    }
+
+    response = client.post(reverse('shipments:shipment_webhook'), data=json.dumps(payload),
+                           content_type='application/json', HTTP_HOST=settings.ALLOWED_HOSTS[0],
+                           HTTP_X_CORRELATION_ID='salla-delivery-1234')
+
+    assert response.status_code == 201
+    assert response['X-Correlation-ID'] == 'salla-delivery-1234'
+    spans = traces()
+    by_name = {span['name']: span for span in spans}
+    assert {'webhook.dispatch', 'shipment.parse', 'shipment.create', 'shipment.status_update', 'shipment.notify',
+            'smtp.send', 'salla.update_shipment', 'db.query'} <= set(by_name)
+    root = by_name['POST shipments:shipment_webhook']
+    assert root['parent_id'] is None
+    assert len({span['trace_id'] for span in spans}) == 1
+    assert by_name['shipment.parse']['attributes']['shipment_id'] == 501
+    assert by_name['salla.update_shipment']['attributes']['http.status_code'] == 200
+    assert by_name['salla.update_shipment']['parent_id'] == by_name['shipment.notify']['span_id']
+
+
+@pytest.mark.django_db
+def test_traceparent_continues_remote_trace(client, settings, traces):
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    response = client.get(reverse('shipments:faq'), HTTP_HOST=settings.ALLOWED_HOSTS[0],
+                          HTTP_TRACEPARENT=f'00-{trace_id}-00f067aa0ba902b7-01')
+
+    assert response['X-Correlation-ID'] == trace_id
+    root = traces()[-1]
+    assert (root['trace_id'], root['parent_id']) == (trace_id, '00f067aa0ba902b7')
+
+
+def test_disabled_tracing_is_noop(settings):
+    settings.TRACING = {'ENABLED': False}
+    with tracing.start_trace('job') as root:
+        with tracing.span('child') as child:
+            assert child is tracing.NOOP_SPAN
+        assert root is tracing.NOOP_SPAN
+        assert tracing.get_correlation_id()
+    assert tracing.get_correlation_id() is None
+
+
+def test_bind_context_carries_correlation_id(settings, traces):
+    seen = []
+
+    def work():
+        with tracing.span('background.work'):
+            seen.append(tracing.get_correlation_id())
+
+    with tracing.start_trace('job', correlation_id='job-correlation-1'):
+        thread = threading.Thread(target=tracing.bind_context(work))
+        thread.start()
+        thread.join()
+
+    assert seen == ['job-correlation-1']
+    assert {span['name'] for span in traces()} == {'background.work', 'job'}
+
+
+def test_otlp_encoding():
+    trace = tracing.Trace('4bf92f3577b34da6a3ce929d0e0e4736')
+    span = tracing.Span('salla.update_shipment', trace, kind='client', attributes={'shipment_id': 1, 'ok': True})
+    span.record_exception(RuntimeError('timeout'))
+    span.end()
+
+    encoded = tracing.OTLPHttpExporter('http://collector:4318/v1/traces', 'shipments').encode([span])
+
+    otlp_span = encoded['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert otlp_span['kind'] == 3
+    assert otlp_span['status'] == {'code': 2, 'message': 'RuntimeError: timeout'}
+    assert {'key': 'shipment_id', 'value': {'intValue': '1'}} in otlp_span['attributes']
+    assert {'key': 'ok', 'value': {'boolValue': True}} in otlp_span['attributes']
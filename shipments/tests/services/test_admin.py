@@ -0,0 +1,77 @@
+import pytest
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from shipments.models import MerchantToken, Shipment, ShipmentStatus, StatusRollup
+from shipments.pagination import EstimatedCountPaginator, estimated_count
+
+requires_postgres = pytest.mark.skipif(connection.vendor != 'postgresql', reason='Estimates need Postgres')
+
+
+@pytest.fixture
+def shipments(db):
+    for shipment_id in range(1, 31):
+        shipment = Shipment.objects.create(
+            shipment_id=shipment_id, event='shipment.creating', merchant=123 if shipment_id % 2 else 456,
+            created_at=timezone.now(), shipping_number=f'{shipment_id:06d}012024', tracking_number=f'TRACK{shipment_id}',
+            courier_name='SMSA' if shipment_id % 3 else 'Aramex', packages=[{'name': 'Perfume'}])
+        ShipmentStatus.objects.create(shipment=shipment, status='created')
+        ShipmentStatus.objects.create(shipment=shipment, status='delivered' if shipment_id <= 10 else 'pending')
+    MerchantToken.objects.create(merchant_id=123, access_token='token', refresh_token='refresh',
+                                 expires_at=timezone.now())
+    StatusRollup.objects.create(day=timezone.localdate(), merchant=123, courier_name='Aramex', status='created',
+                                count=10)
+
+
+def test_shipment_changelist(admin_client, shipments, django_assert_max_num_queries):
+    url = reverse('admin:shipments_shipment_changelist')
+    with django_assert_max_num_queries(12) as captured:
+        response = admin_client.get(url)
+    assert response.status_code == 200
+    assert response.context['cl'].result_count == 30
+    shipment_queries = [query['sql'] for query in captured if 'FROM "shipments_shipment"' in query['sql']]
+    # No per-row status lookups, and the JSON details are not loaded.
+    assert not any('shipments_shipmentstatus' in sql or '"packages"' in sql for sql in shipment_queries)
+
+    response = admin_client.get(url, {'current_status': 'delivered', 'courier_name': 'Aramex', 'merchant': '123'})
+    assert {shipment.shipment_id for shipment in response.context['cl'].result_list} == {3, 9}
+
+
+def test_shipment_search_is_exact(admin_client, shipments):
+    url = reverse('admin:shipments_shipment_changelist')
+    assert [s.shipment_id for s in admin_client.get(url, {'q': 'TRACK12'}).context['cl'].result_list] == [12]
+    assert [s.shipment_id for s in admin_client.get(url, {'q': '7'}).context['cl'].result_list] == [7]
+    assert list(admin_client.get(url, {'q': 'TRACK'}).context['cl'].result_list) == []
+
+
+def test_shipment_change_page_shows_statuses(admin_client, shipments):
+    response = admin_client.get(reverse('admin:shipments_shipment_change', args=[1]))
+    assert response.status_code == 200
+    formset = response.context['inline_admin_formsets'][0].formset
+    assert [form.instance.status for form in formset.forms] == ['created', 'delivered']
+
+
+def test_status_changelist(admin_client, shipments):
+    response = admin_client.get(reverse('admin:shipments_shipmentstatus_changelist'), {'q': '5'})
+    assert response.status_code == 200
+    assert [status.status for status in response.context['cl'].result_list] == ['delivered', 'created']
+
+
+def test_paginator_counts_exactly_without_estimate(shipments):
+    paginator = EstimatedCountPaginator(Shipment.objects.order_by('shipment_id'), 10)
+    if connection.vendor != 'postgresql':
+        assert estimated_count(Shipment.objects.all()) is None
+    assert paginator.count == 30
+
+
+@requires_postgres
+def test_paginator_uses_estimate(shipments, monkeypatch):
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE shipments_shipment')
+    assert estimated_count(Shipment.objects.all()) == 30
+    assert estimated_count(Shipment.objects.filter(current_status='delivered')) > 0
+
+    monkeypatch.setattr(EstimatedCountPaginator, 'EXACT_BELOW', 10)
+    Shipment.objects.filter(shipment_id__gt=20).delete()
+    # The statistics are not updated until the next ANALYZE.
+    assert EstimatedCountPaginator(Shipment.objects.order_by('shipment_id'), 10).count == 30
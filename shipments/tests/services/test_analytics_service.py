@@ -0,0 +1,81 @@
+import pytest
+from datetime import timedelta
+from django.utils import timezone
+from shipments.models import Shipment, ShipmentStatus, StatusRollup, DeliveryLatencyRollup
+from shipments.services.analytics_service import (
+    get_rollup_report, histogram_percentiles, latency_bucket, rebuild_rollups, record_status_transition
+)
+
+
+def create_shipment(shipment_id, created_at, merchant=123, courier_name='DHL'):
+    return Shipment.objects.create(
+        shipment_id=shipment_id,
+        event='shipment.creating',
+        merchant=merchant,
+        created_at=created_at,
+        courier_name=courier_name,
+    )
+
+
+def test_histogram_percentiles_within_bucket_error():
+    histogram = {latency_bucket(minutes): 1 for minutes in (60, 120, 240, 480)}
+    percentiles = histogram_percentiles(histogram)
+    assert 7 <= percentiles['p99'] <= 9
+    assert histogram_percentiles({}) == {'p50': None, 'p90': None, 'p99': None}
+
+
+@pytest.mark.django_db
+def test_record_status_transition_updates_rollups():
+    created_at = timezone.now() - timedelta(hours=10)
+    shipment = create_shipment(1, created_at)
+    for status in ('created', 'delivered', 'delivered'):
+        record_status_transition(ShipmentStatus.objects.create(shipment=shipment, status=status))
+
+    day = timezone.localdate()
+    assert StatusRollup.objects.get(day=day, merchant=123, courier_name='DHL', status='created').count == 1
+    assert StatusRollup.objects.get(day=day, merchant=123, courier_name='DHL', status='delivered').count == 2
+    # Only the first delivery contributes to the latency histogram
+    assert DeliveryLatencyRollup.objects.get(day=day, merchant=123).count == 1
+
+    report = get_rollup_report(group_by='courier')
+    assert report['series'][0]['courier'] == 'DHL'
+    assert report['totals']['delivered'] == 1
+    assert 9 <= report['totals']['latency_hours']['p50'] <= 11
+
+
+@pytest.mark.django_db
+def test_rebuild_rollups_matches_incremental():
+    created_at = timezone.now() - timedelta(days=2)
+    for shipment_id in (1, 2):
+        shipment = create_shipment(shipment_id, created_at, courier_name='Aramex')
+        for status in ('created', 'delivered'):
+            record_status_transition(ShipmentStatus.objects.create(shipment=shipment, status=status))
+    incremental = get_rollup_report()
+
+    StatusRollup.objects.all().delete()
+    DeliveryLatencyRollup.objects.all().delete()
+    assert rebuild_rollups() == (2, 1)
+    assert get_rollup_report() == incremental
+
+
+@pytest.mark.django_db
+def test_rebuild_rollups_since(django_assert_max_num_queries):
+    now = timezone.now()
+    old, recent = create_shipment(1, now - timedelta(days=20)), create_shipment(2, now - timedelta(days=1))
+    # Redelivered lately, but its first delivery predates the rebuild.
+    ShipmentStatus.objects.create(shipment=old, status='delivered', date_time=now - timedelta(days=10))
+    ShipmentStatus.objects.create(shipment=old, status='delivered', date_time=now)
+    ShipmentStatus.objects.create(shipment=recent, status='delivered', date_time=now)
+
+    with django_assert_max_num_queries(10) as captured:
+        rebuild_rollups(since=timezone.localdate() - timedelta(days=3))
+
+    assert any('HAVING' in query['sql'] for query in captured)
+    assert list(DeliveryLatencyRollup.objects.values_list('count', flat=True)) == [1]
+    assert StatusRollup.objects.get(status='delivered').count == 2
+
+
+@pytest.mark.django_db
+def test_get_rollup_report_invalid_group_by():
+    with pytest.raises(ValueError):
+        get_rollup_report(group_by='week')
@@ -0,0 +1,82 @@
+import pytest
+from datetime import timedelta
+from django.utils import timezone
+from shipments.models import Shipment, ShipmentArchive, ShipmentStatus
+from shipments.services.archive_service import archive_shipments, get_archived_shipment
+
+
+def create_shipment(shipment_id, statuses, age_days):
+    shipment = Shipment.objects.create(
+        shipment_id=shipment_id,
+        event='shipment.creating',
+        merchant=123,
+        shipping_number=f'{shipment_id:06d}012024',
+        created_at=timezone.now() - timedelta(days=age_days + 1),
+        ship_to={'name': 'Recipient Name', 'city': 'Riyadh'},
+    )
+    for status in statuses:
+        ShipmentStatus.objects.create(
+            shipment=shipment,
+            status=status,
+            date_time=timezone.now() - timedelta(days=age_days),
+        )
+    return shipment
+
+
+@pytest.fixture
+def shipments():
+    create_shipment(1, ['created', 'delivered'], age_days=400)
+    create_shipment(2, ['created', 'cancelled'], age_days=400)
+    create_shipment(3, ['created', 'delivering'], age_days=400)
+    create_shipment(4, ['created', 'delivered'], age_days=10)
+
+
+@pytest.mark.django_db
+def test_archive_shipments_dry_run(shipments):
+    assert archive_shipments(365, dry_run=True) == 2
+    assert Shipment.objects.count() == 4
+    assert not ShipmentArchive.objects.exists()
+
+
+@pytest.mark.django_db
+def test_archive_shipments_table_mode(shipments):
+    assert archive_shipments(365, batch_size=1) == 2
+    assert sorted(Shipment.objects.values_list('shipment_id', flat=True)) == [3, 4]
+    assert not ShipmentStatus.objects.filter(shipment_id__in=[1, 2]).exists()
+
+    record = get_archived_shipment(2)
+    assert record['ship_to'] == {'name': 'Recipient Name', 'city': 'Riyadh'}
+    assert [s['status'] for s in record['statuses']] == ['created', 'cancelled']
+    assert ShipmentArchive.objects.get(shipment_id=2).final_status == 'cancelled'
+    assert get_archived_shipment(3) is None
+
+
+@pytest.mark.django_db
+def test_archive_shipments_replaces_archived_copies(shipments):
+    ShipmentArchive.objects.create(shipment_id=1, final_status='cancelled', payload={'shipment_id': 1})
+    assert archive_shipments(365) == 2
+    assert ShipmentArchive.objects.get(shipment_id=1).final_status == 'delivered'
+    assert get_archived_shipment(1)['statuses'][-1]['status'] == 'delivered'
+
+
+@pytest.mark.django_db
+def test_archive_shipments_ndjson_mode(shipments, tmp_path):
+    assert archive_shipments(365, mode='ndjson', output_dir=str(tmp_path), batch_size=1) == 2
+    assert len(list(tmp_path.iterdir())) == 1
+    assert ShipmentArchive.objects.get(shipment_id=1).payload is None
+    assert get_archived_shipment(1)['statuses'][-1]['status'] == 'delivered'
+    assert get_archived_shipment(2)['shipment_id'] == 2
+
+
+def test_archive_shipments_requires_output_dir_for_ndjson():
+    with pytest.raises(ValueError):
+        archive_shipments(365, mode='ndjson')
+
+
+@pytest.mark.django_db
+def test_failed_batch_is_cut_from_the_segment(shipments, tmp_path, mocker):
+    mocker.patch.object(ShipmentArchive.objects, 'bulk_create', side_effect=RuntimeError('database is down'))
+    with pytest.raises(RuntimeError):
+        archive_shipments(365, mode='ndjson', output_dir=str(tmp_path))
+    assert [segment.stat().st_size for segment in tmp_path.iterdir()] == [0]
+    assert Shipment.objects.count() == 4
@@ -0,0 +1,108 @@
+import json
+import pytest
+import httpx
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import AsyncClient
+from django.urls import include, path, reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from shipments.models import MerchantToken, Shipment, ShipmentStatus
+from shipments.services import salla_service
+from shipments.services.pdf_service import agenerate_pdf_label
+from shipments.services.webhook_service import awebhook_handler
+from shipments.views import ashipment_detail
+
+# URLconf for the tests marked with pytest.mark.urls: the app as usual plus the async detail view.
+urlpatterns = [
+    path('shipments/', include('shipments.urls')),
+    path('async/<int:shipment_id>/shipment_detail/', ashipment_detail),
+]
+
+
+@pytest.fixture
+def salla_requests(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={})
+
+    # A new client per test: the pooled client belongs to the event loop, and each async_to_sync call runs its own.
+    monkeypatch.setattr(salla_service, 'get_async_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return requests
+
+
+@pytest.mark.django_db
+def test_async_webhook_creates_shipment(rf, mocker, salla_requests):
+    send_email = mocker.patch('shipments.services.shipment_service.send_shipment_email')
+    MerchantToken.objects.create(merchant_id=123, access_token='token', refresh_token='refresh',
+                                 expires_at=timezone.now() + timedelta(days=1))
+    payload = {
+        'event': 'shipment.creating',
+        'merchant': 123,
+        'created_at': 'Wed, 13 Oct 2021 07:53:00 GMT',
+        'data': {'id': 1, 'status': 'creating', 'type': 'shipment', 'courier_name': 'DHL',
+                 'ship_from': {'name': 'Sender'}, 'ship_to': {'name': 'Recipient'}},
+    }
+    request = rf.post(reverse('shipments:shipment_webhook'), content_type='application/json', data=payload)
+
+    response = async_to_sync(awebhook_handler)(request)
+
+    assert response.status_code == 201
+    shipment = Shipment.objects.get(shipment_id=1)
+    assert shipment.label['url'].endswith(reverse('shipments:generate_pdf_label', args=[1]))
+    assert list(ShipmentStatus.objects.values_list('status', flat=True)) == ['created']
+    send_email.assert_called_once()
+    assert len(salla_requests) == 1
+    assert salla_requests[0].method == 'PUT'
+    assert salla_requests[0].headers['Authorization'] == 'Bearer token'
+    assert json.loads(salla_requests[0].content)['status'] == 'created'
+
+
+def test_async_webhook_rejects_get(rf):
+    response = async_to_sync(awebhook_handler)(rf.get('/webhook/'))
+    assert response.status_code == 405
+
+
+@pytest.mark.django_db
+def test_async_pdf_label(rf, mocker):
+    Shipment.objects.create(shipment_id=1, shipping_number='123456', ship_from={}, ship_to={})
+    mocker.patch('shipments.services.pdf_service.render_to_string', return_value='<html></html>')
+    mocker.patch('weasyprint.HTML.write_pdf', return_value=b'PDF content')
+
+    response = async_to_sync(agenerate_pdf_label)(rf.get('/'), 1)
+    assert response.status_code == 200
+    assert response['Content-Disposition'] == 'attachment; filename="shipment_label_1.pdf"'
+    assert response.content == b'PDF content'
+
+    response = async_to_sync(agenerate_pdf_label)(rf.get('/'), 999)
+    assert response.status_code == 404
+
+
+def test_middleware_supports_async():
+    # A single sync-only middleware would move every ASGI request off the event loop.
+    sync_only = [name for name in settings.MIDDLEWARE if not getattr(import_string(name), 'async_capable', False)]
+    assert sync_only == []
+
+
+@pytest.mark.django_db
+@pytest.mark.urls('shipments.tests.services.test_async_views')
+def test_async_detail_through_middleware(settings, admin_user):
+    settings.QUERY_BUDGET = {**settings.QUERY_BUDGET, 'HEADERS': True}
+    shipment = Shipment.objects.create(shipment_id=1, shipping_number='123456', type='shipment')
+    ShipmentStatus.objects.create(shipment=shipment, status='created')
+    ShipmentStatus.objects.create(shipment=shipment, status='delivered')
+
+    client = AsyncClient()
+    client.force_login(admin_user)
+    response = async_to_sync(client.get)('/async/1/shipment_detail/')
+
+    assert response.status_code == 200
+    assert response.context['latest_status'].status == 'delivered'
+    assert 'X-Correlation-ID' in response.headers
+    # Queries made by the async ORM in its worker thread are still counted by the middleware: the session, the user,
+    # the shipment and its statuses.
+    assert response['X-DB-Query-Count'] == '4'
@@ -0,0 +1,95 @@
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from django.utils import timezone
+from shipments.models import DeliveryLatencyRollup, Shipment, ShipmentStatus, StatusRollup
+from shipments.services.bulk_status_service import bulk_status_update, read_manifest
+
+
+@pytest.fixture
+def shipments(db):
+    for shipment_id, merchant in ((1, 123), (2, 123), (3, 456)):
+        shipment = Shipment.objects.create(shipment_id=shipment_id, event='shipment.creating', merchant=merchant,
+                                           created_at=timezone.now(), shipping_number=f'{shipment_id:06d}012024',
+                                           tracking_number=f'TRACK{shipment_id}', courier_name='SMSA')
+        ShipmentStatus.objects.create(shipment=shipment, status='created')
+
+
+@pytest.fixture
+def outbound(mocker):
+    return (mocker.patch('shipments.services.bulk_status_service.send_shipment_emails'),
+            mocker.patch('shipments.services.bulk_status_service.bulk_update_salla_api'))
+
+
+def test_bulk_status_update(shipments, outbound, django_assert_max_num_queries):
+    send_emails, update_salla = outbound
+    with django_assert_max_num_queries(20) as captured:
+        result = bulk_status_update([1, 2, 2, 99], 'delivered', notify=False)
+
+    statements = [query['sql'] for query in captured]
+    assert len([sql for sql in statements if sql.startswith('INSERT INTO "shipments_shipmentstatus"')]) == 1
+    assert len([sql for sql in statements if sql.startswith('UPDATE "shipments_shipment"')]) == 1
+
+    assert result == {'updated': 2, 'missing': [99]}
+    assert ShipmentStatus.objects.filter(status='delivered').count() == 2
+    assert dict(Shipment.objects.values_list('shipment_id', 'current_status')) == {
+        1: 'delivered', 2: 'delivered', 3: 'created'}
+    send_emails.assert_not_called()
+    update_salla.assert_not_called()
+
+
+def test_bulk_status_update_folds_analytics(shipments, outbound):
+    bulk_status_update([1, 2, 3], 'delivered')
+    bulk_status_update([1], 'delivered')
+
+    day = timezone.localdate()
+    assert StatusRollup.objects.get(day=day, merchant=123, courier_name='SMSA', status='delivered').count == 3
+    # A shipment delivered twice counts once in the latency histogram.
+    assert sum(DeliveryLatencyRollup.objects.values_list('count', flat=True)) == 3
+
+
+def test_bulk_status_update_notifies_in_batches(shipments, outbound):
+    send_emails, update_salla = outbound
+    bulk_status_update([1, 2], 'cancelled')
+    assert [shipment.shipment_id for shipment in send_emails.call_args.args[0]] == [1, 2]
+    update_salla.assert_not_called()
+
+    bulk_status_update([1, 2], 'returned')
+    assert update_salla.call_args.args[1] == 'returned'
+
+
+def test_bulk_status_update_is_scoped(shipments, outbound):
+    assert bulk_status_update([1, 3], 'returned', merchant=123) == {'updated': 1, 'missing': [3]}
+    assert Shipment.objects.get(shipment_id=3).current_status == 'created'
+
+
+def test_bulk_status_update_rejects_unknown_status(shipments):
+    with pytest.raises(ValueError, match='Unknown status'):
+        bulk_status_update([1], 'lost')
+
+
+def test_read_manifest(shipments):
+    assert read_manifest(['1', '2, extra', '']) == ([1, 2], [])
+    assert read_manifest(['Shipment_ID,weight', '3,1kg']) == ([3], [])
+    assert read_manifest(['courier,tracking_number', 'SMSA,TRACK2', 'SMSA,TRACK9']) == ([2], ['TRACK9'])
+    assert read_manifest(['tracking_number', 'TRACK3'], merchant=123) == ([], ['TRACK3'])
+    with pytest.raises(ValueError):
+        read_manifest(['shipment_id', 'abc'])
+
+
+def test_bulk_endpoint(merchant_client, shipments, outbound):
+    manifest = SimpleUploadedFile('manifest.csv', b'tracking_number\nTRACK2\nTRACK3\n')
+    response = merchant_client.post(reverse('shipments:bulk_update_status'),
+                                    {'status': 'delivered', 'shipment_ids': '1', 'manifest': manifest})
+    assert response.status_code == 200
+    assert response.json() == {'updated': 2, 'missing': [], 'unmatched': ['TRACK3']}
+
+    response = merchant_client.post(reverse('shipments:bulk_update_status'), {'status': 'lost', 'shipment_ids': '1'})
+    assert response.status_code == 400
+
+
+def test_admin_action(admin_client, shipments, outbound):
+    response = admin_client.post(reverse('admin:shipments_shipment_changelist'),
+                                 {'action': 'mark_returned', '_selected_action': [1, 3]}, follow=True)
+    assert response.status_code == 200
+    assert set(Shipment.objects.filter(current_status='returned').values_list('shipment_id', flat=True)) == {1, 3}
@@ -0,0 +1,67 @@
+import csv
+import json
+import pytest
+from shipments.models import Shipment, ShipmentStatus
+from shipments.services.import_service import import_shipments
+
+
+def salla_event(shipment_id, event='shipment.creating', created_at='2024-01-01T10:00:00Z'):
+    return {
+        'event': event,
+        'merchant': 123,
+        'created_at': created_at,
+        'data': {
+            'id': shipment_id,
+            'status': 'creating',
+            'type': 'shipment',
+            'courier_name': 'DHL',
+            'tracking_number': f'TN{shipment_id}',
+            'packages': [{'id': 1, 'weight': 5}],
+            'ship_to': {'name': 'Recipient Name', 'city': 'Riyadh'},
+        }
+    }
+
+
+@pytest.mark.django_db
+def test_import_shipments_ndjson(tmp_path):
+    path = tmp_path / 'export.ndjson'
+    events = [salla_event(1), salla_event(2), salla_event(1, 'shipment.cancelled', '2024-01-02T10:00:00Z')]
+    path.write_text('\n'.join(json.dumps(event) for event in events) + '\n{"event": "broken"}\n')
+
+    stats = import_shipments(str(path), batch_size=2, label_base_url='https://example.com')
+    assert stats['records'] == 4
+    assert stats['shipments'] == 2
+    assert stats['statuses'] == 3
+    assert stats['skipped'] == 1
+
+    shipment = Shipment.objects.get(shipment_id=1)
+    assert shipment.event == 'shipment.cancelled'
+    assert shipment.ship_to == {'name': 'Recipient Name', 'city': 'Riyadh'}
+    assert shipment.label == {'url': 'https://example.com/shipments/generate-pdf-label/1/'}
+    assert len(set(Shipment.objects.values_list('shipping_number', flat=True))) == 2
+    assert list(shipment.statuses.order_by('date_time').values_list('status', flat=True)) == ['created', 'cancelled']
+
+    # Re-importing the same export changes nothing
+    shipping_numbers = dict(Shipment.objects.values_list('shipment_id', 'shipping_number'))
+    stats = import_shipments(str(path), batch_size=2)
+    assert stats['shipments'] == 0
+    assert stats['statuses'] == 0
+    assert dict(Shipment.objects.values_list('shipment_id', 'shipping_number')) == shipping_numbers
+    assert ShipmentStatus.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_import_shipments_csv(tmp_path):
+    path = tmp_path / 'export.csv'
+    with open(path, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['event', 'merchant', 'created_at', 'id', 'courier_name', 'ship_to'])
+        writer.writerow(['shipment.creating', '123', '2024-01-01T10:00:00Z', '7', 'Aramex',
+                         json.dumps({'name': 'Recipient Name'})])
+
+    stats = import_shipments(str(path))
+    assert stats['shipments'] == 1
+    shipment = Shipment.objects.get(shipment_id=7)
+    assert shipment.courier_name == 'Aramex'
+    assert shipment.ship_to == {'name': 'Recipient Name'}
+    assert shipment.statuses.get().status == 'created'
@@ -0,0 +1,87 @@
+import json
+import pytest
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
+from shipment_management import invalidation_bus
+from shipments.models import MerchantToken
+from shipments.services.salla_service import get_access_token, handle_store_authorize
+
+requires_postgres = pytest.mark.skipif(connection.vendor != 'postgresql', reason='LISTEN/NOTIFY needs Postgres')
+
+
+def remote_event(event, **data):
+    return json.dumps({'node': 'other-node', 'event': event, **data})
+
+
+@pytest.fixture
+def received(monkeypatch):
+    events = []
+    monkeypatch.setitem(invalidation_bus._handlers, 'test', [events.append])
+    return events
+
+
+def test_dispatch_runs_handlers_of_other_nodes_only(received):
+    invalidation_bus.dispatch(remote_event('test', value=1))
+    invalidation_bus.dispatch(json.dumps({'node': invalidation_bus.NODE_ID, 'event': 'test'}))
+    invalidation_bus.dispatch('not json')
+    assert received == [{'node': 'other-node', 'event': 'test', 'value': 1}]
+
+
+def test_publish_is_disabled_by_default():
+    assert invalidation_bus.publish('tags', tags=['shipments']) is False
+
+
+def test_remote_invalidation_drops_local_entries(tiered_cache):
+    tiered_cache.set('one', 1, tags=['shipment:1'])
+    tiered_cache.set_local('token', 'secret', tags=['merchant_token:1'])
+    invalidation_bus.dispatch(remote_event('tags', tags=['shipment:1', 'merchant_token:1']))
+    assert tiered_cache.get_local('token') is None
+    # The file cache of the tests is per node, so the shared tier is invalidated too.
+    assert tiered_cache.get('one') is None
+
+
+def test_bus_connection_extends_local_lifetime(tiered_cache, settings):
+    settings.INVALIDATION_BUS = {'LOCAL_TIMEOUT': 120}
+    tiered_cache.set_local('token', 'secret')
+    invalidation_bus.emit('connected', {})
+    assert tiered_cache.local.timeout == 120
+    assert tiered_cache.get_local('token') is None
+    invalidation_bus.emit('disconnected', {})
+    assert tiered_cache.local.timeout == settings.TIERED_CACHE['LOCAL_TIMEOUT']
+
+
+@pytest.mark.django_db
+def test_access_token_is_cached_until_stored_again(django_assert_num_queries, django_capture_on_commit_callbacks):
+    MerchantToken.objects.create(merchant_id=123, access_token='old', refresh_token='refresh',
+                                 expires_at=timezone.now() + timedelta(days=1))
+    assert get_access_token(123) == 'old'
+    with django_assert_num_queries(0):
+        assert get_access_token(123) == 'old'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        handle_store_authorize({'merchant': 123, 'data': {
+            'access_token': 'new', 'refresh_token': 'refresh',
+            'expires': int((timezone.now() + timedelta(days=1)).timestamp()),
+        }})
+    assert get_access_token(123) == 'new'
+
+
+@requires_postgres
+@pytest.mark.django_db(transaction=True)
+def test_listener_receives_notifications(settings, received):
+    settings.INVALIDATION_BUS = {'ENABLED': True, 'CHANNEL': 'shipments_invalidation_test', 'RECONNECT_DELAY': 0.1}
+    listener = invalidation_bus.start_listener()
+    try:
+        assert listener.connected.wait(5)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', ['shipments_invalidation_test', remote_event('test')])
+        # This node's own events are skipped.
+        assert invalidation_bus.publish('test') is True
+        for _ in range(50):
+            if received:
+                break
+            listener._stopping.wait(0.1)
+    finally:
+        invalidation_bus.stop_listener(timeout=5)
+    assert [event['node'] for event in received] == ['other-node']
@@ -0,0 +1,140 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory
+from django.urls import reverse
+from shipments import live
+from shipments.models import Shipment
+from shipments.services.shipment_service import handle_shipment_creation, handle_status_update
+
+
+@pytest.fixture
+def broker(settings, monkeypatch):
+    settings.LIVE_UPDATES = {'ENABLED': True, 'QUEUE_SIZE': 3, 'REPLAY': 5, 'HEARTBEAT': 0.05}
+    broker = live.Broker(queue_size=3, replay=5)
+    monkeypatch.setattr(live, '_broker', broker)
+    return broker
+
+
+def drain(queue):
+    messages = []
+    while not queue.empty():
+        messages.append(queue.get_nowait())
+    return messages
+
+
+def test_broker_delivers_and_replays(broker):
+    async def scenario():
+        queue, missed = broker.subscribe()
+        assert missed == []
+        broker.publish('status', {'shipment_id': 1})
+        broker.publish('status', {'shipment_id': 2})
+        await asyncio.sleep(0)
+        delivered = drain(queue)
+        assert [data['shipment_id'] for _, _, data in delivered] == [1, 2]
+
+        # A client reconnecting after the first event gets the second one again.
+        _, missed = broker.subscribe(delivered[0][0])
+        assert missed == delivered[1:]
+        _, missed = broker.subscribe('unknown-1')
+        assert missed is None
+
+    async_to_sync(scenario)()
+
+
+def test_slow_client_is_reset(broker):
+    async def scenario():
+        queue, _ = broker.subscribe()
+        for shipment_id in range(5):
+            broker.publish('status', {'shipment_id': shipment_id})
+        await asyncio.sleep(0)
+        return drain(queue)
+
+    messages = async_to_sync(scenario)()
+    assert live.RESET in messages
+
+
+@pytest.mark.django_db
+def test_service_announces_after_commit(broker, rf, django_capture_on_commit_callbacks, mocker):
+    mocker.patch('shipments.services.shipment_service.update_salla_api')
+    mocker.patch('shipments.services.shipment_service.send_shipment_email')
+    with django_capture_on_commit_callbacks() as callbacks:
+        shipment = handle_shipment_creation({'shipment_id': 7, 'shipping_number': '000007012024',
+                                             'created_at': '2024-01-01T10:00:00+03:00',
+                                             'ship_from': {'phone': '+966500000000'}}, rf.post('/'))
+        handle_status_update(shipment.shipment_id, 'delivered')
+        assert list(broker._recent) == []
+    for callback in callbacks:
+        callback()
+
+    (_, first, shipment_data), (_, second, status_data) = broker._recent
+    assert (first, second) == ('shipment', 'status')
+    assert shipment_data['url'] == reverse('shipments:shipment_detail', args=[7])
+    assert shipment_data['phone'] == '+966500000000'
+    assert status_data == {'shipment_id': 7, 'merchant': None, 'status': 'delivered'}
+
+
+def test_event_stream_needs_asgi(broker, rf):
+    response = async_to_sync(live.live_events)(rf.get('/'))
+    assert response.status_code == 204
+
+
+def stream_request(user):
+    request = AsyncRequestFactory().get('/')
+
+    async def auser():
+        return user
+
+    request.auser = auser
+    return request
+
+
+def test_event_stream_sends_events(broker):
+    async def scenario():
+        response = await live.live_events(stream_request(SimpleNamespace(is_authenticated=True, is_staff=True)))
+        assert response['Content-Type'] == 'text/event-stream'
+        stream = response.streaming_content
+        chunks = [await anext(stream)]
+        broker.publish('status', {'shipment_id': 1, 'status': 'delivered'})
+        chunks += [await anext(stream), await anext(stream)]
+        await stream.aclose()
+        return chunks
+
+    retry, event, heartbeat = [chunk.decode() for chunk in async_to_sync(scenario)()]
+    assert retry.startswith('retry:')
+    event_id, name, data = event.strip().split('\n')
+    assert event_id.startswith('id: ')
+    assert name == 'event: status'
+    assert json.loads(data[len('data: '):]) == {'shipment_id': 1, 'status': 'delivered'}
+    assert heartbeat == ': ping\n\n'
+    assert len(broker) == 0
+
+
+def test_unread_event_stream_does_not_subscribe(broker):
+    request = stream_request(SimpleNamespace(is_authenticated=True, is_staff=True))
+    response = async_to_sync(live.live_events)(request)
+    assert response.status_code == 200
+    assert len(broker) == 0
+
+
+def test_event_stream_is_scoped_to_merchant(broker):
+    async def scenario():
+        request = stream_request(SimpleNamespace(is_authenticated=True, is_staff=False))
+        request._merchant = 123
+        stream = (await live.live_events(request)).streaming_content
+        await anext(stream)
+        broker.publish('status', {'shipment_id': 1, 'merchant': 456, 'status': 'delivered'})
+        broker.publish('status', {'shipment_id': 2, 'merchant': 123, 'status': 'delivered'})
+        event = await anext(stream)
+        await stream.aclose()
+        return event
+
+    data = async_to_sync(scenario)().decode().strip().split('\n')[-1]
+    assert json.loads(data[len('data: '):])['shipment_id'] == 2
+
+
+def test_event_stream_ignores_anonymous_users(broker):
+    response = async_to_sync(live.live_events)(stream_request(SimpleNamespace(is_authenticated=False)))
+    assert response.status_code == 204
@@ -0,0 +1,109 @@
+import threading
+import time
+import pytest
+from asgiref.sync import async_to_sync
+from django.db import connection
+from shipments.locks import ShipmentLockTimeout, ashipment_lock, shipment_lock
+from shipments.models import Shipment
+from shipments.services.shipment_service import handle_shipment_creation_or_update
+
+
+def contend(shipment_id):
+    """Starts a thread that waits for the lock of a shipment, returns the event it sets once it holds it."""
+    acquired = threading.Event()
+
+    def worker():
+        try:
+            with shipment_lock(shipment_id):
+                acquired.set()
+        finally:
+            connection.close()
+
+    threading.Thread(target=worker, daemon=True).start()
+    return acquired
+
+
+@pytest.mark.django_db(transaction=True)
+def test_same_shipment_waits_for_the_lock():
+    with shipment_lock(1):
+        acquired = contend(1)
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_waiters_give_up(mocker):
+    mocker.patch('shipments.locks.WAIT_TIMEOUT', 0.1)
+    failed = threading.Event()
+
+    def worker():
+        try:
+            with shipment_lock(4):
+                pass
+        except ShipmentLockTimeout:
+            failed.set()
+        finally:
+            connection.close()
+
+    with shipment_lock(4):
+        threading.Thread(target=worker, daemon=True).start()
+        assert failed.wait(5)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_other_shipments_do_not_wait():
+    with shipment_lock(1):
+        assert contend(2).wait(5)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_lock_is_released():
+    async def hold():
+        async with ashipment_lock(3):
+            pass
+
+    async_to_sync(hold)()
+    assert contend(3).wait(5)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_events_of_a_shipment_are_applied_in_order(rf, mocker):
+    mocker.patch('shipments.services.shipment_service.update_salla_api')
+    mocker.patch('shipments.services.shipment_service.send_shipment_email')
+    creation = mocker.patch('shipments.services.shipment_service.handle_shipment_creation',
+                            side_effect=lambda data, request: time.sleep(0.2) or Shipment.objects.create(**data))
+    shipment_data = {'shipment_id': 5, 'shipping_number': '000005012024', 'type': 'shipment'}
+
+    def deliver(status):
+        return handle_shipment_creation_or_update(dict(shipment_data), status, rf.post('/'))
+
+    def deliver_in_thread(status):
+        try:
+            deliver(status)
+        finally:
+            connection.close()
+
+    creating = threading.Thread(target=deliver_in_thread, args=('created',))
+    creating.start()
+    time.sleep(0.05)
+    deliver('cancelled')
+    creating.join()
+
+    creation.assert_called_once()
+    statuses = Shipment.objects.get(shipment_id=5).statuses.order_by('id').values_list('status', flat=True)
+    assert list(statuses) == ['created', 'cancelled']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_notifications_are_sent_after_the_lock_is_released(rf, mocker):
+    released = []
+    mocker.patch('shipments.services.shipment_service.send_shipment_email',
+                 side_effect=lambda shipment, status: released.append(contend(shipment.shipment_id).wait(5)))
+    update_salla = mocker.patch('shipments.services.shipment_service.update_salla_api')
+    shipment_data = {'shipment_id': 6, 'shipping_number': '000006012024', 'type': 'shipment'}
+
+    response = handle_shipment_creation_or_update(shipment_data, 'created', rf.post('/'))
+
+    assert response.status_code == 201
+    assert released == [True]
+    update_salla.assert_called_once()
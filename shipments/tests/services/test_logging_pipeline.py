@@ -0,0 +1,83 @@
+import json
+import logging
+import pytest
+from shipment_management.logging_pipeline import JsonFormatter, Payload, QueueListenerHandler, log_payload
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+@pytest.fixture
+def pipeline():
+    target = ListHandler()
+    target.setFormatter(JsonFormatter())
+    target.set_name('test-target')
+    logging._handlers['test-target'] = target
+    handler = QueueListenerHandler(['test-target'])
+    logger = logging.getLogger('shipments.tests.pipeline')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger, handler, target
+    logger.removeHandler(handler)
+    handler.stop()
+    del logging._handlers['test-target']
+
+
+def test_records_formatted_on_listener_thread(pipeline):
+    logger, handler, target = pipeline
+    formatted_on = []
+
+    class Probe:
+        def __str__(self):
+            import threading
+            formatted_on.append(threading.current_thread().name)
+            return 'probe'
+
+    logger.info('Updating status for %s', Probe(), extra={'shipment_id': 42})
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logger.exception('Failed')
+    handler.stop()
+
+    first, second = (json.loads(line) for line in target.lines)
+    assert first['message'] == 'Updating status for probe'
+    assert first['shipment_id'] == 42
+    assert 'ValueError: boom' in second['exception']
+    assert any(thread != 'MainThread' for thread in formatted_on)
+
+
+def test_prepare_keeps_message_unformatted():
+    handler = QueueListenerHandler([])
+    record = logging.LogRecord('shipments', logging.INFO, __file__, 1, 'Shipment %s', (42,), None)
+    prepared = handler.prepare(record)
+    assert (prepared.msg, prepared.args) == ('Shipment %s', (42,))
+
+
+def test_full_queue_drops_records(pipeline):
+    logger, _, _ = pipeline
+    handler = QueueListenerHandler(['test-target'], maxsize=1)
+    handler.listener = object()  # never started, so nothing drains the queue
+    for _ in range(3):
+        handler.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 1, 'message', (), None))
+    assert handler.dropped == 2
+
+
+def test_log_payload_capped_and_sampled(settings, pipeline):
+    logger, handler, target = pipeline
+    settings.LOG_PAYLOADS = {'SAMPLE_RATE': 1.0, 'MAX_CHARS': 20}
+    log_payload(logger, 'Parsing shipment data:', {'data': 'x' * 100})
+    settings.LOG_PAYLOADS = {'SAMPLE_RATE': 0.0}
+    log_payload(logger, 'Parsing shipment data:', {'data': 'y'})
+    handler.stop()
+
+    assert len(target.lines) == 1
+    assert json.loads(target.lines[0])['message'].endswith('... [truncated 92 chars]')
+    assert str(Payload({'a': 1}, 100)) == '{"a": 1}'
@@ -0,0 +1,64 @@
+import json
+import pytest
+from django.http import JsonResponse
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from unittest.mock import patch
+from shipments.metrics import get_registry
+from shipments.services.salla_service import refresh_token
+from shipments.services.webhook_service import webhook_handler
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@patch('shipments.services.webhook_service.handle_app_installed')
+def test_webhook_events_counted_per_type(mock_handle_app_installed, rf):
+    mock_handle_app_installed.return_value = JsonResponse({'message': 'ok'}, status=200)
+    url = reverse('shipments:shipment_webhook')
+    installed = sample('shipments_webhook_events_total', event='app.installed', status='200')
+    unknown = sample('shipments_webhook_events_total', event='other', status='500')
+
+    webhook_handler(rf.post(url, json.dumps({'event': 'app.installed', 'merchant': 1}), content_type='application/json'))
+    with patch('shipments.services.webhook_service.parse_shipment_data', side_effect=ValueError('bad')):
+        with pytest.raises(ValueError):
+            webhook_handler(rf.post(url, json.dumps({'event': 'made.up'}), content_type='application/json'))
+
+    assert sample('shipments_webhook_events_total', event='app.installed', status='200') == installed + 1
+    assert sample('shipments_webhook_events_total', event='other', status='500') == unknown + 1
+    assert sample('shipments_webhook_handler_duration_seconds_count', event='app.installed') >= 1
+
+
+def test_token_refresh_metrics(mocker):
+    merchant_token = mocker.Mock(refresh_token='refresh', merchant_id=1)
+    mocker.patch('requests.post', return_value=mocker.Mock(status_code=400, content='Bad Request'))
+    failures = sample('shipments_salla_token_refreshes_total', outcome='failure')
+    calls = sample('shipments_salla_request_duration_seconds_count', operation='refresh_token', status='400')
+
+    assert refresh_token(merchant_token) is False
+
+    assert sample('shipments_salla_token_refreshes_total', outcome='failure') == failures + 1
+    assert sample('shipments_salla_request_duration_seconds_count', operation='refresh_token', status='400') == calls + 1
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(client, settings):
+    settings.METRICS_TOKEN = 'scrape-secret'
+    host = settings.ALLOWED_HOSTS[0]
+
+    assert client.get('/metrics', HTTP_HOST=host).status_code == 403
+    client.get(reverse('shipments:faq'), HTTP_HOST=host)
+    response = client.get('/metrics', HTTP_HOST=host, HTTP_AUTHORIZATION='Bearer scrape-secret')
+
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain')
+    assert b'shipments_http_request_duration_seconds_bucket{le="0.005",method="GET",status="200",view="shipments:faq"}' \
+        in response.content
+
+
+def test_multiprocess_registry(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    assert get_registry() is not REGISTRY
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR')
+    assert get_registry() is REGISTRY
@@ -8,9 +8,10 @@ from django.conf import settings
 from django.utils import timezone
 from django.utils.timezone import make_aware
 from django.http import JsonResponse
-from shipments.models import MerchantToken
+from shipments.models import MerchantToken, Shipment
+from shipments.services import salla_service
 from shipments.services.salla_service import handle_store_authorize, handle_app_installed, handle_app_uninstalled, \
-    refresh_token, get_access_token, update_salla_api
+    refresh_token, get_access_token, update_salla_api, bulk_update_salla_api
 
 
 @pytest.mark.django_db
@@ -182,3 +183,72 @@ def test_update_salla_api_no_token(mocker):
     mock_update_salla_api.assert_not_called()
     logger_error_mock.assert_called_once()
     logger_error_mock.assert_called_with('Unable to retrieve access token')
+
+
+@pytest.mark.django_db
+def test_bulk_update_salla_api(monkeypatch):
+    import httpx
+    urls = []
+
+    def handler(request):
+        urls.append(str(request.url))
+        return httpx.Response(200, json={})
+
+    monkeypatch.setattr(salla_service, 'new_async_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    MerchantToken.objects.create(merchant_id=123, access_token='token', refresh_token='refresh',
+                                 expires_at=timezone.now() + timedelta(days=1))
+    shipments = [Shipment.objects.create(shipment_id=shipment_id, merchant=123, shipping_number=str(shipment_id))
+                 for shipment_id in (1, 2, 3)]
+
+    bulk_update_salla_api(shipments, 'delivered', concurrency=2)
+
+    assert sorted(urls) == [salla_service.SHIPMENT_URL.format(shipment_id=shipment_id) for shipment_id in (1, 2, 3)]
+
+
+@pytest.mark.django_db
+def test_bulk_update_salla_api_refreshes_token_once(monkeypatch):
+    import httpx
+    requests_sent = []
+
+    def handler(request):
+        requests_sent.append(request)
+        if str(request.url) == salla_service.REFRESH_URL:
+            return httpx.Response(200, json={'access_token': 'new_token',
+                                             'expires': (timezone.now() + timedelta(days=1)).timestamp()})
+        return httpx.Response(200, json={})
+
+    monkeypatch.setattr(salla_service, 'new_async_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    MerchantToken.objects.create(merchant_id=123, access_token='old_token', refresh_token='refresh',
+                                 expires_at=timezone.now() - timedelta(minutes=1))
+    shipments = [Shipment.objects.create(shipment_id=shipment_id, merchant=123, shipping_number=str(shipment_id))
+                 for shipment_id in (1, 2, 3)]
+
+    bulk_update_salla_api(shipments, 'delivered', concurrency=3)
+
+    assert [request.method for request in requests_sent].count('POST') == 1
+    assert {request.headers['Authorization'] for request in requests_sent if request.method == 'PUT'} == {
+        'Bearer new_token'}
+
+
+@pytest.mark.django_db
+def test_bulk_update_salla_api_closes_its_client(monkeypatch):
+    import httpx
+    clients = []
+
+    def new_async_client():
+        clients.append(httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200))))
+        return clients[-1]
+
+    monkeypatch.setattr(salla_service, 'new_async_client', new_async_client)
+    MerchantToken.objects.create(merchant_id=123, access_token='token', refresh_token='refresh',
+                                 expires_at=timezone.now() + timedelta(days=1))
+    shipments = [Shipment.objects.create(shipment_id=shipment_id, merchant=123, shipping_number=str(shipment_id))
+                 for shipment_id in (1, 2)]
+
+    bulk_update_salla_api(shipments, 'delivered')
+    bulk_update_salla_api(shipments, 'returned')
+
+    assert len(clients) == 2
+    assert all(client.is_closed for client in clients)
@@ -0,0 +1,59 @@
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from shipments.models import Shipment, ShipmentStatus
+
+
+@pytest.fixture
+def shipments(db):
+    for shipment_id, merchant in ((1, 123), (2, 123), (3, 456)):
+        shipment = Shipment.objects.create(shipment_id=shipment_id, event='shipment.creating', merchant=merchant,
+                                           created_at=timezone.now(), shipping_number=f'{shipment_id:06d}012024',
+                                           tracking_number=f'TRACK{shipment_id}')
+        ShipmentStatus.objects.create(shipment=shipment, status='created')
+    ShipmentStatus.objects.create(shipment_id=1, status='delivered')
+
+
+def test_home_shows_only_the_merchants_shipments(merchant_client, shipments):
+    response = merchant_client.get(reverse('shipments:home'))
+    assert response.status_code == 200
+    assert response.context['shipment_total'] == 2
+    assert response.context['shipment_delivered'] == 1
+    assert [shipment.shipment_id for shipment in response.context['shipments']] == [2, 1]
+
+
+def test_staff_see_every_merchant(admin_client, shipments):
+    assert admin_client.get(reverse('shipments:home')).context['shipment_total'] == 3
+
+
+def test_search_is_scoped(merchant_client, shipments):
+    response = merchant_client.get(reverse('shipments:search_shipments'), {'q': 'TRACK'})
+    assert sorted(row['shipment_id'] for row in response.json()) == [1, 2]
+
+
+def test_other_merchants_shipment_is_not_found(merchant_client, shipments):
+    assert merchant_client.get(reverse('shipments:shipment_detail', args=[1])).status_code == 200
+    # Answered like a missing shipment, which the not-found handler sends home.
+    response = merchant_client.get(reverse('shipments:shipment_detail', args=[3]))
+    assert response.status_code == 302
+    assert response.url == reverse('shipments:home')
+
+
+def test_user_without_merchant_is_refused(client, django_user_model, shipments):
+    client.force_login(django_user_model.objects.create_user('nobody'))
+    assert client.get(reverse('shipments:home')).status_code == 403
+
+
+def test_anonymous_user_is_sent_to_login(client, shipments):
+    response = client.get(reverse('shipments:home'))
+    assert response.status_code == 302
+
+
+def test_current_status_follows_statuses(shipments):
+    assert Shipment.objects.get(shipment_id=1).current_status == 'delivered'
+    ShipmentStatus.objects.filter(shipment_id=1, status='delivered').delete()
+    assert Shipment.objects.get(shipment_id=1).current_status == 'delivered'
+
+    call_command('sync_current_status')
+    assert Shipment.objects.get(shipment_id=1).current_status == 'created'
@@ -4,7 +4,7 @@ from django.urls import reverse
 from django.http import JsonResponse
 from unittest.mock import patch, Mock, MagicMock
 from shipments.models import Shipment, ShipmentStatus
-from shipments.services.shipment_service import handle_shipment_creation_or_update
+from shipments.services.shipment_service import handle_shipment_creation_or_update, handle_shipment_update
 from shipments.services.webhook_service import webhook_handler
 
 
@@ -131,3 +131,32 @@ def test_handle_shipment_creation_or_update_return_shipment(mock_handle_shipment
     assert mock_handle_status_update.called_once_with(123, 'created')
 
 
+@pytest.fixture
+def stored_shipment(db):
+    return Shipment.objects.create(
+        shipment_id=321, type='return', merchant=456, event='shipment.updated', shipping_number='000001012024',
+        created_at='2024-01-01T10:00:00+03:00', courier_name='Test Courier', ship_to={'address': '456 Avenue'},
+    )
+
+
+def test_identical_shipment_update_writes_nothing(stored_shipment, django_assert_num_queries):
+    shipment_data = {'shipment_id': 321, 'type': 'return', 'merchant': '456', 'event': 'shipment.updated',
+                     'created_at': '2024-01-01T07:00:00+00:00', 'courier_name': 'Test Courier',
+                     'ship_to': {'address': '456 Avenue'}}
+    with patch('shipments.services.shipment_service.invalidate_shipment') as invalidate:
+        with django_assert_num_queries(1):
+            response = handle_shipment_update(shipment_data)
+    assert response.status_code == 200
+    invalidate.assert_not_called()
+
+
+def test_shipment_update_saves_only_changed_fields(stored_shipment, django_assert_num_queries):
+    shipment_data = {'shipment_id': 321, 'courier_name': 'Test Courier', 'ship_to': {'address': '789 Road'}}
+    with patch('shipments.services.shipment_service.invalidate_shipment') as invalidate:
+        with django_assert_num_queries(2) as captured:
+            handle_shipment_update(shipment_data)
+    update = captured.captured_queries[1]['sql']
+    assert 'ship_to' in update
+    assert 'courier_name' not in update
+    invalidate.assert_called_once_with(321, 456)
+    assert Shipment.objects.get(shipment_id=321).ship_to == {'address': '789 Road'}
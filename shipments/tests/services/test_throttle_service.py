@@ -0,0 +1,92 @@
+import json
+import pytest
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from django.utils import timezone
+from shipments.models import MerchantToken, RateLimitBucket
+from shipments.services import throttle_service
+from shipments.services.throttle_service import get_throttle_settings, merchant_wait
+from shipments.services.webhook_service import webhook_handler
+
+
+def admissions(outcome):
+    return REGISTRY.get_sample_value('shipments_webhook_admissions_total', {'outcome': outcome}) or 0
+
+
+@pytest.fixture
+def limits(settings):
+    settings.WEBHOOK_LIMITS = {'RATE': 1.0, 'BURST': 2, 'MAX_IN_FLIGHT': 4}
+    settings.CACHES = {**settings.CACHES, 'limits': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                     'LOCATION': 'webhook-limits'}}
+    return get_throttle_settings()
+
+
+@pytest.fixture
+def merchants(db):
+    for merchant_id in (1, 2, 7, 8):
+        MerchantToken.objects.create(merchant_id=merchant_id, access_token='token', refresh_token='refresh',
+                                     expires_at=timezone.now())
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('backend', ['database', 'cache'])
+def test_merchant_bucket_refills(limits, merchants, backend):
+    config = {**limits, 'BACKEND': backend, 'ALIAS': 'limits'}
+    assert merchant_wait(1, config, now=1000.0) == 0
+    assert merchant_wait(1, config, now=1000.0) == 0
+    assert merchant_wait(1, config, now=1000.5) > 0
+    # Other merchants have their own bucket.
+    assert merchant_wait(2, config, now=1000.5) == 0
+    assert merchant_wait(1, config, now=1003.0) == 0
+
+
+@pytest.mark.django_db
+def test_unknown_merchants_share_a_bucket(limits, merchants):
+    assert merchant_wait(101, limits, now=1000.0) == 0
+    assert merchant_wait(102, limits, now=1000.0) == 0
+    assert merchant_wait('1', limits, now=1000.0) > 0
+    assert merchant_wait(1, limits, now=1000.0) == 0
+    assert set(RateLimitBucket.objects.values_list('key', flat=True)) == {'merchant:unknown', 'merchant:1'}
+
+
+@pytest.mark.django_db
+def test_full_buckets_are_pruned(limits, merchants):
+    merchant_wait(1, limits, now=1000.0)
+    merchant_wait(2, limits, now=1001.0)
+    assert RateLimitBucket.objects.count() == 2
+    merchant_wait(7, limits, now=1004.0)
+    assert set(RateLimitBucket.objects.values_list('key', flat=True)) == {'merchant:7'}
+
+
+def webhook(rf, merchant=7):
+    body = json.dumps({'event': 'app.installed', 'merchant': merchant})
+    return rf.post(reverse('shipments:shipment_webhook'), body, content_type='application/json')
+
+
+@pytest.mark.django_db
+def test_merchant_over_limit_gets_429(limits, merchants, rf, mocker):
+    mocker.patch('shipments.services.webhook_service.handle_app_installed', return_value=mocker.Mock(status_code=200))
+    accepted, limited = admissions('accepted'), admissions('rate_limited')
+
+    statuses = [webhook_handler(webhook(rf)).status_code for _ in range(2)]
+    response = webhook_handler(webhook(rf))
+
+    assert statuses == [200, 200]
+    assert response.status_code == 429
+    assert int(response['Retry-After']) >= 1
+    assert webhook_handler(webhook(rf, merchant=8)).status_code == 200
+    assert admissions('accepted') - accepted == 3
+    assert admissions('rate_limited') - limited == 1
+    assert throttle_service.in_flight.count == 0
+
+
+@pytest.mark.django_db
+def test_overloaded_worker_gets_503(limits, rf, monkeypatch):
+    monkeypatch.setattr(throttle_service.in_flight, 'count', limits['MAX_IN_FLIGHT'])
+    overloaded = admissions('overloaded')
+
+    response = webhook_handler(webhook(rf))
+
+    assert response.status_code == 503
+    assert response['Retry-After'] == str(limits['OVERLOAD_RETRY_AFTER'])
+    assert admissions('overloaded') - overloaded == 1
@@ -0,0 +1,137 @@
+import time
+import pytest
+from asgiref.sync import async_to_sync
+from django.template import Context, Template
+from django.urls import reverse
+from shipment_management.tiered_cache import LocalLRU, TieredCache, _MISSING
+from shipments.cache import ALL_SHIPMENTS, invalidate_all
+from shipments.models import Shipment, ShipmentStatus
+from shipments.services.shipment_service import handle_status_update
+from shipments.tests.conftest import shipment_queries
+
+
+@pytest.fixture
+def cache():
+    cache = TieredCache(key_prefix='test')
+    cache.clear()
+    return cache
+
+
+def test_local_lru_evicts_least_recently_used():
+    lru = LocalLRU(max_entries=2, timeout=60)
+    lru.set('a', 1, ())
+    lru.set('b', 2, ())
+    lru.get('a')
+    lru.set('c', 3, ())
+    assert lru.get('b') is _MISSING
+    assert (lru.get('a'), lru.get('c')) == (1, 3)
+
+
+def test_local_lru_expires_entries():
+    lru = LocalLRU(max_entries=10, timeout=0.01)
+    lru.set('a', 1, ())
+    time.sleep(0.02)
+    assert lru.get('a') is _MISSING
+    assert len(lru) == 0
+
+
+def test_invalidating_a_tag_drops_only_its_entries(cache):
+    cache.set('one', 1, tags=['shipment:1'])
+    cache.set('two', 2, tags=['shipment:2'])
+    cache.invalidate_tags('shipment:1')
+    assert cache.get('one') is None
+    assert cache.get('two') == 2
+
+
+def test_invalidation_reaches_other_processes(cache):
+    # A second instance shares the cache alias but not the local tier, like another worker process.
+    other = TieredCache(key_prefix='test', local_timeout=0)
+    cache.set('one', 1, tags=['shipment:1'])
+    assert other.get('one') == 1
+    cache.invalidate_tags('shipment:1')
+    assert other.get('one') is None
+
+
+def test_get_or_set_computes_once(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return 'value'
+
+    assert cache.get_or_set('key', compute, tags=['shipments']) == 'value'
+    assert cache.get_or_set('key', compute, tags=['shipments']) == 'value'
+    assert len(calls) == 1
+
+
+def test_value_computed_during_invalidation_is_not_served(cache):
+    # The tag is invalidated while the value is computed from data that is already out of date.
+    other = TieredCache(key_prefix='test', local_timeout=0)
+    cache.get_or_set('key', lambda: other.invalidate_tags('shipments') or 'stale', tags=['shipments'])
+    assert other.get('key') is None
+
+
+def test_disabled_cache_always_computes(cache):
+    cache.enabled = False
+    cache.set('key', 'value')
+    assert cache.get('key') is None
+    assert cache.get_or_set('key', lambda: 'computed') == 'computed'
+
+
+class UnwritableCache:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise PermissionError(13, 'Permission denied', '/app/cache')
+        return fail
+
+
+def test_shared_tier_errors_fail_open(cache, monkeypatch, caplog):
+    monkeypatch.setattr(TieredCache, 'shared', property(lambda self: UnwritableCache()))
+    assert cache.get_or_set('key', lambda: 'computed', tags=['shipments']) == 'computed'
+    assert async_to_sync(cache.aget_or_set)('akey', _acompute, tags=['shipments']) == 'computed'
+    assert cache.get('missing') is None
+    # Validators never repeat while the shared tier is down, so no stale page is answered 304.
+    assert cache.tag_versions('shipments') != cache.tag_versions('shipments')
+    cache.invalidate_tags('shipments')
+    cache.delete('key')
+    assert 'Permission denied' in caplog.text
+
+
+async def _acompute():
+    return 'computed'
+
+
+@pytest.mark.django_db
+def test_status_update_invalidates_detail_and_home(admin_client, django_capture_on_commit_callbacks,
+                                                   django_assert_max_num_queries, mocker):
+    mocker.patch('shipments.services.shipment_service.update_salla_api')
+    mocker.patch('shipments.services.shipment_service.send_shipment_email')
+    shipment = Shipment.objects.create(shipment_id=1, shipping_number='123456', type='shipment')
+    ShipmentStatus.objects.create(shipment=shipment, status='created')
+    detail_url = reverse('shipments:shipment_detail', args=[1])
+
+    assert admin_client.get(detail_url).context['latest_status'].status == 'created'
+    assert admin_client.get(reverse('shipments:home')).context['shipment_delivered'] == 0
+    with django_assert_max_num_queries(2) as captured:
+        admin_client.get(detail_url)
+    assert shipment_queries(captured) == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        handle_status_update(1, 'delivered')
+
+    assert admin_client.get(detail_url).context['latest_status'].status == 'delivered'
+    assert admin_client.get(reverse('shipments:home')).context['shipment_delivered'] == 1
+
+
+@pytest.mark.django_db
+def test_cachedfragment_renders_until_invalidated(tiered_cache, django_capture_on_commit_callbacks):
+    template = Template("{% load shipment_cache %}{% cachedfragment 'test' 'shipments' %}{{ value }}"
+                        "{% endcachedfragment %}")
+    assert template.render(Context({'value': 'first'})) == 'first'
+    assert template.render(Context({'value': 'second'})) == 'first'
+    tiered_cache.invalidate_tags(ALL_SHIPMENTS)
+    assert template.render(Context({'value': 'third'})) == 'third'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        invalidate_all()
+    assert template.render(Context({'value': 'fourth'})) == 'fourth'
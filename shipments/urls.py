@@ -1,25 +1,37 @@
 # shipments/urls.py
+from django.conf import settings
 from django.urls import path, re_path
 from django.shortcuts import redirect  # Add this import
 from . import views
-from .services.webhook_service import webhook_handler
-from .services.pdf_service import generate_pdf_label
+from .live import live_events
+from .services.webhook_service import awebhook_handler, webhook_handler
+from .services.pdf_service import agenerate_pdf_label, generate_pdf_label
 from django.views.decorators.csrf import csrf_exempt
 
 app_name = 'shipments'
 
+# Under ASGI, the webhook, label and detail views can be served by their async versions (settings.ASYNC_VIEWS).
+if settings.ASYNC_VIEWS['ENABLED']:
+    webhook_view, pdf_label_view, detail_view = awebhook_handler, agenerate_pdf_label, views.ashipment_detail
+else:
+    webhook_view, pdf_label_view, detail_view = webhook_handler, generate_pdf_label, views.shipment_detail
+
 urlpatterns = [
     path('home/', views.home, name='home'),
+    path('home/events/', live_events, name='live_events'),
+    path('home/search/', views.search_shipments, name='search_shipments'),
     path('privacy_policy/', views.privacy, name='privacy_policy'),
     path('faq/', views.faq, name='faq'),
-    path('webhook/', webhook_handler, name='shipment_webhook'),
+    path('webhook/', webhook_view, name='shipment_webhook'),
     path('send-test-email/', views.send_test_email_view, name='send_test_email'),
-    path('generate-pdf-label/<int:shipment_id>/', generate_pdf_label, name='generate_pdf_label'),
-    path('<int:shipment_id>/shipment_detail/', views.shipment_detail, name='shipment_detail'),
+    path('generate-pdf-label/<int:shipment_id>/', pdf_label_view, name='generate_pdf_label'),
+    path('<int:shipment_id>/shipment_detail/', detail_view, name='shipment_detail'),
     path('<int:shipment_id>/update/', views.update_shipment_details, name='shipment_update'),
     path('<int:shipment_id>/status/', views.update_status, name='update_status'),
+    path('status/bulk/', views.bulk_update_status, name='bulk_update_status'),
     path('<int:shipment_id>/delete/', views.shipment_delete, name='shipment_delete'),
-    #path('search_shipments/', views.search_shipments, name='search-shipments'),
+    path('analytics/', views.analytics_data, name='analytics_data'),
+    path('<int:shipment_id>/archive/', views.archived_shipment, name='archived_shipment'),
 
 
 
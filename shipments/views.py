@@ -1,10 +1,22 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import get_object_or_404, redirect, render
+from .cache import BULK, aget_shipment_detail, get_shipment_detail, invalidate_shipment
+from .live import get_live_settings
+from .conditional import adetail_validators, conditional, detail_validators, home_validators
 from .forms import ShipmentForm, ShipmentStatusForm
 from .models import Shipment, ShipmentStatus
+from .scoping import (ALL_MERCHANTS, aget_request_merchant, check_merchant, get_request_merchant, scope_key,
+                      scope_shipments, scope_tag)
 from .services import update_salla_api, handle_status_update, handle_shipment_update, send_shipment_email
+from .services.analytics_service import get_rollup_report
+from .services.archive_service import get_archived_shipment
+from .services.bulk_status_service import bulk_status_update, parse_shipment_ids, read_manifest
 from django.conf import settings
-from django.http import HttpResponse, JsonResponse
+from django.db.models import Count
+from django.http import Http404, HttpResponse, JsonResponse
 from django.template.loader import render_to_string
+from django.utils.dateparse import parse_date
+from shipment_management.tiered_cache import get_tiered_cache
 import json
 
 import logging
@@ -32,31 +44,33 @@ def send_test_email_view(request):
         return HttpResponse(f'Error: {str(e)}', status=500)
 
 
+@login_required
+@conditional(home_validators)
 def home(request):
+    merchant = get_request_merchant(request)
     try:
-        shipments = Shipment.objects.all()
-        shipment_total = shipments.count()
-        shipment_delivered = 0
-        shipment_returnd = 0 
-        shipment_canceled = 0
-        if (shipments.count == 0):
-          return HttpResponse("There is no shipments")
-        else:
-         for ship in shipments:
-         
-         
-      
-
-         
-          if ship.statuses.last().status== 'delivered':
-           shipment_delivered+=1
-          elif ship.statuses.last().status== 'cancelled':
-            shipment_canceled+=1
-          elif ship.statuses.last().status== 'returned':
-           shipment_returnd+=1
-
-               
-        return render(request, 'home.html',{'shipments':shipments ,'shipment_total':shipment_total, 'shipment_delivered':shipment_delivered, 'shipment_canceled':shipment_canceled})
+        # Users see their merchant's shipments only. The counters and the table read the (merchant, current_status)
+        # and (merchant, created_at) indexes, so the page costs the same number of queries however many shipments
+        # there are. Both are cached per merchant until one of its shipments changes: the counters here, the table as
+        # a fragment in the template.
+        shipments = scope_shipments(Shipment.objects.order_by('-created_at'), merchant)
+        status_counts = get_tiered_cache().get_or_set(
+            f'home:status_counts:{scope_key(merchant)}',
+            lambda: dict(shipments.order_by().values_list('current_status').annotate(total=Count('shipment_id'))),
+            tags=[scope_tag(merchant), BULK],
+        )
+        shipment_total = sum(status_counts.values())
+        shipment_delivered = status_counts.get('delivered', 0)
+        shipment_returnd = status_counts.get('returned', 0)
+        shipment_canceled = status_counts.get('cancelled', 0)
+
+        return render(request, 'home.html', {'shipments': shipments, 'shipment_total': shipment_total,
+                                             'shipment_delivered': shipment_delivered,
+                                             'shipment_returnd': shipment_returnd,
+                                             'shipment_canceled': shipment_canceled,
+                                             'table_cache_key': f'home:table:{scope_key(merchant)}',
+                                             'scope_tag': scope_tag(merchant),
+                                             'live_updates': get_live_settings()['ENABLED']})
     except Exception as e:
         return HttpResponse(f'Error: {str(e)}', status=500)
 
@@ -76,35 +90,77 @@ def faq(request):
         return HttpResponse(f'Error: {str(e)}', status=500)
     
 
-'''def search_shipments(request):
-    
-    if request.method == 'POST':
-        search_str = json.load(request.body).get('searchText')
-        logging.info('Search result %s' %search_str)
-        shipment_seach = Shipment.objects.filter(shipping_numbe__istartswith=search_str, owner = request.user)
-        data = shipment_seach.values()
-        return JsonResponse(list(data), safe=False)'''
+SEARCH_LIMIT = 50
+SEARCH_FIELDS = ('shipment_id', 'shipping_number', 'tracking_number', 'courier_name', 'current_status', 'created_at')
+
 
+@login_required
+def search_shipments(request):
+    """
+    Returns the user's shipments whose shipping or tracking number contains the `q` query parameter, newest first, as
+    JSON.
+    """
+    merchant = get_request_merchant(request)
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse([], safe=False)
+    shipments = scope_shipments(Shipment.search_shipments(query), merchant).order_by('-created_at')
+    return JsonResponse(list(shipments.values(*SEARCH_FIELDS)[:SEARCH_LIMIT]), safe=False)
 
+
+@login_required
+@conditional(detail_validators)
 def shipment_detail(request, shipment_id):
+    merchant = get_request_merchant(request)
     try:
-        shipment = get_object_or_404(Shipment, shipment_id=shipment_id)
-        context = {
-            'shipment': shipment,
-            'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY
-        }
-        return render(request, 'shipment_detail.html', context)
+        shipment, statuses = get_shipment_detail(shipment_id)
+        check_merchant(shipment, merchant)
+        return render(request, 'shipment_detail.html', shipment_detail_context(shipment, statuses))
+    except Http404:
+        raise
+    except Exception as e:
+        return HttpResponse(f'Error: {str(e)}', status=500)
+
+
+@login_required
+@conditional(adetail_validators)
+async def ashipment_detail(request, shipment_id):
+    """
+    Async version of `shipment_detail`, served when settings.ASYNC_VIEWS['ENABLED'] is on under ASGI.
+    """
+    merchant = await aget_request_merchant(request)
+    try:
+        shipment, statuses = await aget_shipment_detail(shipment_id)
+        check_merchant(shipment, merchant)
+        return render(request, 'shipment_detail.html', shipment_detail_context(shipment, statuses))
+    except Http404:
+        raise
     except Exception as e:
         return HttpResponse(f'Error: {str(e)}', status=500)
 
 
+def shipment_detail_context(shipment, statuses):
+    # The status history is loaded by the view, so rendering the template runs no queries and is safe in async views.
+    return {
+        'shipment': shipment,
+        'statuses': statuses,
+        'latest_status': statuses[-1] if statuses else None,
+        'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY
+    }
+
+
+@login_required
 def update_shipment_details(request, shipment_id):
+    merchant = get_request_merchant(request)
     try:
-        shipment = get_object_or_404(Shipment, shipment_id=shipment_id)
+        shipment = get_object_or_404(scope_shipments(Shipment.objects.all(), merchant), shipment_id=shipment_id)
         if request.method == 'POST':
             form = ShipmentForm(request.POST, instance=shipment)
             if form.is_valid():
-                shipment = form.save()
+                if form.has_changed():
+                    shipment = form.save(commit=False)
+                    shipment.save(update_fields=form.changed_data)
+                    invalidate_shipment(shipment.shipment_id, shipment.merchant)
                 #handle_shipment_update(shipment)
                 return redirect('shipment_detail', shipment_id=shipment_id)
         else:
@@ -114,9 +170,11 @@ def update_shipment_details(request, shipment_id):
         return HttpResponse(f'Error: {str(e)}', status=500)
 
 
+@login_required
 def update_status(request, shipment_id):
+    merchant = get_request_merchant(request)
     try:
-        shipment = get_object_or_404(Shipment, shipment_id=shipment_id)
+        shipment = get_object_or_404(scope_shipments(Shipment.objects.all(), merchant), shipment_id=shipment_id)
         if request.method == 'POST':
             form = ShipmentStatusForm(request.POST)
             if form.is_valid():
@@ -131,12 +189,98 @@ def update_status(request, shipment_id):
         
 
 
+@login_required
+def bulk_update_status(request):
+    """
+    Gives many of the user's shipments the same status, e.g. after a courier manifest arrives.
+
+    POST parameters:
+    status (str): The new status.
+    shipment_ids (str, optional): Shipment IDs separated by commas or whitespace.
+    manifest (file, optional): A CSV manifest, see `read_manifest`.
+
+    Returns a JSON object with the number of shipments updated, the IDs that were not found, and the manifest's
+    shipping or tracking numbers that match no shipment.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    merchant = get_request_merchant(request)
+    try:
+        shipment_ids = parse_shipment_ids(request.POST.get('shipment_ids', ''))
+        unmatched = []
+        if 'manifest' in request.FILES:
+            lines = request.FILES['manifest'].read().decode('utf-8-sig').splitlines()
+            manifest_ids, unmatched = read_manifest(lines, merchant)
+            shipment_ids += manifest_ids
+        if not shipment_ids and not unmatched:
+            return JsonResponse({'error': 'No shipments given'}, status=400)
+        result = bulk_status_update(shipment_ids, request.POST.get('status', ''), merchant)
+    except (ValueError, UnicodeDecodeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({**result, 'unmatched': unmatched})
+
+
+@login_required
 def shipment_delete(request, shipment_id):
+    merchant = get_request_merchant(request)
     try:
-        shipment = get_object_or_404(Shipment, shipment_id=shipment_id)
+        shipment = get_object_or_404(scope_shipments(Shipment.objects.all(), merchant), shipment_id=shipment_id)
         if request.method == 'POST':
             shipment.delete()
+            invalidate_shipment(shipment_id, shipment.merchant)
             return redirect('shipment_list')
         return render(request, 'shipment_confirm_delete.html', {'shipment': shipment})
     except Exception as e:
         return HttpResponse(f'Error: {str(e)}', status=500)
+
+
+@login_required
+def analytics_data(request):
+    """
+    Returns delivery analytics for dashboard charts as JSON.
+
+    Query parameters:
+    start, end (YYYY-MM-DD): The date range, defaulting to the last 30 days.
+    merchant (int): Restrict the report to one merchant. Users linked to a merchant always get their merchant's.
+    courier (str): Restrict the report to one courier.
+    group_by (str): One of 'day', 'merchant' or 'courier'.
+    """
+    scope = get_request_merchant(request)
+    try:
+        start = parse_date(request.GET['start']) if request.GET.get('start') else None
+        end = parse_date(request.GET['end']) if request.GET.get('end') else None
+        merchant = int(request.GET['merchant']) if request.GET.get('merchant') else None
+        if scope is not ALL_MERCHANTS:
+            merchant = scope
+        params = {
+            'start': start,
+            'end': end,
+            'merchant': merchant,
+            'courier_name': request.GET.get('courier'),
+            'group_by': request.GET.get('group_by', 'day'),
+        }
+        report = get_tiered_cache().get_or_set(
+            'analytics:' + ':'.join(f'{key}={value}' for key, value in params.items()),
+            lambda: get_rollup_report(**params),
+            tags=[scope_tag(merchant), BULK],
+        )
+        return JsonResponse(report)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@login_required
+def archived_shipment(request, shipment_id):
+    """
+    Returns an archived shipment and its status history as JSON for support lookups.
+    """
+    merchant = get_request_merchant(request)
+    try:
+        record = get_archived_shipment(shipment_id)
+        if record is None or merchant is not ALL_MERCHANTS and record.get('merchant') != merchant:
+            return JsonResponse({'error': 'Archived shipment not found'}, status=404)
+        return JsonResponse(record)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
@@ -0,0 +1,148 @@
+"""
+Start-up warmup for label-rendering workers.
+
+The first label a fresh worker renders pays for compiling the templates, importing WeasyPrint and its pango/cairo
+bindings, loading the system fonts and connecting to the database, which adds several seconds to the first real
+request after every deploy or scale-out. `run_warmup()` does that work up front: from ShipmentsConfig.ready() when
+settings.WARMUP['ENABLED'] is set, or with `manage.py warmup`, e.g. from a container start or readiness hook.
+
+Each step is timed and recorded in the shipments_warmup_duration_seconds histogram. Warmup never raises: a failing
+step is reported and the worker starts cold, and the steps run in a thread that is abandoned once the timeout
+expires.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.template.loader import get_template
+
+from .metrics import WARMUP_DURATION
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'BLOCKING': False,
+    'TIMEOUT': 30,
+    'STEPS': ('templates', 'fonts', 'database', 'label'),
+}
+TEMPLATES = ('shipment_label.html', 'shipment_email.html', 'shipment_detail.html', 'home.html')
+SAMPLE_ADDRESS = {
+    'name': 'Warmup', 'address_line': 'King Fahd Road', 'city': 'Riyadh', 'country': 'SA',
+    'phone': '+966500000000', 'email': 'warmup@example.com',
+}
+
+
+def get_warmup_settings():
+    """
+    Returns the WARMUP settings merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'WARMUP', {})}
+
+
+def warm_templates():
+    # get_template() compiles each template into the cached loader, so requests only render them.
+    for name in TEMPLATES:
+        get_template(name)
+
+
+def warm_fonts():
+    # Importing WeasyPrint loads pango and cairo; the first FontConfiguration makes fontconfig scan the system fonts.
+    from weasyprint.text.fonts import FontConfiguration
+    FontConfiguration()
+
+
+def warm_database():
+    # Connections are per thread, so this warms the driver, DNS, TLS and authentication rather than the connection
+    # a request will use; it is closed again at the end of the warmup thread.
+    connection.ensure_connection()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+def warm_label():
+    from .models import Shipment
+    from .services.pdf_service import render_label_pdf
+
+    shipment = Shipment(shipment_id=0, shipping_number='WARMUP000000', ship_from=SAMPLE_ADDRESS,
+                        ship_to=SAMPLE_ADDRESS, total={'amount': 0, 'currency': 'SAR'},
+                        total_weight={'value': 1, 'units': 'kg'})
+    render_label_pdf(shipment, observe=False)
+
+
+STEPS = {
+    'templates': warm_templates,
+    'fonts': warm_fonts,
+    'database': warm_database,
+    'label': warm_label,
+}
+
+
+def run_warmup(steps=None, timeout=None):
+    """
+    Runs the warmup steps in order, within a time limit.
+
+    Args:
+    steps (iterable, optional): Names from STEPS. Defaults to WARMUP['STEPS'].
+    timeout (float, optional): Seconds to wait for all steps. Defaults to WARMUP['TIMEOUT'].
+
+    Returns:
+    dict: 'ok' (all steps finished without error), 'timed_out', 'total_ms', and per step under 'steps' its
+    'duration_ms' and 'status': 'ok', 'error', 'timeout' (running when the time ran out) or 'skipped' (not started).
+
+    Raises:
+    ValueError: If a step is unknown.
+    """
+    config = get_warmup_settings()
+    steps = list(config['STEPS'] if steps is None else steps)
+    timeout = config['TIMEOUT'] if timeout is None else timeout
+    unknown = set(steps) - set(STEPS)
+    if unknown:
+        raise ValueError(f"Unknown warmup steps: {', '.join(sorted(unknown))}")
+
+    results = {name: {'status': 'skipped', 'duration_ms': None} for name in steps}
+    current = {}
+
+    def worker():
+        try:
+            for name in steps:
+                current['step'], current['start'] = name, time.perf_counter()
+                try:
+                    STEPS[name]()
+                    status = 'ok'
+                except Exception as e:
+                    logger.warning("Warmup step %s failed: %s", name, e)
+                    status = 'error'
+                    results[name]['error'] = str(e)
+                elapsed = time.perf_counter() - current['start']
+                WARMUP_DURATION.labels(name, status).observe(elapsed)
+                results[name].update(status=status, duration_ms=round(elapsed * 1000, 1))
+            current.clear()
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=worker, name='warmup', daemon=True)
+    thread.start()
+    thread.join(timeout)
+    timed_out = thread.is_alive()
+    if timed_out and current.get('step'):
+        results[current['step']].update(status='timeout',
+                                        duration_ms=round((time.perf_counter() - current['start']) * 1000, 1))
+    total_ms = round((time.perf_counter() - start) * 1000, 1)
+    ok = not timed_out and all(result['status'] == 'ok' for result in results.values())
+    logger.info("Warmup %s in %s ms: %s", 'finished' if ok else 'incomplete', total_ms,
+                ', '.join(f"{name}={result['status']} ({result['duration_ms']} ms)" for name, result in results.items()))
+    return {'ok': ok, 'timed_out': timed_out, 'total_ms': total_ms, 'steps': results}
+
+
+def start_warmup():
+    """
+    Runs the warmup as configured by settings.WARMUP: in the calling thread when BLOCKING is set, so that the worker
+    only accepts requests once it is warm, otherwise in a background thread.
+    """
+    if get_warmup_settings()['BLOCKING']:
+        return run_warmup()
+    threading.Thread(target=run_warmup, name='warmup-runner', daemon=True).start()
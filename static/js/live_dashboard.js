@@ -0,0 +1,92 @@
+// Patches the dashboard in place from the server-sent events of shipments.live, instead of reloading it.
+(function () {
+    const script = document.currentScript;
+    const rows = document.querySelector('[data-live-rows]');
+    if (!script || !rows || !window.EventSource) {
+        return;
+    }
+
+    // The colours of the status icons, as in home.html; other statuses are shown without an icon or label.
+    const statusColors = {
+        delivered: '#22C55E',
+        delivering: '#EAB308',
+        pending: '#EAB308',
+        in_progress: '#EAB308',
+        Returned: '#22C55E',
+        cancelled: '#FF4444',
+    };
+    const counted = {delivered: 'delivered', returned: 'returned', cancelled: 'cancelled'};
+
+    function addToCount(name, delta) {
+        document.querySelectorAll(`[data-count="${name}"]`).forEach((element) => {
+            element.textContent = parseInt(element.textContent, 10) + delta;
+        });
+    }
+
+    function statusCell(cell, status) {
+        cell.dataset.status = status;
+        cell.replaceChildren();
+        if (!(status in statusColors)) {
+            return;
+        }
+        const svg = document.createElementNS('http://www.w3.org/2000/svg', 'svg');
+        svg.setAttribute('width', '16');
+        svg.setAttribute('height', '16');
+        svg.setAttribute('fill', statusColors[status]);
+        svg.setAttribute('viewBox', '0 0 16 16');
+        const circle = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
+        circle.setAttribute('cx', '8');
+        circle.setAttribute('cy', '8');
+        circle.setAttribute('r', '8');
+        svg.appendChild(circle);
+        cell.append(svg, ` ${status}`);
+    }
+
+    function link(href, text) {
+        const anchor = document.createElement('a');
+        anchor.href = href;
+        anchor.textContent = text;
+        return anchor;
+    }
+
+    const events = new EventSource(script.dataset.eventsUrl);
+
+    events.addEventListener('shipment', (event) => {
+        const shipment = JSON.parse(event.data);
+        if (rows.querySelector(`tr[data-shipment-id="${shipment.shipment_id}"]`)) {
+            return;
+        }
+        const row = document.createElement('tr');
+        row.dataset.shipmentId = shipment.shipment_id;
+        const cells = [shipment.shipping_number, '', shipment.created_at, '', ''].map((text) => {
+            const cell = document.createElement('td');
+            cell.textContent = text;
+            row.appendChild(cell);
+            return cell;
+        });
+        cells[1].dataset.status = '';
+        cells[3].appendChild(link(`https://wa.me/${shipment.phone}`, shipment.phone));
+        cells[4].appendChild(link(shipment.url, 'View'));
+        rows.appendChild(row);
+        addToCount('total', 1);
+    });
+
+    events.addEventListener('status', (event) => {
+        const update = JSON.parse(event.data);
+        const cell = rows.querySelector(`tr[data-shipment-id="${update.shipment_id}"] [data-status]`);
+        if (!cell) {
+            return;
+        }
+        const previous = cell.dataset.status;
+        if (previous in counted) {
+            addToCount(counted[previous], -1);
+        }
+        if (update.status in counted) {
+            addToCount(counted[update.status], 1);
+        }
+        statusCell(cell, update.status);
+    });
+
+    // Sent when this page missed events, e.g. after a long disconnection.
+    events.addEventListener('reset', () => window.location.reload());
+})();